@@ -19,6 +19,21 @@ ALGORITHM = os.getenv('E_ALGORITHM')
 # and connection information. It is loaded from the environment variable C_STR.
 CONNECTION_STR = os.getenv('C_STR')
 
+# DB_POOL_SIZE is the number of connections each process keeps open to the database and
+# DB_MAX_OVERFLOW the number of extra connections it may open under burst load, which are
+# closed once returned. DB_POOL_TIMEOUT is the number of seconds to wait for a free
+# connection before failing the request.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+# DB_POOL_RECYCLE is the age in seconds after which a connection is replaced, keep it below
+# the idle timeout of the database and of any proxy in between (-1 never replaces them).
+# DB_POOL_PRE_PING checks connections with a round trip before handing them out, so the ones
+# dropped by the database are replaced instead of failing the request.
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'false').lower() in ('1', 'true', 'yes')
+
 # ALLOWED_HOSTS is a list of hosts that are allowed to access the application. This improves
 # security by restricting access to specified hosts.
 # The list includes the GitHub Pages host and the local development host.
@@ -32,3 +47,112 @@ ALLOWED_HOSTS = [
 
 # max file size in mb
 MAX_FILE_SIZE = 100
+
+# max total size in mb of the files sent together to /files/batch
+MAX_BATCH_SIZE = 1000
+
+# STORAGE_BACKEND selects how uploaded files are stored: 'local' keeps one file per upload,
+# 'content_addressed' keeps a single copy of each distinct content shared by every upload of it.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+
+# UPLOAD_CHUNK_SIZE is the number of bytes read from an upload and written to disk at a time,
+# which bounds the memory used by each upload regardless of the size of the file.
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# PDF_WORKERS is the number of worker processes used to run the CPU-bound pypdf work
+# (parsing, page copying, encryption and serialization) outside of the event loop.
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1))
+
+# PDF_QUEUE_DEPTH is the number of PDF jobs allowed to wait for a free worker. Once the
+# queue is full new jobs are rejected instead of piling up behind the running ones.
+PDF_QUEUE_DEPTH = int(os.getenv('PDF_QUEUE_DEPTH', 32))
+
+# PDF_JOB_TIMEOUT is the maximum number of seconds a single PDF job may run.
+PDF_JOB_TIMEOUT = float(os.getenv('PDF_JOB_TIMEOUT', 120))
+
+# MERGE_STREAMING_THRESHOLD is the combined size in mb of the inputs of a merge above which
+# the pages are streamed to the output instead of building the whole document in memory.
+# Streamed merges keep only the pages, so smaller merges still keep outlines and forms.
+MERGE_STREAMING_THRESHOLD = int(os.getenv('MERGE_STREAMING_THRESHOLD', 50))
+
+# MMAP_THRESHOLD is the size in mb above which the input files of the PDF operations are
+# memory mapped instead of read into memory before parsing. Mapped files are read through the
+# page cache of the OS, which concurrent jobs over the same file share. Set it to -1 to always
+# read the files into memory.
+MMAP_THRESHOLD = int(os.getenv('MMAP_THRESHOLD', 1))
+
+# JOB_CONCURRENCY is the number of jobs a single worker process (`python -m backend.worker`)
+# runs at the same time. Run more worker processes to scale beyond one machine.
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', PDF_WORKERS))
+
+# JOB_POLL_INTERVAL is the number of seconds an idle worker waits before polling the queue again.
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+
+# JOB_MAX_ATTEMPTS is the number of times a job is retried when the worker running it dies.
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# JOB_STALE_AFTER is the number of seconds without a heartbeat after which a running job is
+# considered abandoned by its worker and put back in the queue.
+JOB_STALE_AFTER = float(os.getenv('JOB_STALE_AFTER', 60))
+
+# SWEEP_INTERVAL is the number of seconds between two runs of the sweeper of each worker
+# process, which removes the files of expired and cancelled tasks, the rows whose file is gone
+# and the files no row points to. Set it to 0 to disable the sweeper.
+SWEEP_INTERVAL = float(os.getenv('SWEEP_INTERVAL', 300))
+
+# TASK_RETENTION is the number of seconds a task that is not running keeps its files after its
+# last update. Anonymous tasks are removed altogether once they have no files left.
+TASK_RETENTION = float(os.getenv('TASK_RETENTION', 86400))
+
+# SWEEP_GRACE is the age in seconds a file or row must reach before the sweeper removes it for
+# being untracked or orphaned, which leaves alone the uploads and results still being written.
+SWEEP_GRACE = float(os.getenv('SWEEP_GRACE', 3600))
+
+# SWEEP_BATCH_SIZE is the number of rows or files the sweeper removes at once, and
+# SWEEP_BATCH_DELAY the number of seconds it waits between two batches, so a large sweep does
+# not hold the database or the disk away from the jobs for long.
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', 500))
+SWEEP_BATCH_DELAY = float(os.getenv('SWEEP_BATCH_DELAY', 0.1))
+
+# METRICS_DIR is a directory shared by the API and worker processes of a host, where each of
+# them publishes its metrics every METRICS_PUBLISH_INTERVAL seconds so /metrics reports all of
+# them. Without it /metrics only reports the process answering it, and the time of the PDF
+# operations is recorded by the workers.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_INTERVAL', 5))
+
+# ADMIN_EMAILS is a comma separated list of the emails of the accounts allowed to profile the
+# PDF operations (the `X-Profile` header or `profile` query flag of /pdf-utilities), to
+# download the profiles from /tasks/profile and to read the operational endpoints.
+ADMIN_EMAILS = [email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()]
+
+# INTERNAL_TOKEN is a bearer token accepted by the operational endpoints (/internal and
+# /metrics) besides the tokens of the administrators, for the scrapers and probes that cannot
+# sign in. Without it only administrators can read them.
+INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN', '')
+
+# RESULT_CACHE_SIZE is the maximum size in mb of the cache of PDF operation results, and
+# RESULT_CACHE_ENTRIES the maximum number of results it keeps. Set either to 0 to disable it.
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_ENTRIES = int(os.getenv('RESULT_CACHE_ENTRIES', 1000))
+
+# DOCUMENT_CACHE_SIZE is the estimated size in mb of the parsed documents (cross-reference
+# tables, trailers, page counts and page references) each PDF worker process keeps in memory,
+# so operations over the same content skip parsing them again, and DOCUMENT_CACHE_ENTRIES the
+# maximum number of documents it keeps. Set either to 0 to disable it.
+DOCUMENT_CACHE_SIZE = int(os.getenv('DOCUMENT_CACHE_SIZE', 64))
+DOCUMENT_CACHE_ENTRIES = int(os.getenv('DOCUMENT_CACHE_ENTRIES', 256))
+
+# RESULT_RETENTION is the number of seconds the result of a task stays available after its
+# first download, so an interrupted or partial (Range) download can be resumed. A response
+# can be cut off by the client at any point, so results are never removed as they are sent:
+# the sweeper removes them once this time is over.
+RESULT_RETENTION = float(os.getenv('RESULT_RETENTION', 3600))
+
+# USER_CACHE_TTL is the number of seconds an authenticated user is kept in memory, so the
+# requests of a token do not look up its user in the database every time, and
+# USER_CACHE_ENTRIES the maximum number of users kept. Each process has its own cache, so a
+# change made through another process is seen after at most USER_CACHE_TTL seconds. Set
+# either to 0 to disable it.
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+USER_CACHE_ENTRIES = int(os.getenv('USER_CACHE_ENTRIES', 1000))
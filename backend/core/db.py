@@ -1,10 +1,174 @@
-from sqlalchemy import create_engine
+import time
+from typing import Any
+
+from sqlalchemy import URL, Column, Connection, Engine, Table, create_engine, event, exc, inspect, make_url
+from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from sqlalchemy.schema import AddConstraint, CreateColumn
 
+from .services.metrics_service import add_db_time, registry
+from .. import config
 from ..config import CONNECTION_STR
 
+# async driver used for each database when the connection string names a sync one
+ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'postgresql': 'asyncpg',
+    'mysql': 'aiomysql',
+}
+
+pool_wait = registry.histogram(
+    'db_pool_wait_seconds',
+    'Time spent getting a connection from the pool, including opening a new one'
+)
+pool_timeouts = registry.counter(
+    'db_pool_timeouts_total',
+    'Number of times no connection became free within DB_POOL_TIMEOUT'
+)
+statement_time = registry.histogram(
+    'db_statement_seconds',
+    'Time spent running each statement of the async engine'
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    '''Queue pool of the async engine that records how long each checkout waited.'''
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            pool_wait.observe(time.perf_counter() - start)
+
+
+def get_async_url(url: str) -> URL:
+    '''Returns the connection string with its driver replaced by the async driver of the same database.'''
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS or parsed.get_driver_name() == ASYNC_DRIVERS[backend]:
+        return parsed
+    return parsed.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}')
+
+
+def get_pool_options(url: URL) -> dict[str, Any]:
+    # in-memory SQLite databases live in a single connection and keep their own pool
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'poolclass': InstrumentedPool,
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+    }
+
+
 url = CONNECTION_STR
+async_url = get_async_url(url)  # type: ignore
+# the sync engine only creates the schema and fills the lookup tables at startup,
+# requests and jobs go through the async engine
 engine = create_engine(url, echo=False) # type: ignore
 SessionLocal = sessionmaker(autocommit=False,autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+async_engine = create_async_engine(async_url, echo=False, **get_pool_options(async_url))
+# objects stay readable after a commit, reloading expired attributes would need IO the
+# async session cannot do implicitly
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+Base = declarative_base(cls=AsyncAttrs)
+
+
+def upgrade_schema(bind: Engine) -> None:
+    '''
+    Creates the missing tables and brings the existing ones up to the models.
+
+    `create_all` leaves the tables that already exist as they are, a database created by an
+    earlier version would miss the columns added to the models since. Those columns are added
+    here, and the indexes of the models that are missing or whose uniqueness changed are
+    created again. Columns are only ever added, never altered or dropped.
+    '''
+    Base.metadata.create_all(bind=bind)
+
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+
+        for table in Base.metadata.tables.values():
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            indexes = {index['name']: bool(index['unique']) for index in inspector.get_indexes(table.name)}
+
+            for column in table.columns:
+                if column.name not in columns:
+                    __add_column(conn, table, column)
+            for index in table.indexes:
+                if indexes.get(index.name) == bool(index.unique):
+                    continue
+                if index.name in indexes:
+                    index.drop(conn)
+                index.create(conn)
+
+
+def __add_column(conn: Connection, table: Table, column: Column) -> None:
+    compiler = conn.dialect.ddl_compiler(conn.dialect, None)
+    preparer = compiler.preparer
+    definition = str(CreateColumn(column).compile(dialect=conn.dialect))
+    # SQLite cannot add a constraint to an existing table, only a column declaring its reference
+    inline = conn.dialect.name == 'sqlite'
+
+    if inline:
+        for key in column.foreign_keys:
+            definition += (
+                f' REFERENCES {preparer.format_table(key.column.table)} ({preparer.quote(key.column.name)})'
+                f'{compiler.define_constraint_cascades(key.constraint)}'
+            )
+    conn.exec_driver_sql(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}')
+
+    if not inline:
+        for key in column.foreign_keys:
+            conn.execute(AddConstraint(key.constraint))
+    # a unique index in place of the constraint `create_all` declares with the table
+    if column.unique:
+        conn.exec_driver_sql(
+            f'CREATE UNIQUE INDEX {preparer.quote(f"uq_{table.name}_{column.name}")} '
+            f'ON {preparer.format_table(table)} ({preparer.quote(column.name)})'
+        )
+
+
+def __pool_status(name: str) -> float:
+    # the engine swaps its pool for a new one when disposed, always read the current one
+    pool = async_engine.pool
+    return getattr(pool, name)() if isinstance(pool, InstrumentedPool) else 0
+
+
+registry.gauge('db_pool_size', 'Connections the pool keeps open', lambda: __pool_status('size'))
+registry.gauge('db_pool_checked_out', 'Connections currently in use', lambda: __pool_status('checkedout'))
+registry.gauge('db_pool_checked_in', 'Open connections waiting to be used', lambda: __pool_status('checkedin'))
+# the pool counts its overflow from minus the pool size, it only overflows above zero
+registry.gauge('db_pool_overflow', 'Connections open beyond the pool size', lambda: max(0, __pool_status('overflow')))
+
+
+@event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+def __statement_started(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(async_engine.sync_engine, 'after_cursor_execute')
+def __statement_finished(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+    statement_time.observe(elapsed)
+    # counted for the request running it, see `metrics_service.RequestMetricsMiddleware`
+    add_db_time(elapsed)
+
+
+@event.listens_for(async_engine.sync_engine, 'handle_error')
+def __statement_failed(context) -> None:
+    started = context.connection.info.get('statement_started') if context.connection else None
+
+    if started:
+        started.pop()
@@ -1,6 +1,8 @@
 from fastapi import HTTPException
 from fastapi import status
 
+from ..config import MAX_FILE_SIZE
+
 
 class HTTPError(Exception):
     """Base class for all HTTP errors."""
@@ -128,6 +130,22 @@ INVALID_TASK = HTTPException(
     }
 )
 
+RESULT_EXPIRED_ERROR = HTTPException(
+    status_code=status.HTTP_410_GONE,
+    detail='The result of this Task was downloaded and is no longer available.',
+    headers={
+        'X-Error': 'ResultExpired'
+    }
+)
+
+ADMIN_REQUIRED = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail='Only administrators can profile PDF operations, download their profiles or read the operational endpoints.',
+    headers={
+        'X-Error': 'AdminRequired'
+    }
+)
+
 FORBIDDEN_TASK = HTTPException(
     status_code=status.HTTP_403_FORBIDDEN,
     detail="You do not have permission to access this Task.",
@@ -140,10 +158,32 @@ COMPLETED_TASK = HTTPException(
     headers={"X-Error": "TaskAlreadyCompleted"}
 )
 
-# FILE_TOO_LARGE_EXCEPTION = HTTPException(
-#     status_code=status.HTTP_400_BAD_REQUEST,
-#     detail=f"File size is larger than {max_size} MB limit.",
-#     headers={
-#         "X-Error": "FileTooLarge"
-#     }
-# )
+TASK_IN_PROGRESS = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="This Task is already being processed.",
+    headers={"X-Error": "TaskInProgress"}
+)
+
+PDF_ENGINE_BUSY = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail='The server is busy processing other PDF files. Please try again later.',
+    headers={
+        'X-Error': 'PdfEngineBusy'
+    }
+)
+
+PDF_JOB_TIMEOUT = HTTPException(
+    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+    detail='The PDF operation took too long and was aborted.',
+    headers={
+        'X-Error': 'PdfJobTimeout'
+    }
+)
+
+FILE_TOO_LARGE_ERROR = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail=f'file size is larger than {MAX_FILE_SIZE:<1}mb limit',
+    headers={
+        'X-Error': 'FileTooLarge'
+    }
+)
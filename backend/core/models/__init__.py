@@ -1,11 +1,13 @@
 from .user import User
 from .task import Task, TaskStatus, TaskProcess
 from .filemodel import FileModel
+from .job import Job
 
 __all__ = [
     'Task',
     'User',
     'FileModel',
+    'Job',
     'TaskStatus',
     'TaskProcess'
 ]
@@ -2,12 +2,13 @@ import os
 from datetime import datetime
 from typing import Optional, Self, TYPE_CHECKING
 
-from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, func
-from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, String, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .. import errors
 from ..db import Base
-from ..services.storage_service import StorageStrategy
+from ..services.storage_service import StorageStrategy, is_blob
 from ... import config
 
 if TYPE_CHECKING:
@@ -18,19 +19,27 @@ class FileModel(Base):
     __tablename__ = 'files'
     __table_args__ = (
         Index('idx_files_name', 'name', 'extension'),
-        Index('idx_files_path', 'path', unique=True)
+        Index('idx_files_path', 'path'),
+        Index('idx_files_sha256', 'sha256')
     )
+    # the timestamps come back in the INSERT or UPDATE itself, instead of a refresh afterwards
+    __mapper_args__ = {'eager_defaults': True}
 
     pk: Mapped[int] = mapped_column(Integer, name='file_id', primary_key=True)
     name: Mapped[str] = mapped_column(String(250), nullable=False)
     extension: Mapped[str] = mapped_column(String(100), nullable=False)
     path: Mapped[str] = mapped_column(String(500), nullable=False)
     content_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    # taken while the file is written, downloads answer Content-Length and ETag from them
+    size: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     created: Mapped[datetime] = mapped_column(DateTime, default=func.now(), nullable=False)
     updated: Mapped[datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
     task_id: Mapped[Optional[int]] = mapped_column(ForeignKey('tasks.task_id', ondelete='RESTRICT'), nullable=True)
 
-    task: Mapped[Optional['Task']] = relationship(back_populates='files', foreign_keys='FileModel.task_id')
+    # joined by `file_utils.get_filemodel`, the only query that needs it, otherwise only
+    # available when the task is already loaded in the session
+    task: Mapped[Optional['Task']] = relationship(back_populates='files', foreign_keys='FileModel.task_id', lazy='raise_on_sql')
 
     @property
     def full_name(self: Self) -> str:
@@ -44,40 +53,68 @@ class FileModel(Base):
     def absolute_path(self: Self) -> str:
         return self.path
 
-    async def upload(self: Self, db: Session, strategy: StorageStrategy, *, upload_to: str) -> str:
+    async def upload(self: Self, db: AsyncSession, strategy: StorageStrategy, *, upload_to: str, commit: bool = True) -> str:
+        '''
+        Stores the file and adds its row to the session.
+
+        When `commit` is false the row is committed by the caller along with the rest of the
+        operation, which then owns removing the stored file with `delete_stored` if that fails.
+        '''
         path = await strategy.upload(upload_to)
+        self.path = path
+        self.size = strategy.size
+        self.sha256 = strategy.sha256
+        db.add(self)
 
+        if not commit:
+            return path
         try:
-            self.path = path
-            db.add(self)
-            db.commit()
-            db.refresh(self)
+            await db.commit()
             return path
         except Exception as error:
-            await strategy.delete(path)
-            db.rollback()
+            await db.rollback()
+            await self.delete_stored(db, strategy)
             raise ValueError(f"Error uploading the file: {str(error)}")
 
-    async def delete(self: Self, db: Session, strategy: StorageStrategy) -> bool:
+    async def delete(self: Self, db: AsyncSession, strategy: StorageStrategy, *, commit: bool = True) -> bool:
+        '''
+        Deletes the row and its stored file.
+
+        When `commit` is false only the row is deleted in the session. The caller commits it
+        along with the rest of the operation and then removes the file with `delete_stored`,
+        so a failed commit never leaves a row without its file.
+        '''
         if not self.path:
             raise errors.FILE_NOT_FOUND_ERROR
+        if not commit:
+            await db.delete(self)
+            return True
 
         try:
-            deleted = await strategy.delete(self.path)
+            # content addressed files share their path with every row of the same content,
+            # the sweeper removes the blob once no row points to it
+            deleted = is_blob(self.path) or await strategy.delete(self.path)
 
             if deleted:
-                db.delete(self)
-                db.commit()
+                await db.delete(self)
+                await db.commit()
             return deleted
         except Exception:
-            db.rollback()
+            await db.rollback()
             return False
 
-    def update(self: Self, db: Session) -> None:
+    async def delete_stored(self: Self, db: AsyncSession, strategy: StorageStrategy) -> bool:
+        '''Removes the stored file, content addressed blobs are left to the sweeper.'''
+        if not self.path or is_blob(self.path):
+            return False
+        return await strategy.delete(self.path)
+
+    async def update(self: Self, db: AsyncSession, *, commit: bool = True) -> None:
         self.updated = func.now()
         db.add(self)
-        db.commit()
-        db.refresh(self)
+
+        if commit:
+            await db.commit()
 
     def __eq__(self: Self, other) -> bool:
-        return self.pk == other.pk
+        return isinstance(other, FileModel) and self.pk == other.pk
@@ -0,0 +1,37 @@
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Optional, Self
+
+from sqlalchemy import JSON, DateTime, ForeignKey, Index, Integer, String, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from ..db import Base
+
+if TYPE_CHECKING:
+    from . import Task
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('idx_jobs_status', 'status', 'job_id'),
+    )
+
+    pk: Mapped[int] = mapped_column(Integer, name='job_id', primary_key=True)
+    task_id: Mapped[int] = mapped_column(ForeignKey('tasks.task_id', ondelete='CASCADE'), nullable=False, unique=True)
+    process_id: Mapped[int] = mapped_column(ForeignKey('task_process_type.process_id', ondelete='RESTRICT'), nullable=False)
+    params: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
+    status: Mapped[str] = mapped_column(String(50), nullable=False)
+    worker: Mapped[Optional[str]] = mapped_column(String(250), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    created: Mapped[datetime] = mapped_column(DateTime, default=func.now(), nullable=False)
+    heartbeat: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    # loaded by the worker along with what the job needs, see `tasks_service.JOB_LOAD`
+    task: Mapped['Task'] = relationship(foreign_keys='Job.task_id', lazy='raise')
+
+    def __eq__(self: Self, other) -> bool:
+        return isinstance(other, Job) and self.pk == other.pk
+
+    def __str__(self: Self) -> str:
+        return f'Job=(pk={self.pk}, task_id={self.task_id}, status=\"{self.status}\", attempts={self.attempts})'
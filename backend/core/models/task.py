@@ -2,7 +2,8 @@ from datetime import datetime
 from typing import TYPE_CHECKING, Optional, Self
 
 from sqlalchemy import DateTime, ForeignKey, Integer, String, func
-from sqlalchemy.orm import Mapped, mapped_column, relationship, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from ..db import Base
 
@@ -12,6 +13,8 @@ if TYPE_CHECKING:
 
 class Task(Base):
     __tablename__ = "tasks"
+    # the timestamps come back in the INSERT or UPDATE itself, instead of a refresh afterwards
+    __mapper_args__ = {'eager_defaults': True}
 
     pk: Mapped[int] = mapped_column(Integer, name='task_id', primary_key=True)
     created: Mapped[datetime] = mapped_column(DateTime, default=func.now(), nullable=False)
@@ -20,39 +23,54 @@ class Task(Base):
     status_id: Mapped[int] = mapped_column(ForeignKey('task_status.status_id', ondelete='RESTRICT'), nullable=False)
     user_id: Mapped[Optional[int]] = mapped_column(ForeignKey('users.user_id', ondelete='CASCADE'), nullable=True)
     result_id: Mapped[Optional[int]] = mapped_column(ForeignKey('files.file_id', ondelete='SET NULL'), nullable=True, unique=True)
+    # set on the first download, the result can be downloaded again until then
+    result_expires: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # profile of the last run of the task, only when an administrator asked for it
+    profile_id: Mapped[Optional[int]] = mapped_column(ForeignKey('files.file_id', ondelete='SET NULL'), nullable=True, unique=True)
     
-    process: Mapped['TaskProcess'] = relationship(back_populates='tasks', foreign_keys='Task.process_id')
-    status: Mapped['TaskStatus'] = relationship(back_populates='tasks', foreign_keys='Task.status_id')
-    user: Mapped[Optional['User']] = relationship(back_populates='tasks', foreign_keys='Task.user_id')
-    result: Mapped[Optional['FileModel']] = relationship(foreign_keys='Task.result_id')
-    files: Mapped[list['FileModel']] = relationship(back_populates='task', foreign_keys='FileModel.task_id')
-
-    def update(self: Self, db: Session) -> None:
+    # every relationship is loaded explicitly by the query of the task, with the loader options
+    # of `tasks_service` for each use, an access to one that was left out raises
+    process: Mapped['TaskProcess'] = relationship(back_populates='tasks', foreign_keys='Task.process_id', lazy='raise')
+    status: Mapped['TaskStatus'] = relationship(back_populates='tasks', foreign_keys='Task.status_id', lazy='raise')
+    user: Mapped[Optional['User']] = relationship(back_populates='tasks', foreign_keys='Task.user_id', lazy='raise')
+    result: Mapped[Optional['FileModel']] = relationship(foreign_keys='Task.result_id', lazy='raise')
+    profile: Mapped[Optional['FileModel']] = relationship(foreign_keys='Task.profile_id', lazy='raise')
+    files: Mapped[list['FileModel']] = relationship(back_populates='task', foreign_keys='FileModel.task_id', lazy='raise')
+
+    async def update(self: Self, db: AsyncSession, *, commit: bool = True) -> None:
+        '''
+        Marks the task as updated.
+
+        Args:
+            commit (bool): Commits the session. When false the change is only added to it, to be
+                committed along with the rest of the operation.
+        '''
         self.updated = func.now()
         db.add(self)
-        db.commit()
-        db.refresh(self)
+
+        if commit:
+            await db.commit()
 
     def check_ownership(self: Self, user: Optional['User']) -> bool:
-        if not self.user:
+        if self.user_id is None:
             return True
-        if user and self.user == user:
+        if user and self.user_id == user.pk:
             return True
         return False
 
-    def add_file(self: Self, filemodel: 'FileModel', db: Session) -> Self:
+    async def add_file(self: Self, filemodel: 'FileModel', db: AsyncSession) -> Self:
         if self.files:
             self.files.append(filemodel)
         else:
             self.files = [filemodel]
-        self.update(db)
+        await self.update(db)
         return self
 
     def __eq__(self: Self, other) -> bool:
-        return self.pk == other.pk
+        return isinstance(other, Task) and self.pk == other.pk
 
     def __str__(self: Self) -> str:
-        return f'Task=(pk={self.pk}, created=\"{self.created}\", updated=\"{self.updated}\", status=\"{self.status}\")'
+        return f'Task=(pk={self.pk}, created=\"{self.created}\", updated=\"{self.updated}\", status_id={self.status_id})'
 
 
 class TaskStatus(Base):
@@ -64,7 +82,7 @@ class TaskStatus(Base):
     tasks: Mapped[list['Task']] = relationship(back_populates='status')
 
     def __eq__(self: Self, other) -> bool:
-        return self.pk == other.pk
+        return isinstance(other, TaskStatus) and self.pk == other.pk
 
     def __str__(self: Self) -> str:
         return f'{self.name}'
@@ -82,7 +100,7 @@ class TaskProcess(Base):
     tasks: Mapped[list['Task']] = relationship(back_populates='process')
 
     def __eq__(self: Self, other) -> bool:
-        return self.pk == other.pk
+        return isinstance(other, TaskProcess) and self.pk == other.pk
 
     def __str__(self: Self) -> str:
         return f'{self.name}'
@@ -2,7 +2,8 @@ import hashlib
 from typing import Self, TYPE_CHECKING
 
 from sqlalchemy import Boolean, Index, Integer, String
-from sqlalchemy.orm import Mapped, mapped_column, relationship, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from ..db import Base
 
@@ -30,10 +31,9 @@ class User(Base):
         sha256.update(password.encode('utf-8'))
         return self.password == sha256.hexdigest()
 
-    def update(self: Self, db: Session) -> None:
+    async def update(self: Self, db: AsyncSession) -> None:
         db.add(self)
-        db.commit()
-        db.refresh(self)
+        await db.commit()
 
     def __eq__(self: Self, other) -> bool:
-        return self.pk == other.pk
+        return isinstance(other, User) and self.pk == other.pk
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -8,6 +9,7 @@ class FileModelSchema(BaseModel):
     full_name: str
     content_type: str
     path: str
+    size: Optional[int] = None
     created: datetime
     updated: datetime
     is_uploaded: bool
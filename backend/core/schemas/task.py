@@ -1,25 +1,23 @@
-from typing import Optional
+from typing import Annotated, Optional
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, BeforeValidator, Field
 
 
 from .filemodel import FileModelSchema
+from ..services.tasks_service import registry
 
-class TaskSchema(BaseModel):
+
+class StatusSchema(BaseModel):
     pk: int
-    created: datetime
-    updated: datetime
-    status: 'StatusSchema'
-    process: 'TaskProcess'
-    result: Optional['FileModelSchema'] = None
+    name: str
 
     model_config = {
         'from_attributes': True
     }
-    
 
-class StatusSchema(BaseModel):
+
+class TaskProcess(BaseModel):
     pk: int
     name: str
 
@@ -28,10 +26,16 @@ class StatusSchema(BaseModel):
     }
 
 
-class TaskProcess(BaseModel):
+class TaskSchema(BaseModel):
     pk: int
-    name: str
+    created: datetime
+    updated: datetime
+    # built from the ids through the lookup registry, the relationships are never loaded for this
+    status: Annotated[StatusSchema, BeforeValidator(registry.status), Field(validation_alias='status_id')]
+    process: Annotated[TaskProcess, BeforeValidator(registry.process), Field(validation_alias='process_id')]
+    result: Optional['FileModelSchema'] = None
+    result_expires: Optional[datetime] = None
 
     model_config = {
         'from_attributes': True
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,373 @@
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Any, Collection, Optional, Self
+from uuid import uuid4
+
+from .metrics_service import registry
+from .storage_service import _get_hashes_file_name, _make_dirs
+from ...config import (
+    SECRET_KEY,
+    UPLOAD_DIR,
+    DOCUMENT_CACHE_ENTRIES,
+    DOCUMENT_CACHE_SIZE,
+    RESULT_CACHE_ENTRIES,
+    RESULT_CACHE_SIZE,
+    USER_CACHE_ENTRIES,
+    USER_CACHE_TTL,
+)
+
+result_lookups = registry.counter(
+    'result_cache_lookups_total',
+    'Lookups of PDF operation results in the result cache of the job workers, by result (hit or miss)',
+    labelnames=('result',)
+)
+# prefix of the files a result is written to before it is moved into its entry
+_STAGING_PREFIX = '.staged-'
+
+document_lookups = registry.counter(
+    'document_cache_lookups_total',
+    'Lookups of parsed documents in the cache of the PDF worker processes, by result (hit or miss)',
+    labelnames=('result',)
+)
+
+
+class ResultCache:
+    '''
+    LRU cache of PDF operation results, bounded by number of entries and total size.
+
+    Entries are keyed by the content hashes of the inputs, the process and its normalized
+    parameters, so running the same operation over the same content again can reuse the
+    result without touching pypdf. Each entry is stored as `<directory>/<key>/<result name>`;
+    results are hard linked in and out of the cache, so a hit costs no copy and deleting a
+    downloaded result leaves the cached copy alone.
+
+    The index lives in memory but is rebuilt from the directory on start, and entries written
+    by other worker processes are picked up on lookup.
+    '''
+
+    def __init__(self: Self, directory: str, max_bytes: int, max_entries: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self.__size = 0
+        self.__load()
+
+    @property
+    def enabled(self: Self) -> bool:
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    @staticmethod
+    def key(
+            input_hashes: list[Optional[str]],
+            process: str,
+            params: dict[str, Any],
+            secrets: Collection[str] = ()
+    ) -> Optional[str]:
+        '''
+        Builds the cache key of an operation, or returns None if it cannot be cached because
+        the content hash of some input is unknown.
+
+        The parameters named in `secrets`, like passwords, still tell results apart but only
+        enter the key as an HMAC under `SECRET_KEY`: keys are the names of the directories of
+        the cache, and a plain digest of a password can be guessed back from them.
+        '''
+        if not input_hashes or not all(input_hashes):
+            return None
+        params = {name: _seal(value) if name in secrets else value for name, value in params.items()}
+        normalized = json.dumps(
+            {'inputs': input_hashes, 'process': process, 'params': params},
+            sort_keys=True,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def get(self: Self, key: str, upload_to: str) -> Optional[tuple[str, str, str]]:
+        '''
+        Looks up a cached result and links it into `upload_to`.
+
+        Returns:
+            Optional[tuple[str, str, str]]: The path of the linked result, its file name and its
+                content type, or None on a miss.
+        '''
+        entry = self.__lookup(key) if self.enabled else None
+
+        if not entry:
+            self.misses += 1
+            result_lookups.labels('miss').inc()
+            return None
+
+        cached, _ = entry
+        filename = os.path.basename(cached)
+        dir_path = _make_dirs(os.path.join(UPLOAD_DIR, upload_to))
+        filepath = os.path.join(dir_path, _get_hashes_file_name(filename))
+
+        try:
+            _link(cached, filepath)
+        except FileNotFoundError:
+            # evicted by another worker process in the meantime
+            self.misses += 1
+            result_lookups.labels('miss').inc()
+            return None
+
+        self.hits += 1
+        result_lookups.labels('hit').inc()
+        return filepath.replace('\\', '/'), filename, _get_content_type(filename)
+
+    def put(self: Self, key: str, path: str, filename: str) -> None:
+        '''Stores the result at `path` under the given key, evicting old entries if needed.'''
+        if not self.enabled or key in self.__entries:
+            return
+
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return
+
+        dir_path = _make_dirs(os.path.join(self.directory, key))
+        cached = os.path.join(dir_path, filename)
+        # other processes look entries up by listing their directory, the result only shows up
+        # there whole, under its final name
+        staged = os.path.join(dir_path, f'{_STAGING_PREFIX}{uuid4().hex}')
+
+        try:
+            if os.path.exists(cached):
+                # already cached by another worker process, its file may be linked to a live result
+                size = os.path.getsize(cached)
+            else:
+                _link(path, staged)
+                os.replace(staged, cached)
+        except FileNotFoundError:
+            # evicted by another worker process in the meantime
+            return
+        finally:
+            _remove(staged)
+
+        self.__add(key, cached, size)
+        self.__evict()
+
+    def stats(self: Self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.__entries),
+            'bytes': self.__size
+        }
+
+    def __lookup(self: Self, key: str) -> Optional[tuple[str, int]]:
+        entry = self.__entries.get(key)
+
+        if entry and os.path.exists(entry[0]):
+            self.__entries.move_to_end(key)
+            return entry
+        if entry:
+            self.__remove(key, unlink=False)
+
+        # the entry may have been written by another worker process
+        found = _find_entry(os.path.join(self.directory, key))
+        if found:
+            self.__add(key, *found)
+            self.__evict()
+        return found
+
+    def __load(self: Self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        for key in os.listdir(self.directory):
+            found = _find_entry(os.path.join(self.directory, key))
+
+            if found:
+                entries.append((os.path.getmtime(found[0]), key, found))
+
+        for _, key, (path, size) in sorted(entries):
+            self.__add(key, path, size)
+        self.__evict()
+
+    def __add(self: Self, key: str, path: str, size: int) -> None:
+        self.__entries[key] = (path, size)
+        self.__size += size
+
+    def __remove(self: Self, key: str, unlink: bool = True) -> None:
+        path, size = self.__entries.pop(key)
+        self.__size -= size
+
+        if unlink:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def __evict(self: Self) -> None:
+        while self.__entries and (self.__size > self.max_bytes or len(self.__entries) > self.max_entries):
+            self.__remove(next(iter(self.__entries)))
+
+
+class UserCache:
+    '''
+    TTL and LRU cache of the active users, keyed by the subject of their tokens.
+
+    It keeps the column values of each user rather than the object itself, so every request
+    builds its own instance and concurrent requests never share one. Whatever changes a user
+    has to `invalidate` it; other processes see the change once their entry expires.
+    '''
+
+    def __init__(self: Self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+
+    @property
+    def enabled(self: Self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self: Self, subject: str) -> Optional[dict[str, Any]]:
+        '''Returns the column values of the user of the given subject, or None on a miss.'''
+        entry = self.__entries.get(subject)
+
+        if entry and entry[0] > time.monotonic():
+            self.__entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self.__entries[subject]
+        self.misses += 1
+        return None
+
+    def put(self: Self, subject: str, values: dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+
+        self.__entries[subject] = (time.monotonic() + self.ttl, values)
+        self.__entries.move_to_end(subject)
+
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def invalidate(self: Self, *subjects: str) -> None:
+        for subject in subjects:
+            self.__entries.pop(subject, None)
+
+    def stats(self: Self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.__entries)
+        }
+
+
+class DocumentCache:
+    '''
+    LRU cache of parsed document metadata, keyed by the SHA-256 digest of the content and
+    bounded by number of entries and by the estimated size of what they hold.
+
+    Entries are whatever the caller parsed, the cache only keeps them with the size they were
+    put with. It lives in the memory of each process that parses documents, the worker
+    processes of `pdf_engine`, and is never shared between them.
+    '''
+
+    def __init__(self: Self, max_bytes: int, max_entries: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self.__size = 0
+
+    @property
+    def enabled(self: Self) -> bool:
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def get(self: Self, sha256: str) -> Optional[Any]:
+        entry = self.__entries.get(sha256)
+
+        if entry is None:
+            self.misses += 1
+            document_lookups.labels('miss').inc()
+            return None
+
+        self.__entries.move_to_end(sha256)
+        self.hits += 1
+        document_lookups.labels('hit').inc()
+        return entry[0]
+
+    def put(self: Self, sha256: str, value: Any, size: int) -> None:
+        '''Adds or replaces the entry of the given content, the size may have changed since it was added.'''
+        if not self.enabled or size > self.max_bytes:
+            return
+
+        previous = self.__entries.pop(sha256, None)
+
+        if previous:
+            self.__size -= previous[1]
+        self.__entries[sha256] = (value, size)
+        self.__size += size
+
+        while len(self.__entries) > self.max_entries or self.__size > self.max_bytes:
+            _, (_, evicted) = self.__entries.popitem(last=False)
+            self.__size -= evicted
+
+    def stats(self: Self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.__entries),
+            'size': self.__size
+        }
+
+
+def _find_entry(dir_path: str) -> Optional[tuple[str, int]]:
+    if not os.path.isdir(dir_path):
+        return None
+
+    for filename in os.listdir(dir_path):
+        # still being written by a worker process
+        if filename.startswith(_STAGING_PREFIX):
+            continue
+
+        path = os.path.join(dir_path, filename)
+
+        try:
+            return path, os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+    return None
+
+
+def _seal(value: Any) -> str:
+    return hmac.new((SECRET_KEY or '').encode('utf-8'), json.dumps(value).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _link(source: str, target: str) -> None:
+    '''Hard links `source` to `target`, or copies it where links are not supported. `target` must not exist.'''
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        # copying over it would rewrite the file every other link of it points to
+        raise
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _get_content_type(filename: str) -> str:
+    content_type, _ = mimetypes.guess_type(filename)
+    return content_type or 'application/octet-stream'
+
+
+result_cache = ResultCache(os.path.join(UPLOAD_DIR, 'cache'), RESULT_CACHE_SIZE * 1_000_000, RESULT_CACHE_ENTRIES)
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_ENTRIES)
+document_cache = DocumentCache(DOCUMENT_CACHE_SIZE * 1_000_000, DOCUMENT_CACHE_ENTRIES)
@@ -0,0 +1,178 @@
+import asyncio
+import multiprocessing
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Self, TypeVar
+
+from .. import errors
+from .metrics_service import registry
+from .profiling_service import current_profile, run_profiled
+from ... import config
+
+T = TypeVar('T')
+
+
+class JobTimeoutError(Exception):
+    '''Raised inside a worker process when a job runs past its deadline.'''
+
+
+class PdfExecutionEngine:
+    '''
+    Runs CPU-bound pypdf work in a pool of worker processes so it never blocks the event loop.
+
+    Jobs are plain module level functions (they must be picklable) that receive file paths,
+    do all the parsing and serialization in the worker and hand back only the output path.
+    What a job records in the metrics of its worker comes back with its result and is added
+    to the metrics of this process. Jobs started inside `profiling_service.profiling` run
+    under the profiler, and their profile comes back the same way.
+    At most `max_workers + max_queue` jobs are admitted at the same time, anything beyond
+    that is rejected right away. A job is a `submit` or a whole `map`, however many of its
+    calls are in flight. Every call is bounded by `timeout` seconds.
+    '''
+
+    def __init__(self: Self, max_workers: int, max_queue: int, timeout: float) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.__executor: Optional[ProcessPoolExecutor] = None
+        self.__pending = 0
+
+    @property
+    def pending(self: Self) -> int:
+        '''Number of admitted jobs, running or waiting for a worker.'''
+        return self.__pending
+
+    @property
+    def full(self: Self) -> bool:
+        '''Whether a new job would be rejected with `PDF_ENGINE_BUSY`.'''
+        return self.__pending >= self.max_workers + self.max_queue
+
+    async def submit(self: Self, fn: Callable[..., T], /, *args: Any) -> T:
+        '''
+        Runs `fn(*args)` in a worker process and waits for its result without blocking the loop.
+
+        Raises:
+            errors.PDF_ENGINE_BUSY: If the queue of pending jobs is full.
+            errors.PDF_JOB_TIMEOUT: If the job does not finish within the configured timeout.
+        '''
+        self.__admit()
+
+        try:
+            future = self.__start(fn, *args)
+        except BaseException:
+            self.__release()
+            raise
+        # the job is over once its call is, even when the caller stops waiting for it
+        future.add_done_callback(lambda _: self.__release())
+        return await self.__result(future)
+
+    async def map(self: Self, fn: Callable[..., T], arguments: Iterable[tuple], /) -> AsyncIterator[T]:
+        '''
+        Runs `fn(*args)` for every tuple of `arguments` across the worker processes and yields
+        the results in the order of `arguments`.
+
+        The calls are the parts of a single job: the job is admitted once and holds a single
+        place in the queue until the iteration ends, while up to `max_workers` of its calls
+        run at the same time, each bounded by the timeout. A call is only started when the
+        caller is ready to take more results, so a slow consumer does not pile up finished
+        results.
+
+        Raises:
+            errors.PDF_ENGINE_BUSY: If the queue of pending jobs is full.
+            errors.PDF_JOB_TIMEOUT: If some call does not finish within the configured timeout.
+        '''
+        self.__admit()
+        window: deque[asyncio.Future] = deque()
+
+        try:
+            for args in arguments:
+                window.append(self.__start(fn, *args))
+
+                if len(window) >= self.max_workers:
+                    yield await self.__result(window.popleft())
+
+            while window:
+                yield await self.__result(window.popleft())
+        finally:
+            for future in window:
+                future.cancel()
+            self.__release()
+
+    def shutdown(self: Self, wait: bool = False) -> None:
+        if self.__executor:
+            self.__executor.shutdown(wait=wait, cancel_futures=True)
+            self.__executor = None
+
+    def __get_executor(self: Self) -> ProcessPoolExecutor:
+        if not self.__executor:
+            self.__executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self.__executor
+
+    def __admit(self: Self) -> None:
+        if self.full:
+            raise errors.PDF_ENGINE_BUSY
+        self.__pending += 1
+
+    def __release(self: Self) -> None:
+        self.__pending -= 1
+
+    def __start(self: Self, fn: Callable[..., T], /, *args: Any) -> asyncio.Future:
+        profiled = current_profile() is not None
+        return asyncio.wrap_future(self.__get_executor().submit(_run_with_deadline, self.timeout, profiled, fn, *args))
+
+    async def __result(self: Self, future: asyncio.Future) -> Any:
+        profile = current_profile()
+
+        try:
+            # the worker enforces the deadline itself, the extra second only covers the
+            # time spent moving the job and its result between processes
+            result, recorded, stats = await asyncio.wait_for(future, self.timeout + 1)
+            registry.merge(recorded)
+        except (TimeoutError, JobTimeoutError) as error:
+            future.cancel()
+
+            if profile:
+                profile.add(getattr(error, 'profile_stats', None))
+            raise errors.PDF_JOB_TIMEOUT
+        except Exception as error:
+            if profile:
+                profile.add(getattr(error, 'profile_stats', None))
+            raise
+
+        if profile:
+            profile.add(stats)
+        return result
+
+
+def _run_with_deadline(timeout: float, profiled: bool, fn: Callable[..., T], *args: Any) -> tuple[T, dict[str, Any], Any]:
+    # SIGALRM is not available on Windows, there the job is only bounded by the wait in `submit`
+    if not hasattr(signal, 'SIGALRM'):
+        return _call(profiled, fn, *args)
+
+    def on_timeout(signum, frame):
+        raise JobTimeoutError(f'job exceeded {timeout} seconds')
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        return _call(profiled, fn, *args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _call(profiled: bool, fn: Callable[..., T], *args: Any) -> tuple[T, dict[str, Any], Any]:
+    if not profiled:
+        return fn(*args), registry.drain(), None
+
+    result, stats = run_profiled(fn, *args)
+    return result, registry.drain(), stats
+
+
+pdf_engine = PdfExecutionEngine(config.PDF_WORKERS, config.PDF_QUEUE_DEPTH, config.PDF_JOB_TIMEOUT)
+registry.gauge('pdf_engine_pending_jobs', 'PDF jobs running or waiting for a worker process', lambda: pdf_engine.pending)
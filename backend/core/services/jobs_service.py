@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from ..models import Job, Task
+from .tasks_service import JOB_LOAD, ProcessTypes, StatusesTypes
+
+
+class JobStatus(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELED = 'canceled'
+
+
+async def enqueue(db: AsyncSession, /, task: Task, process: ProcessTypes, params: dict[str, Any]) -> Job:
+    '''
+    Adds a job for the given task to the queue.
+
+    A task has at most one job, so running a failed task again reuses its previous job. The
+    job is only added to the session, it becomes visible to the workers once the caller commits.
+    '''
+    job = (await db.execute(select(Job).where(Job.task_id == task.pk))).scalar() or Job()
+    job.task = task
+    job.process_id = process.value.pk
+    job.params = params
+    job.status = JobStatus.QUEUED.value
+    job.worker = None
+    job.attempts = 0
+    job.error = None
+    job.heartbeat = None
+    db.add(job)
+    return job
+
+
+async def claim(db: AsyncSession, /, *, worker: str) -> Optional[Job]:
+    '''
+    Claims the oldest queued job for the given worker.
+
+    The candidate row is selected with `FOR UPDATE SKIP LOCKED` so concurrent workers do not
+    wait on each other in databases that support it. The conditional update that follows is
+    what actually guarantees a job is claimed only once, which also covers SQLite where the
+    row lock is not available.
+
+    Returns:
+        Optional[Job]: The claimed job, or None if the queue is empty or another worker won the race.
+    '''
+    candidate: Optional[int] = (await db.execute(
+        select(Job.pk)
+        .where(Job.status == JobStatus.QUEUED.value)
+        .order_by(Job.pk)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )).scalar()
+
+    if candidate is None:
+        await db.rollback()
+        return None
+
+    claimed = await db.execute(
+        update(Job)
+        .where(Job.pk == candidate, Job.status == JobStatus.QUEUED.value)
+        .values(status=JobStatus.RUNNING.value, worker=worker, heartbeat=datetime.now(), attempts=Job.attempts + 1)
+    )
+    await db.commit()
+
+    if claimed.rowcount != 1:  # type: ignore
+        return None
+    return await db.get(Job, candidate)
+
+
+async def get_job(db: AsyncSession, /, *, job_id: int) -> Optional[Job]:
+    '''Retrieves the job with its task, loaded with everything running the job needs.'''
+    return await db.get(Job, job_id, options=[joinedload(Job.task).options(*JOB_LOAD)])
+
+
+async def heartbeat(db: AsyncSession, /, *, worker: str) -> None:
+    '''Tells the other workers that the jobs claimed by the given worker are still running.'''
+    await db.execute(
+        update(Job)
+        .where(Job.worker == worker, Job.status == JobStatus.RUNNING.value)
+        .values(heartbeat=datetime.now())
+    )
+    await db.commit()
+
+
+async def requeue_stale(db: AsyncSession, /, *, older_than: timedelta, max_attempts: int) -> int:
+    '''
+    Puts back in the queue the jobs whose worker died while running them.
+
+    Jobs that already used all their attempts are marked as failed instead, together with
+    their tasks, and forget their secrets as any other failed job.
+
+    Returns:
+        int: The number of jobs that were requeued or failed.
+    '''
+    deadline = datetime.now() - older_than
+    stale = (Job.status == JobStatus.RUNNING.value, Job.heartbeat < deadline)
+
+    failed = (await db.execute(select(Job).where(*stale, Job.attempts >= max_attempts))).scalars().all()
+
+    for job in failed:
+        set_job_failed(job, 'the worker running this job stopped responding')
+    if failed:
+        await db.execute(
+            update(Task)
+            .where(Task.pk.in_([job.task_id for job in failed]))
+            .values(status_id=StatusesTypes.FAILED.value.pk)
+        )
+    requeued = await db.execute(
+        update(Job)
+        .where(*stale, Job.attempts < max_attempts)
+        .values(status=JobStatus.QUEUED.value, worker=None, heartbeat=None)
+    )
+    await db.commit()
+    return len(failed) + requeued.rowcount  # type: ignore
+
+
+async def cancel_queued(db: AsyncSession, /, *, task: Task) -> None:
+    '''
+    Cancels the job of the task if no worker claimed it yet, dropping its parameters with the
+    passwords in them. A running job is cancelled by its worker once it returns. The change
+    is only added to the session, it is committed with the status of the task.
+    '''
+    await db.execute(
+        update(Job)
+        .where(Job.task_id == task.pk, Job.status == JobStatus.QUEUED.value)
+        .values(status=JobStatus.CANCELED.value, params={})
+    )
+
+
+async def count_by_status(db: AsyncSession, /) -> dict[str, int]:
+    '''Counts the jobs in each status, the depth of the queue is the number of queued ones.'''
+    counts = await db.execute(select(Job.status, func.count()).group_by(Job.status))
+    return {status.value: 0 for status in JobStatus} | {status: count for status, count in counts.tuples()}
+
+
+def set_job_completed(job: Job) -> Job:
+    job.status = JobStatus.COMPLETED.value
+    job.error = None
+    return _forget_secrets(job)
+
+
+def set_job_requeued(job: Job) -> Job:
+    '''Puts a claimed job back in the queue, without counting the attempt it could not make.'''
+    job.status = JobStatus.QUEUED.value
+    job.worker = None
+    job.heartbeat = None
+    job.attempts = max(0, job.attempts - 1)
+    return job
+
+
+def set_job_failed(job: Job, error: str) -> Job:
+    job.status = JobStatus.FAILED.value
+    job.error = error[:500]
+    return _forget_secrets(job)
+
+
+def set_job_canceled(job: Job) -> Job:
+    job.status = JobStatus.CANCELED.value
+    return _forget_secrets(job)
+
+
+def _forget_secrets(job: Job) -> Job:
+    # passwords only need to live in the queue until a worker has used them
+    job.params = {key: value for key, value in job.params.items() if key not in SECRET_PARAMS}
+    return job
+
+
+# parameters that never outlive the job, nor reach the result cache in clear
+SECRET_PARAMS = ('password',)
+
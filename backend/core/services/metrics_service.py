@@ -0,0 +1,476 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional, Self, Sequence, override
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# upper bounds in seconds for the histograms of waiting times
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# content type of the text exposition format read by Prometheus
+EXPOSITION_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Labels = tuple[str, ...]
+
+
+class _Metric(ABC):
+    '''
+    Common part of the metrics. A metric built with `labelnames` holds no value itself, every
+    combination of label values passed to `labels` gets a child metric of its own.
+    '''
+    kind = 'untyped'
+
+    def __init__(self: Self, name: str, description: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self.__children: dict[Labels, Self] = {}
+
+    def labels(self: Self, *values: str) -> Self:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'metric {self.name} takes the labels {self.labelnames}')
+
+        with self._lock:
+            child = self.__children.get(values)
+
+            if child is None:
+                child = self.__children[values] = self._child()
+        return child
+
+    def series(self: Self) -> list[tuple[Labels, Self]]:
+        '''Returns every metric that holds a value, with its label values.'''
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return list(self.__children.items())
+
+    def snapshot(self: Self) -> Any:
+        if not self.labelnames:
+            return self._value()
+        return {_format_labels(self.labelnames, values): child._value() for values, child in self.series()}
+
+    def export(self: Self) -> dict[str, Any]:
+        '''Returns the metric as plain values, to be merged into the same metric of another process.'''
+        return {
+            'type': self.kind,
+            'help': self.description,
+            'labelnames': list(self.labelnames),
+            'series': [[list(values), child._state()] for values, child in self.series()],
+        }
+
+    def merge(self: Self, exported: dict[str, Any]) -> None:
+        for values, state in exported['series']:
+            (self.labels(*values) if self.labelnames else self)._add(state)
+
+    def clear(self: Self) -> None:
+        with self._lock:
+            self.__children.clear()
+        self._reset()
+
+    @abstractmethod
+    def _child(self: Self) -> Self:
+        '''A new metric of the same kind for a combination of label values.'''
+        pass
+
+    @abstractmethod
+    def _value(self: Self) -> Any:
+        '''The value as it is reported.'''
+        pass
+
+    def _state(self: Self) -> Any:
+        return self._value()
+
+    @abstractmethod
+    def _add(self: Self, state: Any) -> None:
+        '''Adds up the state exported by the same metric of another process.'''
+        pass
+
+    @abstractmethod
+    def _reset(self: Self) -> None:
+        pass
+
+
+class Counter(_Metric):
+    '''Value that only goes up, like a number of requests or errors.'''
+    kind = 'counter'
+
+    def __init__(self: Self, name: str, description: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, description, labelnames)
+        self.__value = 0.0
+
+    def inc(self: Self, amount: float = 1) -> None:
+        with self._lock:
+            self.__value += amount
+
+    def _child(self: Self) -> 'Counter':
+        return Counter(self.name, self.description)
+
+    def _value(self: Self) -> float:
+        return self.__value
+
+    def _add(self: Self, state: float) -> None:
+        self.inc(state)
+
+    def _reset(self: Self) -> None:
+        with self._lock:
+            self.__value = 0.0
+
+
+class Gauge(_Metric):
+    '''
+    Value that goes up and down. It is either set directly or, when built with a `collect`
+    callable, read from it every time a snapshot is taken. The gauges of several processes
+    add up, like the connections each of them keeps open.
+    '''
+    kind = 'gauge'
+
+    def __init__(
+            self: Self,
+            name: str,
+            description: str,
+            collect: Optional[Callable[[], float]] = None,
+            labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.collect = collect
+        self.__value = 0.0
+
+    def set(self: Self, value: float) -> None:
+        self.__value = value
+
+    def _child(self: Self) -> 'Gauge':
+        return Gauge(self.name, self.description)
+
+    def _value(self: Self) -> float:
+        return self.collect() if self.collect else self.__value
+
+    def _add(self: Self, state: float) -> None:
+        self.__value += state
+
+    def _reset(self: Self) -> None:
+        self.__value = 0.0
+
+
+class Histogram(_Metric):
+    '''Distribution of observed values in cumulative buckets, plus their count and sum.'''
+    kind = 'histogram'
+
+    def __init__(
+            self: Self,
+            name: str,
+            description: str,
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+            labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # one more slot for the values above the last bucket
+        self.__counts = [0] * (len(self.buckets) + 1)
+        self.__sum = 0.0
+
+    def observe(self: Self, value: float) -> None:
+        with self._lock:
+            self.__counts[bisect_left(self.buckets, value)] += 1
+            self.__sum += value
+
+    @contextmanager
+    def time(self: Self) -> Iterator[None]:
+        '''Observes the number of seconds the block takes.'''
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @override
+    def export(self: Self) -> dict[str, Any]:
+        return {**super().export(), 'buckets': list(self.buckets)}
+
+    def _child(self: Self) -> 'Histogram':
+        return Histogram(self.name, self.description, self.buckets)
+
+    def _value(self: Self) -> dict[str, Any]:
+        counts, total = self._state()
+        cumulative, buckets = 0, {}
+
+        for bound, count in zip((*self.buckets, float('inf')), counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': cumulative, 'sum': total}
+
+    def _state(self: Self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self.__counts), self.__sum
+
+    def _add(self: Self, state: Sequence[Any]) -> None:
+        counts, total = state
+
+        with self._lock:
+            for index, count in enumerate(counts[:len(self.__counts)]):
+                self.__counts[index] += count
+            self.__sum += total
+
+    def _reset(self: Self) -> None:
+        with self._lock:
+            self.__counts = [0] * (len(self.buckets) + 1)
+            self.__sum = 0.0
+
+
+Metric = Counter | Gauge | Histogram
+
+
+class MetricsRegistry:
+    '''Keeps the metrics of the process by name, so they can be published together.'''
+
+    def __init__(self: Self) -> None:
+        self.__metrics: dict[str, Metric] = {}
+
+    def counter(self: Self, name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.__register(Counter(name, description, labelnames))  # type: ignore
+
+    def gauge(
+            self: Self,
+            name: str,
+            description: str,
+            collect: Optional[Callable[[], float]] = None,
+            labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        return self.__register(Gauge(name, description, collect, labelnames))  # type: ignore
+
+    def histogram(
+            self: Self,
+            name: str,
+            description: str,
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+            labelnames: Sequence[str] = ()
+    ) -> Histogram:
+        return self.__register(Histogram(name, description, buckets, labelnames))  # type: ignore
+
+    def snapshot(self: Self, prefix: str = '') -> dict[str, Any]:
+        '''Returns the current value of every metric whose name starts with `prefix`.'''
+        return {name: metric.snapshot() for name, metric in self.__metrics.items() if name.startswith(prefix)}
+
+    def export(self: Self) -> dict[str, dict[str, Any]]:
+        '''Returns every metric as plain values, see `render` and `publish`.'''
+        return {name: metric.export() for name, metric in self.__metrics.items()}
+
+    def drain(self: Self) -> dict[str, dict[str, Any]]:
+        '''
+        Exports the counters and histograms and starts them over, so what a process recorded
+        since the last drain can be merged into another one without counting it twice.
+        '''
+        drained = {}
+
+        for name, metric in self.__metrics.items():
+            if not isinstance(metric, Gauge):
+                drained[name] = metric.export()
+                metric.clear()
+        return drained
+
+    def merge(self: Self, exported: dict[str, dict[str, Any]]) -> None:
+        '''Adds metrics exported by another process to the ones of this process with the same name.'''
+        for name, data in exported.items():
+            metric = self.__metrics.get(name)
+
+            if metric and metric.kind == data['type']:
+                metric.merge(data)
+
+    def __register(self: Self, metric: Metric) -> Metric:
+        if metric.name in self.__metrics:
+            raise ValueError(f'metric {metric.name} is already registered')
+        self.__metrics[metric.name] = metric
+        return metric
+
+
+def render(*exports: dict[str, dict[str, Any]]) -> str:
+    '''
+    Writes metrics exported by one or more processes in the Prometheus text exposition format,
+    adding up the series with the same name and labels.
+    '''
+    merged: dict[str, dict[str, Any]] = {}
+
+    for exported in exports:
+        for name, data in exported.items():
+            target = merged.setdefault(name, {**data, 'series': {}})
+
+            if target['type'] != data['type']:
+                continue
+            for values, state in data['series']:
+                key = tuple(values)
+                target['series'][key] = _add_states(target['series'].get(key), state)
+
+    lines = []
+    for name, data in merged.items():
+        lines.append(f'# HELP {name} {data["help"]}'.replace('\n', ' '))
+        lines.append(f'# TYPE {name} {data["type"]}')
+
+        for values, state in data['series'].items():
+            labels = list(zip(data['labelnames'], values))
+
+            if data['type'] != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(state)}')
+                continue
+
+            counts, total = state
+            cumulative = 0
+            for bound, count in zip((*data['buckets'], float('inf')), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels([*labels, ("le", _number(bound))])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# Each process has its own registry. Processes that share a directory publish their metrics
+# to it as `<pid>.json`, and the one answering a scrape adds the others to its own.
+
+def publish(directory: str, exported: dict[str, dict[str, Any]]) -> None:
+    path = os.path.join(directory, f'{os.getpid()}.json')
+
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(exported, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def published(directory: str, max_age: float) -> list[dict[str, dict[str, Any]]]:
+    '''Reads what the other processes published in the last `max_age` seconds.'''
+    own, now = f'{os.getpid()}.json', time.time()
+    exports = []
+
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        path = os.path.join(directory, name)
+
+        if not name.endswith('.json') or name == own:
+            continue
+        try:
+            if now - os.path.getmtime(path) <= max_age:
+                with open(path) as file:
+                    exports.append(json.load(file))
+        except (OSError, ValueError):
+            # removed by its process or left half written by one that died
+            continue
+    return exports
+
+
+class Publisher:
+    '''Publishes the metrics of the process to `directory` every `interval` seconds while started.'''
+
+    def __init__(self: Self, registry: 'MetricsRegistry', directory: str, interval: float) -> None:
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.__task: Optional[asyncio.Task] = None
+
+    def start(self: Self) -> None:
+        if self.directory and not self.__task:
+            os.makedirs(self.directory, exist_ok=True)
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self: Self) -> None:
+        if not self.__task:
+            return
+        self.__task.cancel()
+        await asyncio.gather(self.__task, return_exceptions=True)
+        self.__task = None
+
+        try:
+            os.remove(os.path.join(self.directory, f'{os.getpid()}.json'))
+        except FileNotFoundError:
+            pass
+
+    async def __run(self: Self) -> None:
+        while True:
+            await asyncio.to_thread(publish, self.directory, self.registry.export())
+            await asyncio.sleep(self.interval)
+
+
+def _add_states(current: Any, state: Any) -> Any:
+    if current is None:
+        return state
+    if isinstance(state, (list, tuple)):
+        counts, total = state
+        return [[a + b for a, b in zip(current[0], counts)], current[1] + total]
+    return current + state
+
+
+def _labels(pairs: Sequence[tuple[str, str]]) -> str:
+    return '{' + _format_labels(*zip(*pairs)) + '}' if pairs else ''
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+request_latency = registry.histogram(
+    'http_request_duration_seconds',
+    'Time to answer a request, until the last byte of the response is sent',
+    labelnames=('method', 'route', 'status')
+)
+request_db_time = registry.histogram(
+    'http_request_db_seconds',
+    'Time spent running database statements while answering a request',
+    labelnames=('method', 'route')
+)
+# seconds the request being answered spent in the database, added to by the engine events of `db`
+_db_seconds: ContextVar[Optional[list[float]]] = ContextVar('db_seconds', default=None)
+
+
+def add_db_time(seconds: float) -> None:
+    spent = _db_seconds.get()
+
+    if spent is not None:
+        spent[0] += seconds
+
+
+class RequestMetricsMiddleware:
+    '''
+    Records the latency of every HTTP request and the time its database statements took, by
+    route template so the paths with ids in them do not make a series each.
+    '''
+
+    def __init__(self: Self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self: Self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        spent = [0.0]
+        token = _db_seconds.set(spent)
+        start = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _db_seconds.reset(token)
+            # the router leaves the matched route in the scope
+            route = getattr(scope.get('route'), 'path', 'other')
+            request_latency.labels(scope['method'], route, str(status)).observe(elapsed)
+            request_db_time.labels(scope['method'], route).observe(spent[0])
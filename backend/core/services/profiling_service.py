@@ -0,0 +1,91 @@
+import cProfile
+import os
+import pstats
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional, Self, TypeVar
+
+from .storage_service import StoredFile, _get_hashes_file_name, _make_dirs
+from ...config import UPLOAD_DIR
+
+T = TypeVar('T')
+
+# raw `cProfile` statistics, what `pstats` reads from and writes to a .prof file
+ProfileStats = dict[tuple, tuple]
+
+
+class JobProfile:
+    '''
+    Deterministic (`cProfile`) profile of a job, built from the profiles of every call the job
+    hands to the worker processes of `pdf_engine`: parsing, page copying, encryption,
+    `PdfWriter.write` and the storage code writing the result. A split across several
+    processes adds up the profile of each of its chunks.
+
+    The result is a regular .prof file, read with `python -m pstats` or any viewer of them.
+    '''
+
+    def __init__(self: Self) -> None:
+        self.calls = 0
+        self.__stats = pstats.Stats()
+
+    def add(self: Self, stats: Optional[ProfileStats]) -> None:
+        if stats:
+            self.__stats.add(_Recorded(stats))
+            self.calls += 1
+
+    def write(self: Self, upload_to: str) -> StoredFile:
+        '''Writes the profile as a .prof file in `upload_to`, blocking until it is written.'''
+        dir_path = _make_dirs(os.path.join(UPLOAD_DIR, upload_to))
+        filepath = os.path.join(dir_path, _get_hashes_file_name('profile.prof'))
+        self.__stats.dump_stats(filepath)
+        return StoredFile(filepath.replace('\\', '/'))
+
+
+class _Recorded:
+    '''The statistics of a finished profiler, in the shape `pstats.Stats` loads them from.'''
+
+    def __init__(self: Self, stats: ProfileStats) -> None:
+        self.stats = stats
+
+    def create_stats(self: Self) -> None:
+        pass
+
+
+__profile: ContextVar[Optional[JobProfile]] = ContextVar('profile', default=None)
+
+
+@contextmanager
+def profiling(profile: Optional[JobProfile]) -> Iterator[Optional[JobProfile]]:
+    '''Profiles the work of `pdf_engine` started by the current task into `profile`, if any.'''
+    token = __profile.set(profile)
+
+    try:
+        yield profile
+    finally:
+        __profile.reset(token)
+
+
+def current_profile() -> Optional[JobProfile]:
+    return __profile.get()
+
+
+def run_profiled(fn: Callable[..., T], *args: Any) -> tuple[T, ProfileStats]:
+    '''
+    Runs `fn(*args)` under `cProfile`, returning its result with the statistics.
+
+    When `fn` raises, the statistics up to that point are kept on the error as
+    `profile_stats`, a job that times out is usually the one worth looking at.
+    '''
+    profiler = cProfile.Profile()
+
+    try:
+        result = profiler.runcall(fn, *args)
+    except BaseException as error:
+        error.profile_stats = _snapshot(profiler)  # type: ignore
+        raise
+    return result, _snapshot(profiler)
+
+
+def _snapshot(profiler: cProfile.Profile) -> ProfileStats:
+    profiler.create_stats()
+    return profiler.stats  # type: ignore
@@ -1,14 +1,35 @@
 import os
 import io
+import hashlib
+import mmap
 import zipfile
 from abc import ABC, abstractmethod
-from typing import Self, override
+from contextlib import contextmanager
+from enum import Enum
+from typing import IO, AsyncIterable, BinaryIO, Iterable, Iterator, NamedTuple, Optional, Protocol, Self, override
 from uuid import uuid4
 
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pypdf import PdfWriter
 
-from ...config import BASE_DIR, UPLOAD_DIR
+from .. import errors
+from .metrics_service import registry
+from ...config import BASE_DIR, MMAP_THRESHOLD, UPLOAD_DIR, UPLOAD_CHUNK_SIZE
+
+BLOBS_DIR = 'blobs'
+BLOBS_STAGING_DIR = os.path.join(BLOBS_DIR, 'staging')
+
+pdf_phases = registry.histogram(
+    'pdf_phase_seconds',
+    'Time spent in each phase of the PDF operations: parse, page_copy, encrypt, decrypt, serialize and zip',
+    labelnames=('phase',)
+)
+storage_bytes = registry.counter(
+    'storage_bytes_total',
+    'Bytes each storage strategy wrote to (in) and removed from (out) the disk',
+    labelnames=('strategy', 'direction')
+)
 
 
 class StorageStrategy(ABC):
@@ -16,8 +37,17 @@ class StorageStrategy(ABC):
     Abstract base class for defining a storage strategy.
 
     Concrete implementations must provide methods for uploading and deleting files.
+    Strategies that know the size and SHA-256 digest of what they stored expose them in
+    `size` and `sha256` once `upload` returns.
     '''
 
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+
+    def _count(self: Self, direction: str, amount: Optional[int]) -> None:
+        if amount:
+            storage_bytes.labels(type(self).__name__, direction).inc(amount)
+
     @abstractmethod
     async def upload(self: Self, upload_to: str) -> str:
         '''
@@ -45,93 +75,355 @@ class StorageStrategy(ABC):
 
 
 class LocalUploadFile(StorageStrategy):
-    def __init__(self: Self, upload_file: UploadFile) -> None:
+    '''
+    Streams an uploaded file to disk in chunks of `UPLOAD_CHUNK_SIZE` bytes.
+
+    Disk writes run in the thread pool, and the size and SHA-256 digest of the file are
+    computed while it streams, so they are available in `size` and `sha256` once `upload`
+    returns. When `max_size` (in bytes) is given, the upload is aborted as soon as it is
+    exceeded and the partial file is removed.
+    '''
+
+    def __init__(self: Self, upload_file: UploadFile, max_size: Optional[int] = None) -> None:
         super().__init__()
         self.upload_file = upload_file
+        self.max_size = max_size
+        self.size: Optional[int] = None
+        self.sha256: Optional[str] = None
 
     @override
     async def upload(self: Self, upload_to: str) -> str:
+        path = await self._stream(upload_to)
+        self._count('in', self.size)
+        return path
+
+    async def _stream(self: Self, upload_to: str) -> str:
         dir_path: str = _make_dirs(os.path.join(UPLOAD_DIR, upload_to))
         filename: str = _get_hashes_file_name(self.upload_file.filename)  # type: ignore
         filepath: str = os.path.join(dir_path, filename)
+        digest = hashlib.sha256()
+        size = 0
+
+        try:
+            with open(filepath, "wb") as buffer:
+                while chunk := await self.upload_file.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+
+                    if self.max_size and size > self.max_size:
+                        raise errors.FILE_TOO_LARGE_ERROR
+                    await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        except BaseException:
+            _delete_file(filepath)
+            raise
+
+        self.size = size
+        self.sha256 = digest.hexdigest()
+        return filepath.replace('\\', '/')
 
-        with open(filepath, "wb") as buffer:
-            buffer.write(await self.upload_file.read())
+    @override
+    async def delete(self: Self, file_path: str) -> bool:
+        return _delete_file(file_path, self)
+
+
+class ContentAddressedFile(StorageStrategy):
+    '''
+    Stores an uploaded file once per distinct content, keyed by its SHA-256 digest.
+
+    The upload is streamed to a staging file first; once its digest is known it is moved to
+    `blobs/<first two hex chars>/<digest>`, or dropped if a blob with the same content is
+    already stored. Every FileModel row with the same content therefore shares the same
+    path.
+
+    Blobs are never removed along with a row: an upload of the same content may be reusing
+    the blob while the last row pointing to it is deleted. The sweeper removes the blobs no
+    row points to once they are older than its grace period, and reusing a blob touches it.
+    '''
+
+    def __init__(self: Self, upload_file: UploadFile, max_size: Optional[int] = None) -> None:
+        super().__init__()
+        self.source = LocalUploadFile(upload_file, max_size)
+
+    @override
+    async def upload(self: Self, upload_to: str) -> str:
+        # only the blobs that were not stored yet count as written
+        staged: str = await self.source._stream(BLOBS_STAGING_DIR)
+        self.size = self.source.size
+        self.sha256 = self.source.sha256
+        dir_path: str = _make_dirs(os.path.join(UPLOAD_DIR, BLOBS_DIR, self.sha256[:2]))  # type: ignore
+        filepath: str = os.path.join(dir_path, self.sha256)  # type: ignore
+
+        try:
+            # an existing blob is touched as it gets a new row, so the sweeper does not take it
+            # for an untracked file in the meantime
+            os.utime(filepath)
+            os.remove(staged)
+        except FileNotFoundError:
+            os.replace(staged, filepath)
+            self._count('in', self.size)
         return filepath.replace('\\', '/')
 
     @override
     async def delete(self: Self, file_path: str) -> bool:
-        return _delete_file(file_path)
+        return _delete_file(file_path, self)
+
+
+class StoredFile(NamedTuple):
+    '''A file written outside of a strategy upload, with the size and digest taken while it was written.'''
+    path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+
+
+def is_blob(file_path: str) -> bool:
+    '''Whether `file_path` is a blob of `ContentAddressedFile`, shared by every row of its content.'''
+    return file_path.startswith(os.path.join(UPLOAD_DIR, BLOBS_DIR, '').replace('\\', '/'))
+
+
+@contextmanager
+def open_stored(file_path: str, mmap_threshold: Optional[int] = None) -> Iterator[BinaryIO]:
+    '''
+    Opens a stored file for reading at random offsets, as pypdf reads it.
+
+    Files larger than `mmap_threshold` bytes (`MMAP_THRESHOLD` mb by default) are memory
+    mapped read-only: a read is served from the page cache without going through a file
+    buffer, and jobs reading the same file at the same time share its pages instead of each
+    holding a copy. Smaller files are read into memory at once. The stream is only valid
+    inside the block.
+    '''
+    if mmap_threshold is None:
+        mmap_threshold = MMAP_THRESHOLD * 1_000_000
+
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+
+        # an empty file cannot be mapped, it is never above the threshold
+        if mmap_threshold < 0 or size <= mmap_threshold:
+            yield io.BytesIO(file.read())
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped  # type: ignore
 
 
 class LocalExistingFile(StorageStrategy):
-    def __init__(self: Self, filepath: str) -> None:
+    '''
+    A file that is already on disk, like a result written by a worker process.
+
+    `upload` only hands back its path. The size and SHA-256 digest are the given ones, or are
+    read from the file when they were not recorded as it was written.
+    '''
+
+    def __init__(self: Self, filepath: str, size: Optional[int] = None, sha256: Optional[str] = None) -> None:
         super().__init__()
         self.filepath = filepath
+        self.size = size
+        self.sha256 = sha256
 
     @override
     async def upload(self: Self, upload_to: str) -> str:
+        if self.size is None or self.sha256 is None:
+            self.size, self.sha256 = await run_in_threadpool(_digest_file, self.filepath)
         return self.filepath
 
     @override
     async def delete(self: Self, file_path: str) -> bool:
-        return _delete_file(file_path)
+        return _delete_file(file_path, self)
+
+
+class PdfSerializer(Protocol):
+    '''Anything that writes a PDF document to a binary stream, like `pypdf.PdfWriter`.'''
+
+    def write(self, stream: BinaryIO) -> object:
+        ...
 
 
 class LocalPdfWriterFile(StorageStrategy):
-    def __init__(self: Self, writer: PdfWriter, filename: str) -> None:
+    '''Serializes a PDF writer to disk, taking the size and SHA-256 digest of the bytes as they are written.'''
+
+    def __init__(self: Self, writer: PdfWriter | PdfSerializer, filename: str) -> None:
         super().__init__()
         self.writer = writer
         self.filename = filename
 
     @override
     async def upload(self: Self, upload_to: str) -> str:
+        return self.write(upload_to)
+
+    def write(self: Self, upload_to: str) -> str:
+        '''
+        Serializes the writer to the specified destination without going through the event loop.
+
+        This is the blocking counterpart of `upload`, meant to be called from a worker process.
+        '''
         dir_path: str = _make_dirs(os.path.join(UPLOAD_DIR, upload_to))
         filepath: str = os.path.join(dir_path, _get_hashes_file_name(self.filename))
 
-        with open(filepath, 'wb') as file:
-            self.writer.write(file)
+        digest = hashlib.sha256()
+
+        with open(filepath, 'wb') as file, pdf_phases.labels('serialize').time():
+            stream = _TellingWriter(file, digest)
+            self.writer.write(stream)  # type: ignore
+        self.size = stream.position
+        self.sha256 = digest.hexdigest()
+        self._count('in', self.size)
         return filepath.replace('\\', '/')
 
     @override
     async def delete(self: Self, file_path: str) -> bool:
-        return _delete_file(file_path)
+        return _delete_file(file_path, self)
     
 
+class ZipCompression(str, Enum):
+    '''
+    Compression used for the members of a ZIP result.
+
+    PDF streams are usually compressed already, so `STORED` saves most of the CPU time spent
+    on deflate for a small size penalty.
+    '''
+    STORED = 'stored'
+    DEFLATED = 'deflated'
+
+    @property
+    def method(self: Self) -> int:
+        return zipfile.ZIP_STORED if self == ZipCompression.STORED else zipfile.ZIP_DEFLATED
+
+
 class LocalPDFZipFile(StorageStrategy):
-    def __init__(self: Self, writers: list[tuple[str, PdfWriter]], filename: str) -> None:
+    '''
+    Streams PDF writers into a ZIP archive.
+
+    Each writer is serialized straight into its archive entry, without an intermediate
+    in-memory copy, and is released as soon as its entry is closed. `writers` may be a lazy
+    iterable so writers are only built when the archive is ready to consume them, or an
+    async iterable of writers produced elsewhere, which `upload` consumes as they arrive.
+    '''
+
+    def __init__(
+            self: Self,
+            writers: Iterable[tuple[str, PdfWriter | PdfSerializer]] | AsyncIterable[tuple[str, PdfWriter | PdfSerializer]],
+            filename: str,
+            compression: ZipCompression = ZipCompression.DEFLATED
+    ) -> None:
         super().__init__()
         self.writers = writers
         self.filename = filename
+        self.compression = compression
 
     @override
     async def upload(self: Self, upload_to: str) -> str:
-        dir_path: str = _make_dirs(os.path.join(UPLOAD_DIR, upload_to))
-        filepath: str = os.path.join(dir_path, _get_hashes_file_name(self.filename))
+        if not isinstance(self.writers, AsyncIterable):
+            return self.write(upload_to)
+
+        filepath = self.__get_filepath(upload_to)
+        digest = hashlib.sha256()
+
+        with open(filepath, 'wb') as output:
+            stream = _TellingWriter(output, digest)
+
+            with zipfile.ZipFile(stream, 'w', self.compression.method) as file:
+                async for filename, writer in self.writers:
+                    await run_in_threadpool(_write_entry, file, filename, writer)
+                    del writer
+        self.size = stream.position
+        self.sha256 = digest.hexdigest()
+        self._count('in', self.size)
+        return filepath.replace('\\', '/')
 
-        with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as file:
-            for filename, writer in self.writers:
-                pdf_io = self.__to_bytes(writer)
-                file.writestr(filename, pdf_io.getvalue())
+    def write(self: Self, upload_to: str) -> str:
+        '''
+        Writes every PDF into a ZIP archive at the specified destination.
+
+        This is the blocking counterpart of `upload`, meant to be called from a worker process.
+        '''
+        filepath = self.__get_filepath(upload_to)
+        digest = hashlib.sha256()
+
+        with open(filepath, 'wb') as output:
+            stream = _TellingWriter(output, digest)
+
+            with zipfile.ZipFile(stream, 'w', self.compression.method) as file:
+                for filename, writer in self.writers:  # type: ignore
+                    _write_entry(file, filename, writer)
+                    del writer
+        self.size = stream.position
+        self.sha256 = digest.hexdigest()
+        self._count('in', self.size)
         return filepath.replace('\\', '/')
-    
+
     @override
     async def delete(self: Self, file_path: str) -> bool:
-        return _delete_file(file_path)
-    
-    @staticmethod
-    def __to_bytes(pdf_writer: PdfWriter) -> io.BytesIO:
-        buffer = io.BytesIO()
-        pdf_writer.write(buffer)
-        buffer.seek(0)
-        return buffer
+        return _delete_file(file_path, self)
+
+    def __get_filepath(self: Self, upload_to: str) -> str:
+        dir_path: str = _make_dirs(os.path.join(UPLOAD_DIR, upload_to))
+        return os.path.join(dir_path, _get_hashes_file_name(self.filename))
 
 
-def _delete_file(file_path: str):
+class _TellingWriter(io.RawIOBase):
+    '''
+    Write-only stream that keeps track of its position, and feeds what goes through it to
+    `digest` when one is given.
+
+    pypdf needs `tell()` to build the xref table, which the streams returned by
+    `ZipFile.open(name, 'w')` do not provide. As it cannot seek, a ZIP archive written
+    through it puts the sizes of its entries after their data, so every byte is written
+    once and in order.
+    '''
+
+    def __init__(self: Self, stream: IO[bytes], digest: Optional['hashlib._Hash'] = None) -> None:
+        super().__init__()
+        self.stream = stream
+        self.digest = digest
+        self.position = 0
+
+    @override
+    def writable(self: Self) -> bool:
+        return True
+
+    @override
+    def write(self: Self, data) -> int:
+        written = self.stream.write(data)
+        self.position += written
+
+        if self.digest:
+            self.digest.update(data[:written])
+        return written
+
+    @override
+    def tell(self: Self) -> int:
+        return self.position
+
+
+def _write_entry(file: zipfile.ZipFile, filename: str, writer: PdfWriter | PdfSerializer) -> None:
+    with file.open(filename, 'w') as entry, pdf_phases.labels('zip').time():
+        writer.write(_TellingWriter(entry))  # type: ignore
+
+
+def _write_chunk(buffer: BinaryIO, digest: 'hashlib._Hash', chunk: bytes) -> None:
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _digest_file(file_path: str) -> tuple[int, str]:
+    digest = hashlib.sha256()
+    size = 0
+
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            digest.update(chunk)
+    return size, digest.hexdigest()
+
+
+def _delete_file(file_path: str, strategy: Optional[StorageStrategy] = None):
     full_path = os.path.join(BASE_DIR, file_path)
 
     if os.path.exists(full_path):
+        size = os.path.getsize(full_path)
         os.remove(full_path)
+
+        if strategy:
+            strategy._count('out', size)
         return True
     return False
 
@@ -0,0 +1,265 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Self, Sequence
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import ColumnElement, Select, and_, delete, exists, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import FileModel, Job, Task
+from .jobs_service import JobStatus
+from .metrics_service import registry
+from .storage_service import is_blob
+from .tasks_service import StatusesTypes
+
+removed_tasks = registry.counter('sweeper_removed_tasks_total', 'Anonymous tasks removed by the sweeper')
+removed_rows = registry.counter('sweeper_removed_rows_total', 'File rows removed by the sweeper')
+removed_files = registry.counter('sweeper_removed_files_total', 'Stored files removed by the sweeper')
+reclaimed_bytes = registry.counter('sweeper_reclaimed_bytes_total', 'Disk space given back by the files the sweeper removed')
+
+
+class SweepReport:
+    '''What a sweep removed, and the bytes of disk it gave back.'''
+
+    def __init__(self: Self) -> None:
+        self.tasks = 0
+        self.rows = 0
+        self.files = 0
+        self.reclaimed = 0
+
+    def __str__(self: Self) -> str:
+        return f'{self.tasks} tasks, {self.rows} rows, {self.files} files, {self.reclaimed} bytes reclaimed'
+
+
+class Sweeper:
+    '''
+    Removes what the requests and jobs leave behind when nobody comes back for it, or when the
+    process that should have cleaned it up died:
+
+    - results whose download window (`Task.result_expires`) is over;
+    - the inputs, results and profiles of cancelled tasks, and of tasks not updated for `retention`;
+      anonymous tasks are removed altogether once they have no files left;
+    - rows that belong to no task, and rows whose file is gone from disk;
+    - files under `root` that no row points to.
+
+    Rows are removed in transactions of `batch_size` and their files right after each commit,
+    waiting `batch_delay` seconds between batches. Walking the disk and removing files run in
+    the thread pool, so a sweep only holds the event loop for the queries. Tasks with a queued
+    or running job are never touched, and untracked files and orphaned rows must be older than
+    `grace` to be removed, which leaves alone the ones still being written.
+    '''
+
+    def __init__(
+            self: Self,
+            sessions: Callable[[], AsyncSession],
+            *,
+            root: str,
+            skip: Sequence[str] = (),
+            retention: timedelta,
+            grace: timedelta,
+            batch_size: int,
+            batch_delay: float
+    ) -> None:
+        self.sessions = sessions
+        self.root = root
+        self.skip = tuple(skip)
+        self.retention = retention
+        self.grace = grace
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+    async def sweep(self: Self) -> SweepReport:
+        report = SweepReport()
+        now = datetime.now()
+        stale = self.__stale(now)
+
+        await self.__drain(report, select(FileModel.pk, FileModel.path).join(Task, Task.result_id == FileModel.pk).where(
+            Task.result_expires <= now
+        ))
+        await self.__drain(report, select(FileModel.pk, FileModel.path).where(or_(
+            FileModel.task_id.in_(select(Task.pk).where(stale)),
+            FileModel.pk.in_(select(Task.result_id).where(stale)),
+            FileModel.pk.in_(select(Task.profile_id).where(stale)),
+        )))
+        await self.__remove_tasks(report, select(Task.pk).where(
+            stale,
+            Task.updated < now - self.retention,
+            Task.user_id.is_(None),
+            Task.result_id.is_(None),
+            Task.profile_id.is_(None),
+            ~exists().where(FileModel.task_id == Task.pk),
+        ))
+        await self.__drain(report, select(FileModel.pk, FileModel.path).where(
+            FileModel.task_id.is_(None),
+            FileModel.created < now - self.grace,
+            ~exists().where(or_(Task.result_id == FileModel.pk, Task.profile_id == FileModel.pk)),
+        ))
+        await self.__sweep_disk(report, now - self.grace)
+
+        removed_tasks.inc(report.tasks)
+        removed_rows.inc(report.rows)
+        removed_files.inc(report.files)
+        reclaimed_bytes.inc(report.reclaimed)
+        return report
+
+    def __stale(self: Self, now: datetime) -> ColumnElement[bool]:
+        busy = select(Job.task_id).where(Job.status.in_((JobStatus.QUEUED.value, JobStatus.RUNNING.value)))
+        return and_(
+            Task.status_id != StatusesTypes.IN_PROGRES.value.pk,
+            Task.pk.not_in(busy),
+            or_(Task.status_id == StatusesTypes.CANCELED.value.pk, Task.updated < now - self.retention),
+        )
+
+    async def __drain(self: Self, report: SweepReport, query: Select[Any]) -> None:
+        '''Removes the rows selected by `query`, their pk and path, and their files one batch at a time.'''
+        while True:
+            async with self.sessions() as session:
+                rows = (await session.execute(query.order_by(FileModel.pk).limit(self.batch_size))).all()
+
+            if rows:
+                await self.__remove_rows(report, rows)
+            if len(rows) < self.batch_size:
+                return
+            await asyncio.sleep(self.batch_delay)
+
+    async def __remove_rows(self: Self, report: SweepReport, rows: Sequence[Any]) -> None:
+        pks = [pk for pk, _ in rows]
+        paths = {path for _, path in rows}
+
+        async with self.sessions() as session:
+            # the task keeps its age, only its result or profile goes away
+            await session.execute(
+                update(Task).where(Task.result_id.in_(pks)).values(result_id=None, updated=Task.updated),
+                execution_options={'synchronize_session': False}
+            )
+            await session.execute(
+                update(Task).where(Task.profile_id.in_(pks)).values(profile_id=None, updated=Task.updated),
+                execution_options={'synchronize_session': False}
+            )
+            await session.execute(delete(FileModel).where(FileModel.pk.in_(pks)), execution_options={'synchronize_session': False})
+            await session.commit()
+
+        report.rows += len(pks)
+        # content addressed blobs may be reused by an upload at any time, they are only removed
+        # by the walk of the disk once no row points to them and they were not touched for `grace`
+        await self.__unlink(report, (path for path in paths if not is_blob(path)))
+
+    async def __remove_tasks(self: Self, report: SweepReport, query: Select[Any]) -> None:
+        while True:
+            async with self.sessions() as session:
+                pks = list(await session.scalars(query.order_by(Task.pk).limit(self.batch_size)))
+
+                if pks:
+                    await session.execute(delete(Job).where(Job.task_id.in_(pks)), execution_options={'synchronize_session': False})
+                    await session.execute(delete(Task).where(Task.pk.in_(pks)), execution_options={'synchronize_session': False})
+                    await session.commit()
+
+            report.tasks += len(pks)
+            if len(pks) < self.batch_size:
+                return
+            await asyncio.sleep(self.batch_delay)
+
+    async def __sweep_disk(self: Self, report: SweepReport, cutoff: datetime) -> None:
+        present, candidates, empty = await run_in_threadpool(_scan, self.root, self.skip, cutoff.timestamp())
+        last = 0
+
+        # rows whose file is gone
+        while True:
+            async with self.sessions() as session:
+                rows = (await session.execute(
+                    select(FileModel.pk, FileModel.path)
+                    .where(FileModel.pk > last, FileModel.created < cutoff)
+                    .order_by(FileModel.pk)
+                    .limit(self.batch_size)
+                )).all()
+
+            if not rows:
+                break
+            last = rows[-1][0]
+            missing = [row for row in rows if row[1] not in present]
+
+            if missing:
+                await self.__remove_rows(report, missing)
+            await asyncio.sleep(self.batch_delay)
+
+        # files no row points to
+        for start in range(0, len(candidates), self.batch_size):
+            batch = candidates[start:start + self.batch_size]
+
+            async with self.sessions() as session:
+                tracked = set(await session.scalars(select(FileModel.path).where(FileModel.path.in_(batch))))
+            await self.__unlink(report, (path for path in batch if path not in tracked), cutoff.timestamp())
+            await asyncio.sleep(self.batch_delay)
+
+        await run_in_threadpool(_remove_dirs, empty)
+
+    async def __unlink(self: Self, report: SweepReport, paths: Iterable[str], cutoff: float | None = None) -> None:
+        files, reclaimed = await run_in_threadpool(_unlink, list(paths), cutoff)
+        report.files += files
+        report.reclaimed += reclaimed
+
+
+def _scan(root: str, skip: tuple[str, ...], cutoff: float) -> tuple[set[str], list[str], list[str]]:
+    '''
+    Walks `root`, leaving out the directories in `skip`.
+
+    Returns:
+        tuple[set[str], list[str], list[str]]: The path of every file, the paths of the files
+            last modified before `cutoff` and the empty directories last modified before it.
+    '''
+    present: set[str] = set()
+    candidates: list[str] = []
+    empty: list[str] = []
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if os.path.join(dirpath, name) not in skip]
+
+        if dirpath != root and not dirnames and not filenames and _mtime(dirpath) < cutoff:
+            empty.append(dirpath)
+
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            # stored paths always use forward slashes
+            present.add(path.replace('\\', '/'))
+
+            if _mtime(path) < cutoff:
+                candidates.append(path.replace('\\', '/'))
+    return present, candidates, empty
+
+
+def _unlink(paths: list[str], cutoff: float | None) -> tuple[int, int]:
+    removed, reclaimed = 0, 0
+
+    for path in paths:
+        try:
+            stat_result = os.lstat(path)
+
+            # touched since the disk was walked, it may be about to get a row
+            if cutoff is not None and stat_result.st_mtime >= cutoff:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+
+        removed += 1
+        # a link left in the result cache keeps the data on disk
+        if stat_result.st_nlink == 1:
+            reclaimed += stat_result.st_size
+    return removed, reclaimed
+
+
+def _remove_dirs(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.rmdir(path)
+        except OSError:
+            # something was written to it in the meantime
+            continue
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return float('inf')
@@ -1,11 +1,18 @@
+import logging
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Sequence, Optional
+from types import MappingProxyType
+from typing import Iterable, Mapping, NamedTuple, Optional, Self, Sequence
 
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.sql.base import ExecutableOption
 
 from ..models import Task, TaskStatus, TaskProcess, User
 
+logger = logging.getLogger('backend.tasks')
+
 
 class StatusesTypes(Enum):
     CREATED = TaskStatus(pk=1, name='task_created')
@@ -24,20 +31,77 @@ class ProcessTypes(Enum):
     SPLIT = TaskProcess(pk=5, name='pdf_split')
 
 
-def create_task(db: Session, /, *, user: Optional[User]) -> Task:
+class Lookup(NamedTuple):
+    pk: int
+    name: str
+
+
+class LookupRegistry:
+    '''
+    Statuses and processes of the tasks by id, read once from their lookup tables.
+
+    They never change while the application runs, so the status and process of a task are
+    taken from here instead of being loaded with it. Until `load` runs the registry holds
+    the values of `StatusesTypes` and `ProcessTypes`, which are what the tables are filled with.
+    '''
+
+    def __init__(self: Self) -> None:
+        self.__statuses = self.__freeze(status.value for status in StatusesTypes)
+        self.__processes = self.__freeze(process.value for process in ProcessTypes)
+
+    def load(self: Self, db: Session) -> None:
+        self.__statuses = self.__freeze(db.execute(select(TaskStatus)).scalars())
+        self.__processes = self.__freeze(db.execute(select(TaskProcess)).scalars())
+
+    def status(self: Self, status_id: int) -> Lookup:
+        return self.__statuses[status_id]
+
+    def process(self: Self, process_id: int) -> Lookup:
+        return self.__processes[process_id]
+
+    @staticmethod
+    def __freeze(rows: Iterable[TaskStatus | TaskProcess]) -> Mapping[int, Lookup]:
+        return MappingProxyType({row.pk: Lookup(row.pk, row.name) for row in rows})
+
+
+registry = LookupRegistry()
+
+# Loader options for each use of a task, its relationships are never loaded implicitly.
+# Many-to-one relationships are joined into the query of the task, the files come in a
+# second query. The status and process come from `registry`.
+
+# what `TaskSchema` serializes
+DETAILS_LOAD: tuple[ExecutableOption, ...] = (joinedload(Task.result),)
+# checking the status before adding files
+STATUS_LOAD: tuple[ExecutableOption, ...] = ()
+# downloading and removing the result
+RESULT_LOAD: tuple[ExecutableOption, ...] = (joinedload(Task.result),)
+# downloading the profile of the last run
+PROFILE_LOAD: tuple[ExecutableOption, ...] = (joinedload(Task.profile),)
+# running a job over the input files
+JOB_LOAD: tuple[ExecutableOption, ...] = (joinedload(Task.user), selectinload(Task.files))
+
+
+async def create_task(db: AsyncSession, /, *, user: Optional[User]) -> Task:
     task: Task = Task()
     task.status_id = StatusesTypes.CREATED.value.pk
     task.result = None
     task.user = user
     task.process_id = ProcessTypes.UNDEFINED.value.pk
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    await db.commit()
     return task
 
 
-def get_task(db: Session, /, *, task_id: int) -> Task:
-    task: Task = db.query(Task).where(Task.pk == task_id).first()
+async def get_task(
+        db: AsyncSession,
+        /,
+        *,
+        task_id: int,
+        options: Sequence[ExecutableOption] = DETAILS_LOAD
+) -> Optional[Task]:
+    query = select(Task).where(Task.pk == task_id).options(*options)
+    task: Optional[Task] = (await db.execute(query)).unique().scalar()
     return task
 
 
@@ -62,18 +126,32 @@ def set_task_canceled(task: Task) -> Task:
 
 
 def download_ready(task: Task) -> bool:
-    return task.status == StatusesTypes.COMPLETED.value
+    return task.status_id == StatusesTypes.COMPLETED.value.pk
+
+
+def is_in_progress(task: Task) -> bool:
+    return task.status_id == StatusesTypes.IN_PROGRES.value.pk
 
 
 def is_completed(task: Task) -> bool:
-    return task.status == StatusesTypes.COMPLETED.value or task.status == StatusesTypes.DOWLOADED.value
+    return task.status_id in (StatusesTypes.COMPLETED.value.pk, StatusesTypes.DOWLOADED.value.pk)
+
+
+def is_canceled(task: Task) -> bool:
+    return task.status_id == StatusesTypes.CANCELED.value.pk
 
 
-def set_task_dowloaded(task: Task) -> Task:
+def set_task_dowloaded(task: Task, retention: float) -> Task:
+    '''Marks the task as downloaded, keeping its result available for `retention` more seconds.'''
     task.status_id = StatusesTypes.DOWLOADED.value.pk
+    task.result_expires = datetime.now() + timedelta(seconds=retention)
     return task
 
 
+def result_expired(task: Task) -> bool:
+    return task.result_expires is not None and task.result_expires <= datetime.now()
+
+
 def set_process(task: Task, process: ProcessTypes) -> Task:
     task.process_id = process.value.pk
     return task
@@ -98,5 +176,6 @@ def init_service(db: Session) -> None:
             db.add_all(processes)
             db.commit()
     except Exception as error:
-        print(error)
+        logger.error('could not fill the task lookup tables: %r', error)
         db.rollback()
+    registry.load(db)
@@ -1,12 +1,22 @@
+import asyncio
+import os
 from abc import ABC, abstractmethod
 from functools import reduce
-from typing import Annotated, Optional, Self, override
+from typing import Annotated, Mapping, Optional, Self, Sequence, override
 
+import anyio
 from fastapi import File, HTTPException, status, UploadFile
-from sqlalchemy.orm import Session
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.datastructures import Headers
+from starlette.responses import MalformedRangeHeader, RangeNotSatisfiable
+from starlette.types import Receive, Scope, Send
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from ..errors import INVALID_FILE_ERROR
-from ..models import FileModel, Task
+from ..models import FileModel, Task, User
+from ..services.storage_service import StorageStrategy
 
 
 class FileModelFactory(ABC):
@@ -32,7 +42,8 @@ class UploadFileModelFactory(FileModelFactory):
             filemodel.name = name
             filemodel.extension = extension
             filemodel.content_type = content_type
-            filemodel.task = self.task
+            # by id, the files of the task are not loaded to append the new one to them
+            filemodel.task_id = self.task.pk
             return filemodel
         raise INVALID_FILE_ERROR
 
@@ -54,13 +65,71 @@ class ResponseFileModelFactory(FileModelFactory):
         return filemodel
 
 
-def get_filemodel(
-        db: Session,
+async def get_filemodel(
+        db: AsyncSession,
         *,
         file_url: str,
+        user: Optional[User] = None
 ) -> Optional[FileModel]:
-    filemodel = db.query(FileModel).where(FileModel.path == file_url).first()
-    return filemodel
+    '''
+    Retrieves the file model stored at the given path.
+
+    Content addressed files share their path with every upload of the same content, so when
+    several rows match, the one the given user has access to is preferred.
+    '''
+    query = select(FileModel).where(FileModel.path == file_url).options(joinedload(FileModel.task))
+    filemodels = (await db.execute(query)).scalars().all()
+    accessible = [f for f in filemodels if f.task and f.task.check_ownership(user)]
+    return next(iter(accessible or filemodels), None)
+
+
+async def upload_filemodels(
+        db: AsyncSession,
+        uploads: list[tuple[FileModel, StorageStrategy]],
+        *,
+        upload_to: str
+) -> Sequence[FileModel]:
+    '''
+    Stores every file concurrently, then inserts all their rows with a single statement and
+    commits them along with whatever else the session holds.
+
+    The given file models are only used as templates for the rows, they are not added to the
+    session. If some file cannot be stored, or the commit fails, nothing is committed and the
+    files that were already stored are removed.
+
+    Returns:
+        Sequence[FileModel]: The inserted file models, in the order they were inserted.
+    '''
+    stored = await asyncio.gather(*(strategy.upload(upload_to) for _, strategy in uploads), return_exceptions=True)
+
+    try:
+        for path in stored:
+            if isinstance(path, BaseException):
+                raise path
+
+        rows = [
+            {
+                'name': filemodel.name,
+                'extension': filemodel.extension,
+                'content_type': filemodel.content_type,
+                'task_id': filemodel.task_id,
+                'path': path,
+                'size': strategy.size,
+                'sha256': strategy.sha256,
+            }
+            for (filemodel, strategy), path in zip(uploads, stored)
+        ]
+        # keeping the order of the parameters would split the INSERT in one statement per row
+        filemodels = (await db.scalars(insert(FileModel).returning(FileModel), rows)).all()
+        await db.commit()
+        return sorted(filemodels, key=lambda filemodel: filemodel.pk)
+    except BaseException:
+        await db.rollback()
+
+        for (_, strategy), path in zip(uploads, stored):
+            if not isinstance(path, BaseException):
+                await FileModel(path=path).delete_stored(db, strategy)
+        raise
 
 
 def split_filename(filename: str) -> tuple[str, str]:
@@ -91,3 +160,108 @@ def check_size_or_raise(
                 'X-Error': 'FileTooLarge'
             }
         )
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    '''
+    Checks an `If-None-Match` header against the entity tag of a file, using the weak
+    comparison HTTP asks for on conditional GET requests.
+    '''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag.removeprefix('W/') in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+
+
+class StoredFileResponse(FileResponse):
+    '''
+    Sends a stored file with the size and SHA-256 digest recorded in its row.
+
+    Content-Length, the ETag and byte ranges are answered from them, so the file is not
+    touched until its bytes are sent. When the ASGI server offers the `zerocopysend` or
+    `pathsend` extensions the body is handed to it, and it can use `os.sendfile` instead of
+    the file going through the event loop in chunks. Rows without a recorded size or digest
+    are sent as a plain `FileResponse`.
+    '''
+
+    def __init__(
+            self: Self,
+            filemodel: FileModel,
+            headers: Optional[Mapping[str, str]] = None,
+            stat_result: Optional[os.stat_result] = None
+    ) -> None:
+        super().__init__(
+            filemodel.absolute_path,
+            headers=headers,
+            media_type=filemodel.content_type,
+            filename=filemodel.full_name,
+            stat_result=stat_result
+        )
+        self.size = filemodel.size
+        self.recorded = stat_result is None and filemodel.size is not None and filemodel.sha256 is not None
+
+        if self.recorded:
+            self.headers.setdefault('content-length', str(filemodel.size))
+            self.headers.setdefault('etag', f'"{filemodel.sha256}"')
+
+    @override
+    async def __call__(self: Self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.recorded:
+            return await super().__call__(scope, receive, send)
+
+        send_header_only = scope['method'].upper() == 'HEAD'
+        extensions = scope.get('extensions') or {}
+        headers = Headers(scope=scope)
+        http_range = headers.get('range')
+        http_if_range = headers.get('if-range')
+        size: int = self.size  # type: ignore
+
+        if http_range is None or (http_if_range is not None and http_if_range != self.headers['etag']):
+            await self.__send(send, extensions, self.status_code, 0, size, send_header_only)
+        else:
+            try:
+                ranges = self._parse_range_header(http_range, size)
+            except MalformedRangeHeader as exc:
+                return await PlainTextResponse(exc.content, status_code=400)(scope, receive, send)
+            except RangeNotSatisfiable as exc:
+                response = PlainTextResponse(status_code=416, headers={'Content-Range': f'*/{exc.max_size}'})
+                return await response(scope, receive, send)
+
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                self.headers['content-range'] = f'bytes {start}-{end - 1}/{size}'
+                self.headers['content-length'] = str(end - start)
+                await self.__send(send, extensions, 206, start, end - start, send_header_only)
+            else:
+                await self._handle_multiple_ranges(send, ranges, size, send_header_only)
+
+        if self.background is not None:
+            await self.background()
+
+    async def __send(
+            self: Self, send: Send, extensions: dict, status_code: int, offset: int, count: int, send_header_only: bool
+    ) -> None:
+        await send({'type': 'http.response.start', 'status': status_code, 'headers': self.raw_headers})
+
+        if send_header_only:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        elif 'http.response.zerocopysend' in extensions:
+            file = await anyio.to_thread.run_sync(open, self.path, 'rb')
+
+            try:
+                await send({'type': 'http.response.zerocopysend', 'file': file, 'offset': offset, 'count': count})
+            finally:
+                file.close()
+        elif 'http.response.pathsend' in extensions and offset == 0 and count == self.size:
+            await send({'type': 'http.response.pathsend', 'path': os.path.abspath(self.path)})
+        else:
+            async with await anyio.open_file(self.path, mode='rb') as file:
+                await file.seek(offset)
+                more_body = True
+
+                while more_body:
+                    chunk = await file.read(min(self.chunk_size, count))
+                    count -= len(chunk)
+                    more_body = bool(chunk) and count > 0
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
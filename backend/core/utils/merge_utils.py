@@ -0,0 +1,184 @@
+from typing import BinaryIO, Optional, Self
+
+import pypdf
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+)
+
+from ..services.storage_service import open_stored
+
+# keys that are rebuilt by the merger instead of being copied from the inputs
+_PAGE_SKIPPED_KEYS = ('/Parent',)
+_STREAM_SKIPPED_KEYS = ('/Length',)
+
+
+class StreamingPdfMerger:
+    '''
+    Merges PDF files by streaming their pages to the output one input at a time.
+
+    `pypdf.PdfWriter.append` keeps every copied page and object in memory until the whole
+    document is serialized. Here every object is renumbered and written to the output as
+    soon as it is reached from a page, and only the object number mapping of the input being
+    copied is kept; the objects parsed by its reader are dropped after each page. Memory then
+    depends on the largest page instead of the size of the merged document.
+
+    Only pages are copied, together with everything they reference (contents, resources,
+    annotations). Document level structures such as outlines, named destinations and form
+    fields are not kept.
+
+    It exposes the same `write(stream)` as `pypdf.PdfWriter`, so it can be handed to
+    `LocalPdfWriterFile` in place of a writer.
+    '''
+
+    def __init__(self: Self, paths: list[str], strict: bool = False) -> None:
+        self.paths = paths
+        self.strict = strict
+        self.__stream: Optional[BinaryIO] = None
+        self.__offsets: list[int] = []
+        self.__kids: list[int] = []
+
+    def write(self: Self, stream: BinaryIO) -> None:
+        '''
+        Writes the merged document to `stream`, which must support `tell`.
+
+        Raises:
+            ValueError: In strict mode, if some input is not a readable PDF file.
+        '''
+        self.__stream = stream
+        # object number 0 is the head of the free list
+        self.__offsets = [0]
+        self.__kids = []
+
+        stream.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        pages_id = self.__reserve()
+
+        for path in self.paths:
+            self.__append(path, pages_id)
+
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(kid, 0, None) for kid in self.__kids),
+            NameObject('/Count'): NumberObject(len(self.__kids)),
+        })
+        self.__write_object(pages_id, pages)
+
+        catalog_id = self.__reserve()
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(pages_id, 0, None),
+        })
+        self.__write_object(catalog_id, catalog)
+        self.__write_trailer(catalog_id)
+
+    def __append(self: Self, path: str, pages_id: int) -> None:
+        kids = len(self.__kids)
+
+        try:
+            with open_stored(path) as file:
+                reader = pypdf.PdfReader(file)
+                pages = reader.pages
+                # every page gets its number up front so links between pages of the same
+                # input point to the copied page instead of pulling the page in again
+                ids = {_key(page.indirect_reference): self.__reserve() for page in pages}
+
+                for page in pages:
+                    self.__copy_page(reader, page, ids, pages_id)
+        except Exception:
+            # objects already written are left unreferenced, the pages are dropped
+            del self.__kids[kids:]
+
+            if self.strict:
+                raise ValueError(f'{path} is not a PDF file')
+
+    def __copy_page(
+            self: Self,
+            reader: pypdf.PdfReader,
+            page: pypdf.PageObject,
+            ids: dict[tuple[int, int], int],
+            pages_id: int
+    ) -> None:
+        pending: list[tuple[int, IndirectObject]] = []
+        page_id = ids[_key(page.indirect_reference)]
+
+        # the flattened page already carries the attributes inherited from the page tree
+        copy = DictionaryObject({
+            key: self.__translate(value, ids, pending)
+            for key, value in page.items() if key not in _PAGE_SKIPPED_KEYS
+        })
+        copy[NameObject('/Parent')] = IndirectObject(pages_id, 0, None)
+        self.__write_object(page_id, copy)
+        self.__kids.append(page_id)
+
+        while pending:
+            object_id, reference = pending.pop()
+            self.__write_object(object_id, self.__translate(reference.get_object(), ids, pending))
+
+        # objects shared with later pages are already written, only their numbers are needed
+        reader.resolved_objects.clear()
+
+    def __translate(
+            self: Self,
+            obj: PdfObject,
+            ids: dict[tuple[int, int], int],
+            pending: list[tuple[int, IndirectObject]]
+    ) -> PdfObject:
+        # copies a direct object, renumbering the indirect objects it references and
+        # queueing the ones that have not been written yet
+        if isinstance(obj, IndirectObject):
+            key = _key(obj)
+
+            if key not in ids:
+                ids[key] = self.__reserve()
+                pending.append((ids[key], obj))
+            return IndirectObject(ids[key], 0, None)
+
+        if isinstance(obj, StreamObject):
+            stream = StreamObject()
+            # the data is written as is, still encoded with its original filters
+            stream._data = obj._data
+
+            for key, value in obj.items():
+                if key not in _STREAM_SKIPPED_KEYS:
+                    stream[key] = self.__translate(value, ids, pending)
+            return stream
+
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self.__translate(value, ids, pending) for key, value in obj.items()})
+
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.__translate(value, ids, pending) for value in obj)
+        return obj
+
+    def __reserve(self: Self) -> int:
+        self.__offsets.append(0)
+        return len(self.__offsets) - 1
+
+    def __write_object(self: Self, object_id: int, obj: PdfObject) -> None:
+        stream: BinaryIO = self.__stream  # type: ignore
+        self.__offsets[object_id] = stream.tell()
+        stream.write(f'{object_id} 0 obj\n'.encode())
+        obj.write_to_stream(stream)
+        stream.write(b'\nendobj\n')
+
+    def __write_trailer(self: Self, catalog_id: int) -> None:
+        stream: BinaryIO = self.__stream  # type: ignore
+        xref = stream.tell()
+
+        stream.write(f'xref\n0 {len(self.__offsets)}\n'.encode())
+        stream.write(b'0000000000 65535 f \n')
+        for offset in self.__offsets[1:]:
+            # numbers reserved for objects of a broken input are never written
+            stream.write(f'{offset:010} 00000 n \n'.encode() if offset else b'0000000000 00000 f \n')
+
+        stream.write(f'trailer\n<< /Size {len(self.__offsets)} /Root {catalog_id} 0 R >>\n'.encode())
+        stream.write(f'startxref\n{xref}\n%%EOF\n'.encode())
+
+
+def _key(reference: Optional[IndirectObject]) -> tuple[int, int]:
+    return reference.idnum, reference.generation  # type: ignore
@@ -0,0 +1,214 @@
+import bisect
+import itertools
+from typing import Optional, Self, Sequence, overload
+
+import pypdf
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, PdfObject
+
+from .reader_utils import DocumentIndex, IndexedPdfReader, Reference
+
+# attributes a page takes from the nearest /Pages node above it when it does not set them
+_INHERITABLE = (NameObject('/Resources'), NameObject('/MediaBox'), NameObject('/CropBox'), NameObject('/Rotate'))
+# deeper than any real page tree, a cycle in a damaged one ends here
+_MAX_DEPTH = 64
+
+
+class _BrokenTree(Exception):
+    '''The /Count of some node of the page tree does not match what is below it.'''
+
+
+class LazyPages(Sequence[pypdf.PageObject]):
+    '''
+    The pages of a reader, looked up on demand through the page tree.
+
+    `reader.pages` flattens the whole page tree on first use, resolving the dictionary of
+    every page of the document even to get one of them. Here a page is found by going down
+    from the root, choosing at each /Pages node the kid that holds the index. A kid that is a
+    /Pages node counts for its /Count and is not read further, so only the nodes on the way
+    to the page and their kids are resolved; the objects the page references are then read
+    from the xref as the writer copies them. Getting a few pages of a balanced tree costs its
+    depth times its width for each of them instead of the size of the document, a flat tree
+    still has all its kids read once.
+
+    The /Count of a node the lookup goes down into is checked against its kids, and where the
+    pages of each kid end is kept for the later lookups through the node. When they disagree
+    the lookup falls back to `reader.pages`, which does not rely on /Count.
+
+    With an `IndexedPdfReader` the page count, the checked nodes and where each page found
+    sits in the tree are kept in its `DocumentIndex`, so a later reader of the same content
+    goes straight to them.
+    '''
+
+    def __init__(self: Self, reader: pypdf.PdfReader) -> None:
+        self.reader = reader
+        self.index: Optional[DocumentIndex] = reader.index if isinstance(reader, IndexedPdfReader) else None
+        self.__pages: dict[int, pypdf.PageObject] = {}
+        self.__kid_ends: dict[Reference, list[int]] = self.index.kid_ends if self.index else {}
+        self.__length: Optional[int] = self.index.pages if self.index else None
+        self.__fallback = False
+
+    def __len__(self: Self) -> int:
+        if self.__length is None:
+            try:
+                self.__length = int(self.__root()['/Count'])  # type: ignore
+            except Exception:
+                self.__fallback = True
+                self.__length = len(self.reader.pages)
+
+            if self.index:
+                self.index.pages = self.__length
+        return self.__length
+
+    @overload
+    def __getitem__(self: Self, index: int) -> pypdf.PageObject: ...
+
+    @overload
+    def __getitem__(self: Self, index: slice) -> list[pypdf.PageObject]: ...
+
+    def __getitem__(self: Self, index: int | slice) -> pypdf.PageObject | list[pypdf.PageObject]:
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+
+        length = len(self)
+
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('page index out of range')
+        if self.__fallback:
+            return self.reader.pages[index]
+
+        if index not in self.__pages:
+            try:
+                self.__pages[index] = self.__known(index) or self.__find(index)
+            except Exception:
+                self.__fallback = True
+                return self.reader.pages[index]
+        return self.__pages[index]
+
+    def __root(self: Self) -> DictionaryObject:
+        root = self.reader.root_object['/Pages'].get_object()
+
+        if not isinstance(root, DictionaryObject):
+            raise _BrokenTree('invalid /Pages')
+        return root
+
+    def __known(self: Self, index: int) -> Optional[pypdf.PageObject]:
+        '''The page from where an earlier reader of the same content found it, if any did.'''
+        if not self.index or index not in self.index.page_refs:
+            return None
+
+        (idnum, generation), path = self.index.page_refs[index]
+        inherited: dict[NameObject, PdfObject] = {}
+
+        for node in path:
+            node = IndirectObject(*node, self.reader).get_object()
+            inherited.update((key, node[key]) for key in _INHERITABLE if key in node)  # type: ignore
+
+        reference = IndirectObject(idnum, generation, self.reader)
+        kid = reference.get_object()
+
+        if not _is_page(kid):
+            raise _BrokenTree('a known page that is not a page')
+        return self.__page(reference, kid, inherited)  # type: ignore
+
+    def __find(self: Self, index: int) -> pypdf.PageObject:
+        position = index
+        node, node_reference = self.__root(), dict.get(self.reader.root_object, '/Pages')
+        # references of the nodes on the way down a page inherits from, None once one of them
+        # is a direct object; the others do not need to be read again to rebuild the page
+        path: Optional[list[Reference]] = []
+        inherited: dict[NameObject, PdfObject] = {}
+
+        for _ in range(_MAX_DEPTH):
+            if any(key in node for key in _INHERITABLE):
+                path = _visit(path, node_reference)
+            # nearer nodes come later and override what the ones above set
+            inherited.update((key, node[key]) for key in _INHERITABLE if key in node)
+            kids = node.get('/Kids')
+
+            if not isinstance(kids, ArrayObject):
+                raise _BrokenTree('a /Pages node without /Kids')
+
+            ends = self.__ends_of(node_reference, node, kids)
+            # the first kid whose pages end after the index, empty /Pages nodes end where the
+            # kid before them does and are passed over
+            position_in_node = bisect.bisect_right(ends, index)
+
+            if position_in_node:
+                index -= ends[position_in_node - 1]
+
+            reference = kids[position_in_node]
+            kid = reference.get_object()
+
+            if _is_page(kid):
+                return self.__found(position, path, reference, kid, inherited)
+            node, node_reference = kid, reference
+        raise _BrokenTree('the page tree is too deep')
+
+    def __ends_of(self: Self, node_reference: Optional[PdfObject], node: DictionaryObject, kids: ArrayObject) -> list[int]:
+        '''Where the pages under each kid of a node end, once their sum matches the /Count of the node.'''
+        key = (node_reference.idnum, node_reference.generation) if isinstance(node_reference, IndirectObject) else None
+
+        if key in self.__kid_ends:
+            return self.__kid_ends[key]  # type: ignore
+
+        ends = list(itertools.accumulate(_count(reference.get_object()) for reference in kids))
+
+        if (ends[-1] if ends else 0) != int(node['/Count']):  # type: ignore
+            raise _BrokenTree('the kids do not hold /Count pages')
+        # only kept for the nodes that are indirect objects, a direct one is read again anyway
+        if key is not None:
+            self.__kid_ends[key] = ends
+        return ends
+
+    def __found(
+            self: Self,
+            position: int,
+            path: Optional[list[Reference]],
+            reference: PdfObject,
+            kid: DictionaryObject,
+            inherited: dict[NameObject, PdfObject]
+    ) -> pypdf.PageObject:
+        if self.index is not None and path is not None and isinstance(reference, IndirectObject):
+            self.index.page_refs[position] = ((reference.idnum, reference.generation), tuple(path))
+        return self.__page(reference, kid, inherited)
+
+    def __page(self: Self, reference: PdfObject, kid: DictionaryObject, inherited: dict[NameObject, PdfObject]) -> pypdf.PageObject:
+        # built the way `reader.pages` builds it, without changing the parsed dictionary
+        page = pypdf.PageObject(self.reader, reference if isinstance(reference, IndirectObject) else None)
+        page.update(kid)
+
+        for key, value in inherited.items():
+            if key not in page:
+                page[key] = value
+        return page
+
+
+def _visit(path: Optional[list[Reference]], reference: Optional[PdfObject]) -> Optional[list[Reference]]:
+    if path is None or not isinstance(reference, IndirectObject):
+        return None
+
+    path.append((reference.idnum, reference.generation))
+    return path
+
+
+def _count(kid: PdfObject) -> int:
+    '''The number of pages under a kid of a /Pages node.'''
+    if _is_page(kid):
+        return 1
+
+    count = int(kid['/Count'])  # type: ignore
+
+    if count < 0:
+        raise _BrokenTree('a negative /Count')
+    return count
+
+
+def _is_page(obj: PdfObject) -> bool:
+    if not isinstance(obj, DictionaryObject):
+        raise _BrokenTree('a kid that is not a dictionary')
+    if '/Type' in obj:
+        return obj['/Type'] == '/Page'
+    # an untyped node is a page when it has no kids, as `reader.pages` decides it
+    return '/Kids' not in obj
@@ -1,18 +1,29 @@
-from typing import Optional, Self, override
+from typing import Any, AsyncIterator, BinaryIO, Iterator, Optional, Self, override
+from contextlib import aclosing, contextmanager
 from enum import Enum
-import io
-import zipfile
 from abc import ABC, abstractmethod
+import io
+import os
+import shutil
+import tempfile
 
 import pypdf
 import pypdf.errors
-from sqlalchemy.orm import Session
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, PdfObject, StreamObject
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import pair
+from .merge_utils import StreamingPdfMerger
+from .page_utils import LazyPages
+from .reader_utils import IndexedPdfReader
 from .. import errors
 from ..models import FileModel, Task, User
-from ..services.storage_service import LocalPdfWriterFile, LocalPDFZipFile
+from ..services.cache_service import document_cache
+from ..services.execution_service import pdf_engine
+from ..services.storage_service import LocalExistingFile, LocalPdfWriterFile, LocalPDFZipFile, StoredFile, ZipCompression, open_stored, pdf_phases
 from . import file_utils
+from ...config import MERGE_STREAMING_THRESHOLD
 
 
 class SplitMode(str, Enum):
@@ -22,16 +33,25 @@ class SplitMode(str, Enum):
 
 
 class PdfProcessStrategy(ABC):
+    filename: str
+    content_type: str
+
     @abstractmethod
     def start_process(self: Self, reader: pypdf.PdfReader) -> None:
         pass
 
     @abstractmethod
-    async def get_filemodel(self: Self, db: Session, user: Optional[User]) -> FileModel:
+    def get_storage(self: Self) -> LocalPdfWriterFile | LocalPDFZipFile:
         pass
 
+    async def get_filemodel(self: Self, db: AsyncSession, stored: StoredFile) -> FileModel:
+        return await save_result(db, stored, self.filename, self.content_type)
+
 
 class PdfSlicerM(PdfProcessStrategy):
+    filename = 'split-pdf.pdf'
+    content_type = 'application/pdf'
+
     def __init__(self: Self, ranges: list[int]) -> None:
         super().__init__()
         self.ranges: list[tuple[int, int]] = list(pair(ranges))
@@ -39,19 +59,18 @@ class PdfSlicerM(PdfProcessStrategy):
 
     @override
     def start_process(self: Self, reader: pypdf.PdfReader) -> None:
+        # only the requested pages are looked up, the rest of the page tree is never read
+        pages = LazyPages(reader)
+
         for r in self.ranges:
             start, end = r
 
-            for page in reader.pages[start-1:end]:
+            for page in pages[start-1:end]:
                 self.pages.append(page)
 
     @override
-    async def get_filemodel(self: Self, db: Session, user: Optional[User]) -> FileModel:
-        filemodel = file_utils.ResponseFileModelFactory('split-pdf.pdf', 'application/pdf').create_filemodel()
-        writer = self.__merge_pages()
-        strategy = LocalPdfWriterFile(writer, 'split-pdf.pdf')
-        await filemodel.upload(db, strategy, upload_to=_get_target_path(user))
-        return filemodel
+    def get_storage(self: Self) -> LocalPdfWriterFile:
+        return LocalPdfWriterFile(self.__merge_pages(), self.filename)
 
     def __merge_pages(self: Self) -> pypdf.PdfWriter:
         writer = pypdf.PdfWriter()
@@ -61,178 +80,501 @@ class PdfSlicerM(PdfProcessStrategy):
         return writer
 
 
-class PdfSlicerZ(PdfProcessStrategy):
-    def __init__(self: Self, ranges: list[int]) -> None:
+# parts of a split are handed to the worker processes in a few chunks per process, enough to
+# keep them all busy until the end without paying for the document being opened too often
+_CHUNKS_PER_WORKER = 2
+
+
+class PdfPartsStrategy(PdfProcessStrategy):
+    '''
+    Strategy whose result is a ZIP archive of independent parts, each built from some pages
+    of the document.
+
+    As the parts do not depend on each other, `upload_parallel` spreads them across the
+    worker processes of `pdf_engine`, each one opening the document by itself, while the
+    archive takes in the finished parts in order.
+    '''
+    content_type = 'application/zip'
+
+    def __init__(self: Self, compression: ZipCompression = ZipCompression.DEFLATED) -> None:
         super().__init__()
-        self.ranges:  list[tuple[int, int]] = list(pair(ranges))
-        self.writers: list[tuple[str, pypdf.PdfWriter]] = []
+        self.compression = compression
+        self.reader: Optional[pypdf.PdfReader] = None
+
+    @abstractmethod
+    def parts(self: Self) -> list[Any]:
+        '''Returns the description of every part, in archive order. They must be picklable.'''
+
+    @abstractmethod
+    def build_part(self: Self, reader: pypdf.PdfReader, part: Any) -> Optional[tuple[str, pypdf.PdfWriter]]:
+        '''Builds the writer of a part with its entry name, or returns None to leave the part out.'''
 
     @override
     def start_process(self: Self, reader: pypdf.PdfReader) -> None:
-        for index, r in enumerate(self.ranges):
-            start, end = r
-            writer = pypdf.PdfWriter()
+        self.reader = reader
+
+    @override
+    def get_storage(self: Self) -> LocalPDFZipFile:
+        return LocalPDFZipFile(self.build_writers(self.reader, self.parts()), self.filename, self.compression)  # type: ignore
+
+    def build_writers(self: Self, reader: pypdf.PdfReader, parts: list[Any]) -> Iterator[tuple[str, pypdf.PdfWriter]]:
+        # writers are built one at a time, while the archive consumes them
+        for part in parts:
+            built = self.build_part(reader, part)
+
+            if built:
+                yield built
+
+    async def upload_parallel(self: Self, source: StoredFile, upload_to: str) -> StoredFile:
+        parts = self.parts()
+        size = max(1, -(-len(parts) // (pdf_engine.max_workers * _CHUNKS_PER_WORKER)))
+        chunks = [parts[start:start+size] for start in range(0, len(parts), size)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            results = pdf_engine.map(_parts_job, [(self, source, chunk, directory) for chunk in chunks])
+            storage = LocalPDFZipFile(_written_parts(results), self.filename, self.compression)
+            return StoredFile(await storage.upload(upload_to), storage.size, storage.sha256)
 
-            for page in reader.pages[start-1:end]:
-                writer.add_page(page)
-            self.writers.append((f'range-[{index+1}].pdf', writer))
+
+class PdfSlicerZ(PdfPartsStrategy):
+    filename = 'split-pdf.zip'
+
+    def __init__(self: Self, ranges: list[int], compression: ZipCompression = ZipCompression.DEFLATED) -> None:
+        super().__init__(compression)
+        self.ranges:  list[tuple[int, int]] = list(pair(ranges))
+
+    @override
+    def parts(self: Self) -> list[tuple[int, tuple[int, int]]]:
+        return list(enumerate(self.ranges))
 
     @override
-    async def get_filemodel(self: Self, db: Session, user: Optional[User]) -> FileModel:
-        strategy = LocalPDFZipFile(self.writers, 'split-pdf.zip')
-        filemodel = file_utils.ResponseFileModelFactory('split-pdf.zip', 'application/zip').create_filemodel()
-        await filemodel.upload(db, strategy, upload_to=_get_target_path(user))
-        return filemodel
-    
+    def build_part(self: Self, reader: pypdf.PdfReader, part: tuple[int, tuple[int, int]]) -> tuple[str, pypdf.PdfWriter]:
+        index, (start, end) = part
+        writer = pypdf.PdfWriter()
+
+        for page in LazyPages(reader)[start-1:end]:
+            writer.add_page(page)
+        return (f'range-[{index+1}].pdf', writer)
+
 
 class PagesExtractM(PdfProcessStrategy):
+    filename = 'extracted pages-pdf.pdf'
+    content_type = 'application/pdf'
+
     def __init__(self: Self, pages: list[int]) -> None:
         super().__init__()
         self.pages = pages
-        self.writer = pypdf.PdfWriter()
+        # the writer is created by `start_process` inside the worker process, a PdfWriter
+        # does not survive being sent between processes
+        self.writer: Optional[pypdf.PdfWriter] = None
 
     @override
     def start_process(self: Self, reader: pypdf.PdfReader) -> None:
+        self.writer = pypdf.PdfWriter()
+        pages = LazyPages(reader)
+
         for index in self.pages:
             try:
-                page = reader.pages[index-1]
+                page = pages[index-1]
                 self.writer.add_page(page)
             except IndexError:
                 continue
 
     @override
-    async def get_filemodel(self: Self, db: Session, user: Optional[User]) -> FileModel:
-        filemodel = file_utils.ResponseFileModelFactory('extracted pages-pdf.pdf', 'application/pdf').create_filemodel()
-        strategy = LocalPdfWriterFile(self.writer, 'extracted pages-pdf.pdf')
-        await filemodel.upload(db, strategy, upload_to=_get_target_path(user))
-        return filemodel
+    def get_storage(self: Self) -> LocalPdfWriterFile:
+        return LocalPdfWriterFile(self.writer or pypdf.PdfWriter(), self.filename)
 
 
-class PagesExtractZ(PdfProcessStrategy):
-    def __init__(self: Self, pages: list[int]) -> None:
-        super().__init__()
+class PagesExtractZ(PdfPartsStrategy):
+    filename = 'extracted pages.zip'
+
+    def __init__(self: Self, pages: list[int], compression: ZipCompression = ZipCompression.DEFLATED) -> None:
+        super().__init__(compression)
         self.pages = pages
-        self.writers: list[tuple[str, pypdf.PdfWriter]] = []
 
     @override
-    def start_process(self: Self, reader: pypdf.PdfReader) -> None:
-        for index, page_number in enumerate(self.pages):
-            try:
-                writer = pypdf.PdfWriter()
-                page = reader.pages[page_number-1]
-                writer.add_page(page)
-                self.writers.append((f'page-[{index+1}].pdf', writer))
-            except IndexError:
-                continue
+    def parts(self: Self) -> list[tuple[int, int]]:
+        return list(enumerate(self.pages))
 
     @override
-    async def get_filemodel(self: Self, db: Session, user: Optional[User]) -> FileModel:
-        strategy = LocalPDFZipFile(self.writers, 'extracted pages.zip')
-        filemodel = file_utils.ResponseFileModelFactory('extracted pages.zip', 'application/zip').create_filemodel()
-        await filemodel.upload(db, strategy, upload_to=_get_target_path(user))
-        return filemodel
+    def build_part(self: Self, reader: pypdf.PdfReader, part: tuple[int, int]) -> Optional[tuple[str, pypdf.PdfWriter]]:
+        index, page_number = part
 
+        try:
+            writer = pypdf.PdfWriter()
+            writer.add_page(LazyPages(reader)[page_number-1])
+            return (f'page-[{index+1}].pdf', writer)
+        except IndexError:
+            return None
+
+
+# rough size of the header, catalog, page tree and trailer of a part, and of the
+# "n 0 obj ... endobj" wrapper plus xref entry of every object
+_PART_OVERHEAD = 1024
+_OBJECT_OVERHEAD = 48
+# keys pointing back up the page tree, following them would reach every page of the document
+_UPWARD_KEYS = ('/Parent', '/P')
+
+
+class SizeSplitZ(PdfProcessStrategy):
+    '''
+    Cuts a document into consecutive parts whose serialized size stays under `max_size` MB.
+
+    Pages are walked once. For every page the indirect objects it reaches (contents, fonts,
+    images and other resources) are collected and each object is measured only the first
+    time it is seen, so a part grows by the size of the objects it does not hold yet and
+    resources shared between pages are only counted once per part. Nothing is re-serialized
+    after a page is added, which keeps the whole split linear in the size of the document.
+    A single page larger than the limit ends up alone in its own part.
+    '''
+    filename = 'split-pdf.zip'
+    content_type = 'application/zip'
+
+    def __init__(self: Self, max_size: float, compression: ZipCompression = ZipCompression.DEFLATED) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.compression = compression
+        self.reader: Optional[pypdf.PdfReader] = None
+        self.__sizes: dict[int, int] = {}
 
-async def merge_pdf(db: Session, /, task: Task, strict: bool) -> FileModel:
+    @override
+    def start_process(self: Self, reader: pypdf.PdfReader) -> None:
+        self.reader = reader
+
+    @override
+    def get_storage(self: Self) -> LocalPDFZipFile:
+        return LocalPDFZipFile(self.__build_writers(), self.filename, self.compression)
+
+    def __build_writers(self: Self) -> Iterator[tuple[str, pypdf.PdfWriter]]:
+        budget = self.max_size * 1_000_000
+        pages: list[pypdf.PageObject] = []
+        objects: set[int] = set()
+        size = _PART_OVERHEAD
+        part = 1
+
+        for page in self.reader.pages:  # type: ignore
+            reachable = self.__collect(page)
+            cost = sum(self.__sizes[idnum] for idnum in reachable - objects)
+
+            if pages and size + cost > budget:
+                yield (f'part-[{part}].pdf', _write_pages(pages))
+                pages, objects, size, part = [], set(), _PART_OVERHEAD, part + 1
+                cost = sum(self.__sizes[idnum] for idnum in reachable)
+
+            pages.append(page)
+            objects |= reachable
+            size += cost
+
+        if pages:
+            yield (f'part-[{part}].pdf', _write_pages(pages))
+
+    def __collect(self: Self, page: pypdf.PageObject) -> set[int]:
+        # walks the objects reachable from the page without going back up the page tree
+        found: set[int] = set()
+        stack: list[PdfObject] = [page.indirect_reference or page]
+
+        while stack:
+            obj = stack.pop()
+
+            if isinstance(obj, IndirectObject):
+                if obj.idnum in found:
+                    continue
+                found.add(obj.idnum)
+                resolved = page if obj == page.indirect_reference else obj.get_object()
+
+                if obj.idnum not in self.__sizes:
+                    self.__sizes[obj.idnum] = _serialized_size(resolved)
+                obj = resolved
+
+            if isinstance(obj, DictionaryObject):
+                stack.extend(value for key, value in obj.items() if key not in _UPWARD_KEYS)
+            elif isinstance(obj, ArrayObject):
+                stack.extend(obj)
+        return found
+
+
+async def merge_pdf(db: AsyncSession, /, task: Task, strict: bool) -> FileModel:
     filemodels = task.files
-    writer = pypdf.PdfWriter()
-    strategy = LocalPdfWriterFile(writer, 'merged-pdf.pdf')
-    result = file_utils.ResponseFileModelFactory('merged-pdf.pdf', 'application/pdf').create_filemodel()
 
     if len(filemodels) < 2:
         raise errors.MERGE_ERROR
 
-    for filemodel in filemodels:
-        try:
-            reader = pypdf.PdfReader(filemodel.absolute_path)
-            writer.append(reader)
-            reader.close()
-        except:
-            if strict:
-                raise errors.NOT_PDF_ERROR
-            continue
-    await result.upload(db, strategy, upload_to=_get_target_path(task.user))
-    return result
+    try:
+        sources = [_source(filemodel) for filemodel in filemodels]
+        stored = await pdf_engine.submit(_merge_job, sources, strict, get_target_path(task.user))
+    except ValueError:
+        raise errors.NOT_PDF_ERROR
+    return await save_result(db, stored, 'merged-pdf.pdf', 'application/pdf')
 
 
-async def lock_pdf(db: Session, /, task: Task, password: str) -> FileModel:
+async def lock_pdf(db: AsyncSession, /, task: Task, password: str) -> FileModel:
     if len(task.files) == 0:
         raise errors.LOCK_ERROR
     filemodel = task.files[0]
-    result = file_utils.ResponseFileModelFactory('locked-pdf.pdf', 'application/pdf').create_filemodel()
-    strategy: LocalPdfWriterFile
 
     try:
-        reader = pypdf.PdfReader(filemodel.absolute_path)
-        writer = pypdf.PdfWriter()
-        strategy = LocalPdfWriterFile(writer, 'locked-pdf.pdf')
-
-        writer.append(reader)
-        writer.encrypt(password, None, True)
-        await result.upload(db, strategy, upload_to=_get_target_path(task.user))
-        reader.close()
-        return result
+        stored = await pdf_engine.submit(_lock_job, _source(filemodel), password, get_target_path(task.user))
+        return await save_result(db, stored, 'locked-pdf.pdf', 'application/pdf')
+    except HTTPException as error:
+        await db.rollback()
+        raise error
     except:
-        db.rollback()
+        await db.rollback()
         raise errors.LOCK_ERROR
 
 
-async def unlock_pdf(db: Session, /, task: Task, password: str) -> FileModel:
+async def unlock_pdf(db: AsyncSession, /, task: Task, password: str) -> FileModel:
     if len(task.files) == 0:
         raise errors.UNLOCK_ERROR
     filemodel = task.files[0]
     result = file_utils.ResponseFileModelFactory('unlocked-pdf.pdf', 'application/pdf').create_filemodel()
-    strategy: LocalPdfWriterFile
 
     try:
-        reader = pypdf.PdfReader(filemodel.absolute_path)
-        writer = ...
+        stored = await pdf_engine.submit(_unlock_job, _source(filemodel), password, get_target_path(task.user))
 
-        if reader.is_encrypted:
-            reader.decrypt(password)
-            writer = pypdf.PdfWriter(clone_from=reader)
-            strategy = LocalPdfWriterFile(writer, 'unlocked-pdf.pdf')
-            await result.upload(db, strategy, upload_to=_get_target_path(task.user))
+        if stored:
+            result = await save_result(db, stored, 'unlocked-pdf.pdf', 'application/pdf')
         return result
+    except HTTPException as error:
+        await db.rollback()
+        raise error
     except pypdf.errors.PyPdfError:
-        db.rollback()
+        await db.rollback()
         raise errors.UNLOCK_ERROR_WP
     except Exception:
-        db.rollback()
+        await db.rollback()
         raise errors.UNLOCK_ERROR
 
 
-async def rangesplit_pdf(db: Session, /, task: Task, ranges: list[int], merge: bool) -> FileModel:
+async def rangesplit_pdf(
+        db: AsyncSession,
+        /,
+        task: Task,
+        ranges: list[int],
+        merge: bool,
+        compression: ZipCompression = ZipCompression.DEFLATED
+) -> FileModel:
+    if len(task.files) == 0:
+        raise errors.SPLIT_ERROR
+    filemodel = task.files[0]
+
+    try:
+        pdfslicer = PdfSlicerM(ranges) if merge else PdfSlicerZ(ranges, compression)
+        stored = await _run_split(pdfslicer, _source(filemodel), get_target_path(task.user))
+        return await pdfslicer.get_filemodel(db, stored)
+    except HTTPException as error:
+        await db.rollback()
+        raise error
+    except Exception:
+        await db.rollback()
+        raise errors.SPLIT_ERROR
+
+
+async def pagesplit_pdf(
+        db: AsyncSession,
+        /,
+        task: Task,
+        pages: list[int],
+        merge: bool,
+        compression: ZipCompression = ZipCompression.DEFLATED
+) -> FileModel:
     if len(task.files) == 0:
         raise errors.SPLIT_ERROR
     filemodel = task.files[0]
 
     try:
-        pdfreader = pypdf.PdfReader(filemodel.path)
-        pdfslicer = PdfSlicerM(ranges) if merge else PdfSlicerZ(ranges)
-        pdfslicer.start_process(pdfreader)
-        return await pdfslicer.get_filemodel(db, task.user)
+        pdfslicer = PagesExtractM(pages) if merge else PagesExtractZ(pages, compression)
+        stored = await _run_split(pdfslicer, _source(filemodel), get_target_path(task.user))
+        return await pdfslicer.get_filemodel(db, stored)
+    except HTTPException as error:
+        await db.rollback()
+        raise error
     except Exception:
-        db.rollback()
+        await db.rollback()
         raise errors.SPLIT_ERROR
 
 
-async def pagesplit_pdf(db: Session, /, task: Task, pages: list[int], merge: bool) -> FileModel:
+async def sizesplit_pdf(
+        db: AsyncSession,
+        /,
+        task: Task,
+        max_size: float,
+        compression: ZipCompression = ZipCompression.DEFLATED
+) -> FileModel:
     if len(task.files) == 0:
         raise errors.SPLIT_ERROR
     filemodel = task.files[0]
 
     try:
-        pdfreader = pypdf.PdfReader(filemodel.path)
-        pdfslicer = PagesExtractM(pages) if merge else PagesExtractZ(pages)
-        pdfslicer.start_process(pdfreader)
-        return await pdfslicer.get_filemodel(db, task.user)
+        pdfslicer = SizeSplitZ(max_size, compression)
+        stored = await _run_split(pdfslicer, _source(filemodel), get_target_path(task.user))
+        return await pdfslicer.get_filemodel(db, stored)
+    except HTTPException as error:
+        await db.rollback()
+        raise error
     except Exception:
-        db.rollback()
+        await db.rollback()
         raise errors.SPLIT_ERROR
 
 
-def _get_target_path(user: Optional[User]) -> str:
+async def _run_split(pdfslicer: PdfProcessStrategy, source: StoredFile, upload_to: str) -> StoredFile:
+    if isinstance(pdfslicer, PdfPartsStrategy) and pdf_engine.max_workers > 1 and len(pdfslicer.parts()) > 1:
+        return await pdfslicer.upload_parallel(source, upload_to)
+    return await pdf_engine.submit(_split_job, pdfslicer, source, upload_to)
+
+
+def _source(filemodel: FileModel) -> StoredFile:
+    # the digest recorded with the input lets the workers reuse what they parsed of the same content
+    return StoredFile(filemodel.absolute_path, filemodel.size, filemodel.sha256)
+
+
+async def save_result(db: AsyncSession, stored: StoredFile, filename: str, content_type: str) -> FileModel:
+    '''
+    Adds the row of a written result to the session. It is committed by the caller, in the
+    same transaction that completes the task.
+    '''
+    result = file_utils.ResponseFileModelFactory(filename, content_type).create_filemodel()
+    await result.upload(db, LocalExistingFile(*stored), upload_to='', commit=False)
+    return result
+
+
+# The jobs below run inside the worker processes of `pdf_engine`. They only receive plain
+# values (inputs, passwords, strategies that have not been started yet), do all the pypdf
+# work and hand back the written result, with the size and digest taken while writing it.
+# The time of each phase goes to `pdf_phases`, parsing is timed by `open_reader` and
+# serializing by the storage itself. Inputs are only readable inside `open_reader`, so
+# everything that reads them, writing the result included, happens within it.
+
+@contextmanager
+def open_reader(source: StoredFile) -> Iterator[pypdf.PdfReader]:
+    '''
+    Parses a stored input, memory mapped when it is larger than `MMAP_THRESHOLD`, and closes
+    it when the block ends. Objects not read by then can no longer be read.
+
+    Inputs with a recorded digest are opened from the `DocumentIndex` of their content kept in
+    `document_cache` by an earlier reader of this process, and leave theirs there when done.
+    '''
+    index = document_cache.get(source.sha256) if source.sha256 and document_cache.enabled else None
+
+    with open_stored(source.path) as stream:
+        with pdf_phases.labels('parse').time():
+            reader = IndexedPdfReader(stream, index)
+
+        try:
+            yield reader
+        finally:
+            # put back even on a hit, the pages found since then make it grow
+            if source.sha256:
+                document_cache.put(source.sha256, reader.index, reader.index.size)
+            reader.close()
+
+
+def _merge_job(sources: list[StoredFile], strict: bool, upload_to: str) -> StoredFile:
+    if sum(os.path.getsize(source.path) for source in sources) > MERGE_STREAMING_THRESHOLD * 1_000_000:
+        merger = StreamingPdfMerger([source.path for source in sources], strict)
+        return _write(LocalPdfWriterFile(merger, 'merged-pdf.pdf'), upload_to)
+
+    writer = pypdf.PdfWriter()
+
+    for source in sources:
+        try:
+            # the copied pages no longer need the reader once appended
+            with open_reader(source) as reader, pdf_phases.labels('page_copy').time():
+                writer.append(reader)
+        except Exception:
+            if strict:
+                raise ValueError(f'{source.path} is not a PDF file')
+            continue
+    return _write(LocalPdfWriterFile(writer, 'merged-pdf.pdf'), upload_to)
+
+
+def _lock_job(source: StoredFile, password: str, upload_to: str) -> StoredFile:
+    with open_reader(source) as reader:
+        writer = pypdf.PdfWriter()
+
+        with pdf_phases.labels('page_copy').time():
+            writer.append(reader)
+        with pdf_phases.labels('encrypt').time():
+            writer.encrypt(password, None, True)
+        return _write(LocalPdfWriterFile(writer, 'locked-pdf.pdf'), upload_to)
+
+
+def _unlock_job(source: StoredFile, password: str, upload_to: str) -> Optional[StoredFile]:
+    with open_reader(source) as reader:
+        if not reader.is_encrypted:
+            return None
+        with pdf_phases.labels('decrypt').time():
+            reader.decrypt(password)
+        with pdf_phases.labels('page_copy').time():
+            writer = pypdf.PdfWriter(clone_from=reader)
+        return _write(LocalPdfWriterFile(writer, 'unlocked-pdf.pdf'), upload_to)
+
+
+def _split_job(pdfslicer: PdfProcessStrategy, source: StoredFile, upload_to: str) -> StoredFile:
+    with open_reader(source) as reader:
+        with pdf_phases.labels('page_copy').time():
+            pdfslicer.start_process(reader)
+        # the parts are built from the reader while they are written
+        return _write(pdfslicer.get_storage(), upload_to)
+
+
+def _write(storage: LocalPdfWriterFile | LocalPDFZipFile, upload_to: str) -> StoredFile:
+    path = storage.write(upload_to)
+    return StoredFile(path, storage.size, storage.sha256)
+
+
+def _parts_job(pdfslicer: PdfPartsStrategy, source: StoredFile, parts: list[Any], directory: str) -> list[tuple[str, str]]:
+    written = []
+
+    with open_reader(source) as reader:
+        for filename, writer in pdfslicer.build_writers(reader, parts):
+            handle, filepath = tempfile.mkstemp(suffix='.pdf', dir=directory)
+
+            with os.fdopen(handle, 'wb') as file, pdf_phases.labels('serialize').time():
+                writer.write(file)
+            written.append((filename, filepath))
+    return written
+
+
+def _serialized_size(obj: PdfObject) -> int:
+    buffer = io.BytesIO()
+
+    if isinstance(obj, StreamObject):
+        # measure the dictionary only, the stream data is written as is
+        DictionaryObject.write_to_stream(obj, buffer)
+        return buffer.tell() + len(obj._data) + _OBJECT_OVERHEAD
+    obj.write_to_stream(buffer)
+    return buffer.tell() + _OBJECT_OVERHEAD
+
+
+def _write_pages(pages: list[pypdf.PageObject]) -> pypdf.PdfWriter:
+    writer = pypdf.PdfWriter()
+
+    for page in pages:
+        writer.add_page(page)
+    return writer
+
+
+class _WrittenPart:
+    '''A part already serialized by a worker process, moved into the archive as is.'''
+
+    def __init__(self: Self, filepath: str) -> None:
+        self.filepath = filepath
+
+    def write(self: Self, stream: BinaryIO) -> None:
+        with open(self.filepath, 'rb') as file:
+            shutil.copyfileobj(file, stream)
+        os.remove(self.filepath)
+
+
+async def _written_parts(results: AsyncIterator[list[tuple[str, str]]]) -> AsyncIterator[tuple[str, _WrittenPart]]:
+    async with aclosing(results):
+        async for written in results:
+            for filename, filepath in written:
+                yield (filename, _WrittenPart(filepath))
+
+
+def get_target_path(user: Optional[User]) -> str:
     if user:
         return f'{user.email}/results'
-    return 'temp/results'
\ No newline at end of file
+    return 'temp/results'
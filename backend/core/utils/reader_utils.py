@@ -0,0 +1,117 @@
+from typing import Any, BinaryIO, Optional, Self, override
+
+import pypdf
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, PdfObject
+
+# (object number, generation) of an indirect object, without the reader it belongs to
+Reference = tuple[int, int]
+
+# rough memory taken by an entry of the cross-reference tables, by a known page, by the count
+# of a kid of the page tree and by the rest of an index, used to bound the cache of indexes
+_XREF_ENTRY_SIZE = 160
+_PAGE_SIZE = 200
+_KID_END_SIZE = 16
+_INDEX_OVERHEAD = 2048
+
+
+class DocumentIndex:
+    '''
+    What parsing a document learns before reading any of its objects: the cross-reference
+    tables (where every object is), the trailer, and as they are found the number of pages,
+    the number of pages under the kids of each /Pages node and where each page sits in the
+    page tree. Whether the document is encrypted comes with the trailer.
+
+    It only depends on the bytes of the document, so it is kept in `document_cache` by their
+    SHA-256 digest and a reader of the same content opens from it instead of finding the
+    xref, reading every table and checking every entry against the file. Nothing decrypted is
+    kept, an encrypted document still checks its password in every reader.
+    '''
+
+    def __init__(
+            self: Self,
+            xref: dict[int, dict[Any, Any]],
+            xref_free_entry: dict[int, dict[Any, Any]],
+            xref_objStm: dict[int, tuple[Any, Any]],
+            xref_index: int,
+            startxref: int,
+            trailer: DictionaryObject
+    ) -> None:
+        self.xref = xref
+        self.xref_free_entry = xref_free_entry
+        self.xref_objStm = xref_objStm
+        self.xref_index = xref_index
+        self.startxref = startxref
+        self.trailer = trailer
+        self.pages: Optional[int] = None
+        # page index -> the page and the /Pages nodes above it that it inherits from, root first
+        self.page_refs: dict[int, tuple[Reference, tuple[Reference, ...]]] = {}
+        # /Pages node -> where the pages under each of its kids end, once checked against its /Count
+        self.kid_ends: dict[Reference, list[int]] = {}
+
+    @classmethod
+    def capture(cls: type[Self], reader: pypdf.PdfReader) -> Self:
+        '''Takes the index of a reader that has just been opened, before it is closed.'''
+        return cls(
+            _copy_tables(reader.xref),
+            _copy_tables(reader.xref_free_entry),
+            dict(reader.xref_objStm),
+            reader.xref_index,
+            reader._startxref,
+            _detach(reader.trailer, None),  # type: ignore
+        )
+
+    def restore(self: Self, reader: pypdf.PdfReader) -> None:
+        '''Gives the reader the state `PdfReader.read` would have left it in.'''
+        # readers may change their tables when they come across broken objects
+        reader.xref = _copy_tables(self.xref)
+        reader.xref_free_entry = _copy_tables(self.xref_free_entry)
+        reader.xref_objStm = dict(self.xref_objStm)
+        reader.xref_index = self.xref_index
+        reader._startxref = self.startxref
+        reader.trailer = _detach(self.trailer, reader)  # type: ignore
+
+    @property
+    def size(self: Self) -> int:
+        entries = sum(map(len, self.xref.values())) + sum(map(len, self.xref_free_entry.values())) + len(self.xref_objStm)
+        kids = sum(map(len, self.kid_ends.values()))
+        return (
+            _INDEX_OVERHEAD
+            + entries * _XREF_ENTRY_SIZE
+            + len(self.page_refs) * _PAGE_SIZE
+            + kids * _KID_END_SIZE
+        )
+
+
+class IndexedPdfReader(pypdf.PdfReader):
+    '''
+    A `pypdf.PdfReader` opened from the `DocumentIndex` of its content when one is given,
+    which replaces the parsing of the xref and trailer; everything else works as in any reader.
+    Its own index, given or captured when it was opened, is in `index`.
+    '''
+
+    def __init__(self: Self, stream: BinaryIO, index: Optional[DocumentIndex] = None) -> None:
+        # read() is called by the constructor of the reader
+        self.__given = index
+        super().__init__(stream)
+        self.index = index or DocumentIndex.capture(self)
+
+    @override
+    def read(self: Self, stream: BinaryIO) -> None:
+        if self.__given is None:
+            return super().read(stream)
+        self.__given.restore(self)
+
+
+def _copy_tables(tables: dict[int, Any]) -> dict[int, Any]:
+    return {key: dict(entries) for key, entries in tables.items()}
+
+
+def _detach(obj: PdfObject, pdf: Optional[pypdf.PdfReader]) -> PdfObject:
+    '''Copies the containers of `obj`, with its references pointing into `pdf`.'''
+    if isinstance(obj, IndirectObject):
+        return IndirectObject(obj.idnum, obj.generation, pdf)  # type: ignore
+    if isinstance(obj, DictionaryObject):
+        return DictionaryObject({NameObject(key): _detach(value, pdf) for key, value in dict.items(obj)})
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_detach(value, pdf) for value in list.__iter__(obj))
+    return obj
@@ -1,34 +1,74 @@
 import hashlib
+from typing import Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached, selectinload
 
 from ..models import user as models
 from ..schemas import user as schemas
+from ..services import tasks_service as ts
+from ..services.cache_service import user_cache
+from ...config import ADMIN_EMAILS
 
 
-def create_user(db: Session, *, user_in: schemas.UserCreate):
+async def create_user(db: AsyncSession, *, user_in: schemas.UserCreate):
     sha256 = hashlib.sha256()
     sha256.update(user_in.password.encode('utf-8'))
     user_in.password = sha256.hexdigest()
 
     db_user = models.User(**user_in.model_dump())
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     # db.rollback()
     return db_user
 
 
-def get_by_email(db: Session, *, email: str):
-    user_db = db.query(models.User).where(models.User.email == email).first()
+async def get_by_email(db: AsyncSession, *, email: str):
+    user_db = (await db.execute(select(models.User).where(models.User.email == email))).scalar()
     return user_db
 
 
-def get_by_username(db: Session, *, username: str):
-    user_db = db.query(models.User).where(models.User.first_name == username).first()
+async def get_by_email_cached(db: AsyncSession, *, email: str):
+    '''
+    Same as `get_by_email`, but served from `user_cache` when possible. Only active users
+    are cached, a cached user is merged into the session without a query.
+    '''
+    values = user_cache.get(email)
+
+    if values is not None:
+        user = models.User(**values)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    user_db = await get_by_email(db, email=email)
+
+    if user_db and user_db.is_active:
+        user_cache.put(email, {column.key: getattr(user_db, column.key) for column in inspect(models.User).column_attrs})
+    return user_db
+
+
+async def get_by_username(db: AsyncSession, *, username: str):
+    user_db = (await db.execute(select(models.User).where(models.User.first_name == username))).scalar()
     return user_db
 
 
-def get_by_id(db: Session, *, user_id: int):
-    user_db = db.get(models.User, user_id)
+async def get_by_id(db: AsyncSession, *, user_id: int):
+    user_db = await db.get(models.User, user_id)
     return user_db
+
+
+def is_admin(user: Optional[models.User]) -> bool:
+    '''Whether the user is one of the administrators listed in `ADMIN_EMAILS`.'''
+    return user is not None and user.email.lower() in ADMIN_EMAILS
+
+
+async def load_tasks(db: AsyncSession, *, user: models.User) -> models.User:
+    '''Loads the tasks of the user, with everything `TaskSchema` serializes of each one.'''
+    query = (
+        select(models.User)
+        .where(models.User.pk == user.pk)
+        .options(selectinload(models.User.tasks).options(*ts.DETAILS_LOAD))
+        .execution_options(populate_existing=True)
+    )
+    return (await db.execute(query)).scalar_one()
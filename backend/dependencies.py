@@ -1,29 +1,29 @@
-from typing import Any, Annotated, Generator, Optional
+import hmac
+from typing import Annotated, AsyncGenerator, Awaitable, Callable, Optional, Sequence
 
 import jwt
-from fastapi import Body, UploadFile, File, Depends, HTTPException, Query
+from fastapi import Body, UploadFile, File, Depends, Header, HTTPException, Query
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.base import ExecutableOption
 
 from . import config
-from .core.db import SessionLocal
+from .core.db import AsyncSessionLocal
 from .core.models import User, FileModel, Task
+from .core.services import tasks_service as ts
 from .core.utils import file_utils, user_utils
 from .core import errors
 
 __oauth2 = OAuth2PasswordBearer(tokenUrl='/accounts/authenticate/sign-in', auto_error=False)
 
 
-def get_db() -> Generator[Session, Any, None]:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def current_user_or_none(
-        db: Annotated[Session, Depends(get_db)],
+async def current_user_or_none(
+        db: Annotated[AsyncSession, Depends(get_db)],
         token: Annotated[Optional[str], Depends(__oauth2)]
 ) -> Optional[User]:
     '''
@@ -36,7 +36,7 @@ def current_user_or_none(
     account), it returns None.
 
     Args:
-        db (Session): Database session dependency.
+        db (AsyncSession): Database session dependency.
         token (str): JWT token used for authenticating the user.
 
     Returns:
@@ -47,14 +47,14 @@ def current_user_or_none(
         return None
 
     try:
-        user = __get_current_user(db, token)
+        user = await __get_current_user(db, token)
         return user
     except HTTPException:
         return None
 
 
-def current_user_or_raise(
-        db: Annotated[Session, Depends(get_db)],
+async def current_user_or_raise(
+        db: Annotated[AsyncSession, Depends(get_db)],
         token: Annotated[str, Depends(__oauth2)]
 ) -> User:
     '''
@@ -68,7 +68,7 @@ def current_user_or_raise(
     appropriate exception will be raised.
 
     Args:
-        db (Session): Database session dependency.
+        db (AsyncSession): Database session dependency.
         token (str): JWT token used for authenticating the user.
 
     Returns:
@@ -79,7 +79,58 @@ def current_user_or_raise(
         USER_NOT_FOUND_ERROR: If no user is found for the provided email.
         INACTIVE_USER_ERROR: If the user exists but their account is inactive.
     '''
-    return __get_current_user(db, token)
+    return await __get_current_user(db, token)
+
+
+def admin_or_raise(
+        user: Annotated[User, Depends(current_user_or_raise)]
+) -> User:
+    '''
+    Retrieve the current authenticated user, who must be one of the administrators listed in
+    `ADMIN_EMAILS`.
+
+    Raises:
+        ADMIN_REQUIRED: If the user is not an administrator.
+    '''
+    if user_utils.is_admin(user):
+        return user
+    raise errors.ADMIN_REQUIRED
+
+
+async def operator_or_raise(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        token: Annotated[Optional[str], Depends(__oauth2)]
+) -> None:
+    '''
+    Lets through the requests to the operational endpoints: the ones bearing `INTERNAL_TOKEN`,
+    as scrapers send it, and the ones of the administrators listed in `ADMIN_EMAILS`.
+
+    Raises:
+        ADMIN_REQUIRED: If the request bears neither.
+    '''
+    if token and config.INTERNAL_TOKEN and hmac.compare_digest(token.encode(), config.INTERNAL_TOKEN.encode()):
+        return
+    if not user_utils.is_admin(await current_user_or_none(db, token)):
+        raise errors.ADMIN_REQUIRED
+
+
+def profiling_requested(
+        user: Annotated[Optional[User], Depends(current_user_or_none)],
+        x_profile: Annotated[bool, Header(description='profile the operation, administrators only')] = False,
+        profile: Annotated[bool, Query(description='profile the operation, administrators only')] = False
+) -> bool:
+    '''
+    Whether the PDF operation must run under the profiler, asked for with the `X-Profile`
+    header or the `profile` query flag.
+
+    Raises:
+        ADMIN_REQUIRED: If the profile is asked for by someone who is not an administrator.
+    '''
+    if not (x_profile or profile):
+        return False
+    if user_utils.is_admin(user):
+        return True
+    raise errors.ADMIN_REQUIRED
 
 
 def file_upload(
@@ -107,16 +158,55 @@ def file_upload(
     return file
 
 
-def get_task(db: Annotated[Session, Depends(get_db)], task_id: int) -> Task:
-    task = db.query(Task).where(Task.pk == task_id).first()
+def files_upload(
+        files: Annotated[list[UploadFile], File(...)]
+) -> list[UploadFile]:
+    '''
+    Handles the upload of several files at once, checking their total size.
+
+    Each file is still limited to `MAX_FILE_SIZE` while it is stored, the total of all of
+    them is limited to `MAX_BATCH_SIZE`.
+
+    Raises:
+        HTTPException: If the files together exceed the maximum allowed size.
+    '''
+    file_utils.check_size_or_raise(files, config.MAX_BATCH_SIZE)
+    return files
+
+
+def task_loader(options: Sequence[ExecutableOption]) -> Callable[..., Awaitable[Task]]:
+    '''
+    Builds a dependency that retrieves the task of the `task_id` parameter, loading only the
+    relationships the route uses.
+
+    Args:
+        options (Sequence[ExecutableOption]): Loader options of the relationships, one of
+            the profiles of `tasks_service`.
+
+    Raises:
+        INVALID_TASK: If the task does not exist.
+    '''
+    async def load_task(db: Annotated[AsyncSession, Depends(get_db)], task_id: int) -> Task:
+        task = await ts.get_task(db, task_id=task_id, options=options)
+
+        if task:
+            return task
+        raise errors.INVALID_TASK
+    return load_task
+
 
-    if task:
-        return task
-    raise errors.INVALID_TASK
+# the task with everything `TaskSchema` serializes
+get_task = task_loader(ts.DETAILS_LOAD)
+# the task with its status, to check it before changing it
+get_task_status = task_loader(ts.STATUS_LOAD)
+# the task with its result, for downloads
+get_task_result = task_loader(ts.RESULT_LOAD)
+# the task with the profile of its last run
+get_task_profile = task_loader(ts.PROFILE_LOAD)
 
 
-def get_file_or_raise(
-        db: Annotated[Session, Depends(get_db)],
+async def get_file_or_raise(
+        db: Annotated[AsyncSession, Depends(get_db)],
         user: Annotated[User, Depends(current_user_or_none)],
         path: Annotated[str, Query(...)]
 ) -> FileModel:
@@ -127,7 +217,7 @@ def get_file_or_raise(
     If the file is not found or if the user is not authorized to access it, an error is raised.
 
     Args:
-        db (Session): The database session used to query the file.
+        db (AsyncSession): The database session used to query the file.
         user (ModelUser): The current user attempting to access the file.
         path (str): The file path to be used for retrieving the file model.
 
@@ -138,7 +228,7 @@ def get_file_or_raise(
         errors.FILE_NOT_FOUND_ERROR: If the file is not found in the database.
         errors.FILE_ACCESS_DENIED: If the user does not have access to the file (either because they are not the owner or access is restricted).
     '''
-    filemodel = file_utils.get_filemodel(db, file_url=path)
+    filemodel = await file_utils.get_filemodel(db, file_url=path, user=user)
 
     if not filemodel:
         raise errors.FILE_NOT_FOUND_ERROR
@@ -148,8 +238,8 @@ def get_file_or_raise(
     raise errors.FILE_ACCESS_DENIED
 
 
-def __get_current_user(
-        db: Session,
+async def __get_current_user(
+        db: AsyncSession,
         token: Optional[str]
 ) -> User:
     user_db = ...
@@ -161,7 +251,7 @@ def __get_current_user(
     except jwt.PyJWTError:
         raise errors.INVALID_CREDENTIALS_ERROR
 
-    user_db = user_utils.get_by_email(db, email=email)
+    user_db = await user_utils.get_by_email_cached(db, email=email)
 
     if not user_db:
         raise errors.USER_NOT_FOUND_ERROR
@@ -5,7 +5,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from . import routers
 from .core import db
 from .core.services import tasks_service as ts
-from .config import ALLOWED_HOSTS, BASE_DIR
+from .core.services.execution_service import pdf_engine
+from .core.services.metrics_service import Publisher, RequestMetricsMiddleware, registry
+from .config import ALLOWED_HOSTS, BASE_DIR, METRICS_DIR, METRICS_PUBLISH_INTERVAL
 
 def __init_services():
     session = db.SessionLocal()
@@ -16,12 +18,15 @@ def __init_services():
         session.close
 
 
-db.Base.metadata.create_all(bind=db.engine)
+# creates the tables, or adds what an existing database created by an earlier version misses
+db.upgrade_schema(db.engine)
 app = FastAPI(title='iHate PyPDF', version='2.1.1')
 app.include_router(routers.accounts.router)
 app.include_router(routers.pdf_tools.router)
 app.include_router(routers.storage.router)
 app.include_router(routers.tasks.router)
+app.include_router(routers.internal.router)
+app.include_router(routers.internal.metrics_router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_HOSTS,
@@ -30,5 +35,12 @@ app.add_middleware(
     allow_headers=['*'],
     expose_headers=['x-error']
 )
+# added last so it wraps everything else, the latency includes the other middlewares
+app.add_middleware(RequestMetricsMiddleware)
+publisher = Publisher(registry, METRICS_DIR, METRICS_PUBLISH_INTERVAL)
+app.add_event_handler('startup', publisher.start)
+app.add_event_handler('shutdown', publisher.stop)
+app.add_event_handler('shutdown', pdf_engine.shutdown)
+app.add_event_handler('shutdown', db.async_engine.dispose)
 app.mount('/' + BASE_DIR + '/static', StaticFiles(directory='static'), name='static')
 __init_services()
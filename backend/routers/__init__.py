@@ -1,7 +1,8 @@
-from . import accounts, pdf_tools, storage, tasks
+from . import accounts, internal, pdf_tools, storage, tasks
 
 __all__ = [
     'accounts',
+    'internal',
     'pdf_tools',
     'storage',
     'tasks'
@@ -5,13 +5,14 @@ from typing import Annotated, Any
 import jwt
 from fastapi import APIRouter, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import config
 from ..core import errors
 from ..core.models.user import User
 from ..core.schemas import Token
 from ..core.schemas import user as schemas
+from ..core.services.cache_service import user_cache
 from ..core.utils import user_utils
 from ..dependencies import current_user_or_raise, get_db
 
@@ -23,8 +24,8 @@ SECRET_KEY = config.SECRET_KEY
 ALGORITHM = config.ALGORITHM
 
 
-def __authenticate_user(db: Session, *, user_email: str, password: str) -> User:
-    db_user: User = user_utils.get_by_email(db, email=user_email)
+async def __authenticate_user(db: AsyncSession, *, user_email: str, password: str) -> User:
+    db_user: User = await user_utils.get_by_email(db, email=user_email)
 
     if not db_user:
         raise errors.USER_NOT_FOUND_ERROR
@@ -43,25 +44,26 @@ def __create_token(data: dict[str, Any], *, expires_delta: timedelta = timedelta
 
 
 @router.post('/authenticate/sign-up', response_model=schemas.UserSchema, status_code=status.HTTP_201_CREATED)
-def create_user(
+async def create_user(
         user_in: schemas.UserCreate,
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)]
 ) -> User:
-    user_db: User = user_utils.get_by_email(db, email=user_in.email)
+    user_db: User = await user_utils.get_by_email(db, email=user_in.email)
     create = ...
 
     if user_db:
         raise errors.EMAIL_IN_USE_ERROR
-    create = user_utils.create_user(db, user_in=user_in)
+    create = await user_utils.create_user(db, user_in=user_in)
+    await create.awaitable_attrs.tasks
     return create
 
 
 @router.post('/authenticate/sign-in', response_model=Token)
-def login_user(
+async def login_user(
     auth_form: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_db)]
 ) -> dict[str, str]:
-    user = __authenticate_user(db, user_email=auth_form.username, password=auth_form.password)
+    user = await __authenticate_user(db, user_email=auth_form.username, password=auth_form.password)
     token = __create_token({'sub': user.email}, expires_delta=timedelta(minutes=30))
 
     return {'access_token': token, 'token_type': 'bearer'}
@@ -69,17 +71,23 @@ def login_user(
 
 @router.put('/authenticate/edit', response_model=schemas.UserSchema)
 async def edit_user(
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     user: Annotated[User, Depends(current_user_or_raise)],
     edit: schemas.UserEdit
 ) -> User:
+    email = user.email
     user.first_name = edit.first_name
     user.last_name = edit.last_name
     user.email = edit.email
-    user.update(db)
-    return user
+    await user.update(db)
+    user_cache.invalidate(email, user.email)
+    return await user_utils.load_tasks(db, user=user)
 
 
 @router.get('/users/current', response_model=schemas.UserSchema)
-def user_profile(user: Annotated[User, Depends(current_user_or_raise)]) -> User:
-    return user
+async def user_profile(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    user: Annotated[User, Depends(current_user_or_raise)]
+) -> User:
+    # the tasks of a user are only loaded for the profile, not on every authenticated request
+    return await user_utils.load_tasks(db, user=user)
@@ -0,0 +1,56 @@
+from typing import Annotated, Any
+
+from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import config
+from ..core.services import jobs_service as js
+from ..core.services import metrics_service as ms
+from ..core.services.metrics_service import registry
+from ..dependencies import get_db, operator_or_raise
+
+# operational endpoints, left out of the OpenAPI schema and only answered to administrators
+# and to the bearers of `INTERNAL_TOKEN`
+router = APIRouter(
+    prefix='/internal', tags=['Internal'], include_in_schema=False, dependencies=[Depends(operator_or_raise)]
+)
+# scraped at the path Prometheus expects, outside of the prefix, with the same access
+metrics_router = APIRouter(tags=['Internal'], include_in_schema=False, dependencies=[Depends(operator_or_raise)])
+
+
+@router.get('/metrics/db-pool')
+async def db_pool_metrics() -> dict[str, Any]:
+    """
+    Connection pool of the database engine of this process.
+    - **settings**: Configured size, overflow, timeout, recycle and pre-ping.
+    - **metrics**: Connections in use, idle and in overflow, timeouts, and the histogram of
+      the time spent getting a connection.
+    """
+    return {
+        'settings': {
+            'pool_size': config.DB_POOL_SIZE,
+            'max_overflow': config.DB_MAX_OVERFLOW,
+            'pool_timeout': config.DB_POOL_TIMEOUT,
+            'pool_recycle': config.DB_POOL_RECYCLE,
+            'pool_pre_ping': config.DB_POOL_PRE_PING,
+        },
+        'metrics': registry.snapshot('db_pool_'),
+    }
+
+
+@metrics_router.get('/metrics', response_class=PlainTextResponse)
+async def metrics(db: Annotated[AsyncSession, Depends(get_db)]) -> PlainTextResponse:
+    """
+    Metrics of this process in the Prometheus text exposition format, added up with the ones
+    the other processes published to `METRICS_DIR`, plus the jobs in each status.
+    """
+    jobs = ms.Gauge('jobs', 'Jobs in each status, the queued ones are the depth of the queue', labelnames=('status',))
+
+    for status, count in (await js.count_by_status(db)).items():
+        jobs.labels(status).set(count)
+
+    others = await run_in_threadpool(ms.published, config.METRICS_DIR, 3 * config.METRICS_PUBLISH_INTERVAL)
+    body = ms.render(registry.export(), *others, {jobs.name: jobs.export()})
+    return PlainTextResponse(body, media_type=ms.EXPOSITION_CONTENT_TYPE)
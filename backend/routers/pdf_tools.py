@@ -1,34 +1,58 @@
-from typing import Annotated
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, Query, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..core import errors
 from ..core.models import Task, User
 from ..core.schemas import TaskSchema
-from ..core.services.storage_service import LocalExistingFile
+from ..core.services import jobs_service as js
 from ..core.services import tasks_service as ts
+from ..core.services.storage_service import ZipCompression
 from ..core.utils import pdf_utils
-from ..dependencies import get_db, get_task, current_user_or_none
+from ..dependencies import get_db, get_task, current_user_or_none, profiling_requested
 
 router = APIRouter(prefix='/pdf-utilities', tags=['PDF Utilities'])
 
 
-async def __clear_files(db: Session, task_id: int):
-    strategy = LocalExistingFile('')
-    task = db.query(Task).where(Task.pk == task_id).first()
-    files = task.files # type: ignore
+async def __enqueue(
+        db: AsyncSession,
+        task: Task,
+        user: User,
+        process: ts.ProcessTypes,
+        params: dict[str, Any],
+        profile: bool = False
+) -> Task:
+    '''
+    Queues the PDF operation for the job workers and returns the task right away.
 
-    for filemodel in files:
-        await filemodel.delete(db, strategy)
+    The task is moved to `task_in_progress`; clients poll `/tasks/{task_id}` until the
+    workers move it to `task_completed` or `task_failed`. A profiled operation skips the
+    result cache, its profile is downloaded from `/tasks/profile/{task_id}` once it is done.
+    '''
+    if not task.check_ownership(user):
+        raise errors.FORBIDDEN_TASK
+    if ts.is_completed(task):
+        raise errors.COMPLETED_TASK
+    if ts.is_in_progress(task):
+        raise errors.TASK_IN_PROGRESS
+
+    if profile:
+        params = params | {'profile': True}
+
+    await js.enqueue(db, task, process, params)
+    ts.set_task_in_progress(task)
+    ts.set_process(task, process)
+    await task.update(db)
+    return task
 
 
 @router.post('/merge', response_model=TaskSchema)
 async def merge_pdf(
-        background_tasks: BackgroundTasks,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         task: Annotated[Task, Depends(get_task)],
         user: Annotated[User, Depends(current_user_or_none)],
+        profile: Annotated[bool, Depends(profiling_requested)],
         strict: Annotated[bool, Query(..., description='strict mode')] = False
 ) -> Task:
     """
@@ -36,30 +60,15 @@ async def merge_pdf(
     - **strict**: If false then non-PDF files will be ignored. Otherwise, an error will be raised.
     - **upload_files**: Files to be merged.
     """
-    background_tasks.add_task(__clear_files, db, task.pk)
-    if not task.check_ownership(user):
-        raise errors.FORBIDDEN_TASK
-    if ts.is_completed(task):
-        raise errors.COMPLETED_TASK
-
-    try:
-        task.result = await pdf_utils.merge_pdf(db, task, strict)
-        ts.set_task_completed(task)
-        ts.set_process(task, ts.ProcessTypes.MERGE)
-        task.update(db)
-        return task
-    except Exception as error:
-        ts.set_task_failed(task)
-        task.update(db)
-        raise error
+    return await __enqueue(db, task, user, ts.ProcessTypes.MERGE, {'strict': strict}, profile)
 
 
 @router.post('/lock', response_model=TaskSchema)
 async def lock_pdf(
-        background_tasks: BackgroundTasks,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         task: Annotated[Task, Depends(get_task)],
         user: Annotated[User, Depends(current_user_or_none)],
+        profile: Annotated[bool, Depends(profiling_requested)],
         password: Annotated[str, Query(..., description='password to unlock the PDF file')]
 ) -> Task:
     """
@@ -67,30 +76,15 @@ async def lock_pdf(
     - **uploaded_files**: Files to be protected.
     - **password**: Password to protect the PDF file.
     """
-    background_tasks.add_task(__clear_files, db, task.pk)
-    if not task.check_ownership(user):
-        raise errors.FORBIDDEN_TASK
-    if ts.is_completed(task):
-        raise errors.COMPLETED_TASK
-
-    try:
-        task.result = await pdf_utils.lock_pdf(db, task, password)
-        ts.set_task_completed(task)
-        ts.set_process(task, ts.ProcessTypes.LOCK)
-        task.update(db)
-        return task
-    except Exception as error:
-        ts.set_task_failed(task)
-        task.update(db)
-        raise error
+    return await __enqueue(db, task, user, ts.ProcessTypes.LOCK, {'password': password}, profile)
 
 
 @router.post('/unlock', response_model=TaskSchema)
 async def unlock_pdf(
-        background_tasks: BackgroundTasks,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         task: Annotated[Task, Depends(get_task)],
         user: Annotated[User, Depends(current_user_or_none)],
+        profile: Annotated[bool, Depends(profiling_requested)],
         password: Annotated[str, Query(..., description='password to unlock the PDF file')]
 ) -> Task:
     """
@@ -98,73 +92,64 @@ async def unlock_pdf(
     - **upload_file**: File to be unlocked.
     - **password**: Password to unlock the PDF file.
     """
-    background_tasks.add_task(__clear_files, db, task.pk)
-    if not task.check_ownership(user):
-        raise errors.FORBIDDEN_TASK
-    if ts.is_completed(task):
-        raise errors.COMPLETED_TASK
+    return await __enqueue(db, task, user, ts.ProcessTypes.UNLOCK, {'password': password}, profile)
 
-    try:
-        task.result = await pdf_utils.unlock_pdf(db, task, password)
-        ts.set_task_completed(task)
-        ts.set_process(task, ts.ProcessTypes.UNLOCK)
-        task.update(db)
-        return task
-    except Exception as error:
-        ts.set_task_failed(task)
-        task.update(db)
-        raise error
-    
 
 @router.post('/split/range', response_model=TaskSchema)
 async def split_pdf(
-        background_tasks: BackgroundTasks,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         task: Annotated[Task, Depends(get_task)],
         user: Annotated[User, Depends(current_user_or_none)],
+        profile: Annotated[bool, Depends(profiling_requested)],
         ranges: Annotated[list[int], Query()],
-        merge_after: bool = False
+        merge_after: bool = False,
+        compression: Annotated[ZipCompression, Query(description='compression of the ZIP result')] = ZipCompression.DEFLATED
 ) -> Task:
-    background_tasks.add_task(__clear_files, db, task.pk)
-    if not task.check_ownership(user):
-        raise errors.FORBIDDEN_TASK
-    if ts.is_completed(task):
-        raise errors.COMPLETED_TASK
-    
-    try:
-        task.result = await pdf_utils.rangesplit_pdf(db, task, ranges, merge_after)
-        ts.set_task_completed(task)
-        ts.set_process(task, ts.ProcessTypes.SPLIT)
-        task.update(db)
-        return task
-    except Exception as error:
-        ts.set_task_failed(task)
-        task.update(db)
-        raise error
-    
+    params = {
+        'mode': pdf_utils.SplitMode.RANGE.value,
+        'ranges': ranges,
+        'merge': merge_after,
+        'compression': compression.value
+    }
+    return await __enqueue(db, task, user, ts.ProcessTypes.SPLIT, params, profile)
+
 
 @router.post('/split/pages', response_model=TaskSchema)
 async def extract_pages(
-        background_tasks: BackgroundTasks,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         task: Annotated[Task, Depends(get_task)],
         user: Annotated[User, Depends(current_user_or_none)],
+        profile: Annotated[bool, Depends(profiling_requested)],
         pages: Annotated[list[int], Query()],
-        merge_after: bool = False
+        merge_after: bool = False,
+        compression: Annotated[ZipCompression, Query(description='compression of the ZIP result')] = ZipCompression.DEFLATED
 ) -> Task:
-    background_tasks.add_task(__clear_files, db, task.pk)
-    if not task.check_ownership(user):
-        raise errors.FORBIDDEN_TASK
-    if ts.is_completed(task):
-        raise errors.COMPLETED_TASK
-    
-    try:
-        task.result = await pdf_utils.pagesplit_pdf(db, task, pages, merge_after)
-        ts.set_task_completed(task)
-        ts.set_process(task, ts.ProcessTypes.SPLIT)
-        task.update(db)
-        return task
-    except Exception as error:
-        ts.set_task_failed(task)
-        task.update(db)
-        raise error
\ No newline at end of file
+    params = {
+        'mode': pdf_utils.SplitMode.PAGE.value,
+        'pages': pages,
+        'merge': merge_after,
+        'compression': compression.value
+    }
+    return await __enqueue(db, task, user, ts.ProcessTypes.SPLIT, params, profile)
+
+
+@router.post('/split/size', response_model=TaskSchema)
+async def split_by_size(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        task: Annotated[Task, Depends(get_task)],
+        user: Annotated[User, Depends(current_user_or_none)],
+        profile: Annotated[bool, Depends(profiling_requested)],
+        max_size: Annotated[float, Query(gt=0, description='maximum size of each part in mb')],
+        compression: Annotated[ZipCompression, Query(description='compression of the ZIP result')] = ZipCompression.DEFLATED
+) -> Task:
+    """
+    Split a PDF file into consecutive parts, each smaller than the given size.
+    - **max_size**: Maximum size of each part in MB. A single page larger than this ends up alone in its part.
+    - **compression**: Compression of the ZIP file holding the parts.
+    """
+    params = {
+        'mode': pdf_utils.SplitMode.SIZE.value,
+        'max_size': max_size,
+        'compression': compression.value
+    }
+    return await __enqueue(db, task, user, ts.ProcessTypes.SPLIT, params, profile)
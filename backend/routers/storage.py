@@ -1,15 +1,16 @@
 from typing import Annotated, Optional
 
 from fastapi import APIRouter, Depends, status, UploadFile
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from .. import config
 from ..core import errors
 from ..core.models import User, Task, FileModel
 from ..core.schemas import FileModelSchema
 from ..core.services import storage_service as ss
 from ..core.services import tasks_service as ts
 from ..core.utils import file_utils
-from ..dependencies import current_user_or_none, get_db, file_upload, get_task, get_file_or_raise
+from ..dependencies import current_user_or_none, get_db, file_upload, files_upload, get_task_status, get_file_or_raise
 
 router = APIRouter(prefix='/files', tags=['File Storage'])
 
@@ -17,20 +18,42 @@ router = APIRouter(prefix='/files', tags=['File Storage'])
 @router.post('/', status_code=status.HTTP_201_CREATED, response_model=FileModelSchema)
 async def upload_file(
         file: Annotated[UploadFile, Depends(file_upload)],
-        session: Annotated[Session, Depends(get_db)],
-        task: Annotated[Task, Depends(get_task)],
+        session: Annotated[AsyncSession, Depends(get_db)],
+        task: Annotated[Task, Depends(get_task_status)],
         user: Annotated[Optional[User], Depends(current_user_or_none)]
 ) -> FileModel:
     if task.check_ownership(user) and not ts.is_completed(task):
         path = __get_target_path(user)
         file_model = file_utils.UploadFileModelFactory(file, task).create_filemodel()
-        strategy = ss.LocalUploadFile(file)
+        strategy = __get_strategy(file)
+        # committed along with the file row
+        await task.update(session, commit=False)
         await file_model.upload(session, strategy, upload_to=path)
-        task.update(session)
         return file_model
     raise errors.INVALID_TASK
 
 
+@router.post('/batch', status_code=status.HTTP_201_CREATED, response_model=list[FileModelSchema])
+async def upload_files(
+        files: Annotated[list[UploadFile], Depends(files_upload)],
+        session: Annotated[AsyncSession, Depends(get_db)],
+        task: Annotated[Task, Depends(get_task_status)],
+        user: Annotated[Optional[User], Depends(current_user_or_none)]
+) -> list[FileModel]:
+    """
+    Upload several files to the task in one request.
+    - **files**: Files to be added to the task, stored concurrently and saved all at once.
+      If any of them fails none is added.
+    """
+    if task.check_ownership(user) and not ts.is_completed(task):
+        path = __get_target_path(user)
+        uploads = [(file_utils.UploadFileModelFactory(file, task).create_filemodel(), __get_strategy(file)) for file in files]
+        # committed along with the file rows
+        await task.update(session, commit=False)
+        return await file_utils.upload_filemodels(session, uploads, upload_to=path)
+    raise errors.INVALID_TASK
+
+
 @router.get('/', response_model=FileModelSchema)
 async def get_file(
         filemodel: Annotated[FileModel, Depends(get_file_or_raise)]
@@ -41,10 +64,10 @@ async def get_file(
 @router.delete('/')
 async def delete_file(
         file_url: str,
-        session: Annotated[Session, Depends(get_db)],
+        session: Annotated[AsyncSession, Depends(get_db)],
         user: Annotated[User, Depends(current_user_or_none)]
 ) -> dict[str, bool]:
-    filemodel = file_utils.get_filemodel(session, file_url=file_url)
+    filemodel = await file_utils.get_filemodel(session, file_url=file_url, user=user)
     strategy = ss.LocalExistingFile(filemodel.path)  # type: ignore
 
     if not filemodel:
@@ -56,6 +79,14 @@ async def delete_file(
     raise errors.FILE_ACCESS_DENIED
 
 
+def __get_strategy(file: UploadFile) -> ss.StorageStrategy:
+    max_size = config.MAX_FILE_SIZE * 1_000_000
+
+    if config.STORAGE_BACKEND == 'content_addressed':
+        return ss.ContentAddressedFile(file, max_size=max_size)
+    return ss.LocalUploadFile(file, max_size=max_size)
+
+
 def __get_target_path(user: Optional[User]) -> str:
     if user:
         return f'{user.email}/uploads'
@@ -1,37 +1,34 @@
+import os
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, status, BackgroundTasks
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..core.models import User, Task
 from ..core.schemas import TaskSchema
+from ..core.utils import file_utils
+from ..core.services import jobs_service as js
 from ..core.services import tasks_service as ts
 from ..core.services import storage_service as ss
-from ..dependencies import current_user_or_none, get_db, get_task
+from ..dependencies import admin_or_raise, current_user_or_none, get_db, get_task, get_task_profile, get_task_result
 from ..core import errors
+from .. import config
 
 router = APIRouter(prefix='/tasks', tags=['Tasks'])
 
 
-async def __delete_result(task_id:int, db: Session):
-    task = db.query(Task).where(Task.pk == task_id).first()
-    file = task.result # type: ignore
-
-    if file:
-        await file.delete(db, ss.LocalExistingFile(file.path))
-
 @router.post('/start', response_model=TaskSchema, status_code=status.HTTP_201_CREATED)
-def start_task(
+async def start_task(
         user: Annotated[User, Depends(current_user_or_none)],
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)]
 ) -> Task:
-    task = ts.create_task(db, user=user)
+    task = await ts.create_task(db, user=user)
     return task
 
 
 @router.get('/{task_id}', response_model=TaskSchema)
-def get_task_details(
+async def get_task_details(
         user: Annotated[User, Depends(current_user_or_none)],
         task: Annotated[Task, Depends(get_task)]
 ) -> Task:
@@ -41,38 +38,85 @@ def get_task_details(
 
 
 @router.put('/cancel/{task_id}', response_model=TaskSchema)
-def cancel_task(
+async def cancel_task(
         user: Annotated[User, Depends(current_user_or_none)],
         task: Annotated[Task, Depends(get_task)],
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)]
 ) -> Task:
     if task.check_ownership(user) and not ts.is_completed(task):
         ts.set_task_canceled(task)
-        task.update(db)
+        await js.cancel_queued(db, task=task)
+        await task.update(db)
         return task
     raise errors.INVALID_TASK
 
 
 @router.get('/download/{task_id}')
 async def download(
-        background_tasks: BackgroundTasks,
-        db: Annotated[Session, Depends(get_db)],
+        request: Request,
+        db: Annotated[AsyncSession, Depends(get_db)],
         user: Annotated[User, Depends(current_user_or_none)],
-        task: Annotated[Task, Depends(get_task)],
-) -> FileResponse:
+        task: Annotated[Task, Depends(get_task_result)],
+) -> Response:
+    '''
+    Downloads the result of the task. Byte ranges (`Range`, `If-Range`) and conditional
+    requests (`If-None-Match`) are supported, the result stays available for `RESULT_RETENTION`
+    seconds after the first download so an interrupted transfer can be resumed. It is removed
+    by the sweeper, or by the first download asking for it once that time is over.
+    '''
     filemodel = task.result
 
     if not filemodel or not filemodel.absolute_path:
         raise errors.FILE_NOT_FOUND_ERROR
-    if task.check_ownership(user):
-        background_tasks.add_task(__delete_result, task.pk, db)
-        ts.set_task_dowloaded(task)
-        task.update(db)
-        return FileResponse(
-            filemodel.absolute_path,
-            filename=filemodel.full_name,
-            media_type=filemodel.content_type,
-            headers={"Content-Disposition": f"attachment; filename={filemodel.full_name}"}
-        )
-
-    raise errors.FORBIDDEN_TASK
+    if not task.check_ownership(user):
+        raise errors.FORBIDDEN_TASK
+    if ts.result_expired(task):
+        await filemodel.delete(db, ss.LocalExistingFile(filemodel.path))
+        raise errors.RESULT_EXPIRED_ERROR
+
+    stat_result = None
+
+    # results stored before their size and digest were recorded are described by a stat
+    if filemodel.size is None or filemodel.sha256 is None:
+        try:
+            stat_result = await run_in_threadpool(os.stat, filemodel.absolute_path)
+        except FileNotFoundError:
+            raise errors.FILE_NOT_FOUND_ERROR
+    # ranges and If-Range are answered by the response itself, against the same ETag
+    response = file_utils.StoredFileResponse(
+        filemodel,
+        headers={"Content-Disposition": f"attachment; filename={filemodel.full_name}"},
+        stat_result=stat_result,
+    )
+
+    if file_utils.etag_matches(request.headers.get('if-none-match'), response.headers['etag']):
+        headers = {name: value for name, value in response.headers.items() if name in ('etag', 'last-modified')}
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if task.result_expires is None:
+        ts.set_task_dowloaded(task, config.RESULT_RETENTION)
+        await task.update(db)
+    return response
+
+
+@router.get('/profile/{task_id}')
+async def download_profile(
+        admin: Annotated[User, Depends(admin_or_raise)],
+        task: Annotated[Task, Depends(get_task_profile)],
+) -> Response:
+    '''
+    Downloads the profile of the last run of the task, when it was profiled. Administrators only.
+
+    The profile is a `cProfile` .prof file, read it with `python -m pstats <file>` or any
+    viewer of them. It stays available until the task is swept.
+    '''
+    filemodel = task.profile
+
+    if not filemodel or not filemodel.absolute_path:
+        raise errors.FILE_NOT_FOUND_ERROR
+    if not await run_in_threadpool(os.path.exists, filemodel.absolute_path):
+        raise errors.FILE_NOT_FOUND_ERROR
+    return file_utils.StoredFileResponse(
+        filemodel,
+        headers={"Content-Disposition": f"attachment; filename=task-{task.pk}-{filemodel.full_name}"},
+    )
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+from datetime import timedelta
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import config
+from .core import db, errors
+from .core.models import FileModel, Job, Task
+from .core.services import jobs_service as js
+from .core.services import tasks_service as ts
+from .core.services.cache_service import result_cache
+from .core.services.execution_service import pdf_engine
+from .core.services.metrics_service import Publisher, registry
+from .core.services.profiling_service import JobProfile, profiling
+from .core.services.sweeper_service import Sweeper
+from .core.services.storage_service import LocalExistingFile, StoredFile, ZipCompression
+from .core.utils import pdf_utils
+
+logger = logging.getLogger('backend.worker')
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+JobHandler = Callable[[AsyncSession, Task, dict[str, Any]], Awaitable[FileModel]]
+
+
+async def __split(session: AsyncSession, task: Task, params: dict[str, Any]) -> FileModel:
+    compression = ZipCompression(params.get('compression', ZipCompression.DEFLATED))
+
+    if params['mode'] == pdf_utils.SplitMode.RANGE:
+        return await pdf_utils.rangesplit_pdf(session, task, params['ranges'], params['merge'], compression)
+    if params['mode'] == pdf_utils.SplitMode.SIZE:
+        return await pdf_utils.sizesplit_pdf(session, task, params['max_size'], compression)
+    return await pdf_utils.pagesplit_pdf(session, task, params['pages'], params['merge'], compression)
+
+
+__handlers: dict[int, JobHandler] = {
+    ts.ProcessTypes.MERGE.value.pk: lambda session, task, params: pdf_utils.merge_pdf(session, task, params['strict']),
+    ts.ProcessTypes.LOCK.value.pk: lambda session, task, params: pdf_utils.lock_pdf(session, task, params['password']),
+    ts.ProcessTypes.UNLOCK.value.pk: lambda session, task, params: pdf_utils.unlock_pdf(session, task, params['password']),
+    ts.ProcessTypes.SPLIT.value.pk: __split,
+}
+
+
+async def run_job(session: AsyncSession, job: Job) -> None:
+    '''
+    Runs a claimed job and moves its task to completed or failed.
+
+    Every row change of the job (the result file, the task and job statuses and the removal
+    of the inputs) is committed at once. The stored input files are removed after that
+    commit, and the result file is removed when it fails. The inputs are kept when the job
+    fails so the client can fix the parameters and run the task again. A job the PDF
+    engine had no room for goes back to the queue instead of failing.
+
+    A task cancelled while its job ran stays cancelled, the result is discarded.
+    '''
+    task = job.task
+
+    if ts.is_canceled(task):
+        js.set_job_canceled(job)
+        await session.commit()
+        return
+
+    result, inputs = None, list(task.files)
+    strategy = LocalExistingFile('')
+    profile = JobProfile() if job.params.get('profile') else None
+
+    try:
+        with profiling(profile):
+            result = await __process(session, task, job)
+        # the status read with the job is as old as the job, the row stays locked until the
+        # commit where the database supports it so a cancellation arriving now waits for it
+        await session.refresh(task, ['status_id'], with_for_update=True)
+
+        if ts.is_canceled(task):
+            await __discard(session, job, result, strategy)
+            return
+        task.result = result
+        await __save_profile(session, task, profile)
+        ts.set_task_completed(task)
+        js.set_job_completed(job)
+
+        for filemodel in inputs:
+            await filemodel.delete(session, strategy, commit=False)
+        await task.update(session)
+    except Exception as error:
+        await session.rollback()
+
+        if result:
+            await result.delete_stored(session, strategy)
+        # the rollback expired them, and expired attributes cannot be loaded on access
+        await session.refresh(job)
+        await session.refresh(task)
+
+        if error is errors.PDF_ENGINE_BUSY:
+            # nothing ran, the job waits in the queue for the engine to have room
+            logger.info('job %s of task %s requeued, the PDF engine is busy', job.pk, task.pk)
+            js.set_job_requeued(job)
+            await session.commit()
+            return
+        logger.warning('job %s of task %s failed: %r', job.pk, task.pk, error)
+        ts.set_task_failed(task)
+        js.set_job_failed(job, __describe(error))
+        await __save_profile(session, task, profile)
+        await task.update(session)
+        return
+
+    for filemodel in inputs:
+        await filemodel.delete_stored(session, strategy)
+
+
+async def __discard(session: AsyncSession, job: Job, result: FileModel, strategy: LocalExistingFile) -> None:
+    '''Drops the result of a job whose task was cancelled while it ran.'''
+    await session.rollback()
+    await result.delete_stored(session, strategy)
+    await session.refresh(job)
+    js.set_job_canceled(job)
+    await session.commit()
+    logger.info('job %s was cancelled while running, its result is discarded', job.pk)
+
+
+async def __process(session: AsyncSession, task: Task, job: Job) -> FileModel:
+    '''
+    Runs the operation of the job, reusing the result of an identical earlier run when the
+    result cache has it.
+    '''
+    process = ts.registry.process(job.process_id).name
+    # a profiled run is there to do the work, not to reuse it
+    profiled = bool(job.params.get('profile'))
+    key = None if profiled else result_cache.key(
+        [filemodel.sha256 for filemodel in task.files], process, job.params, js.SECRET_PARAMS
+    )
+    cached = result_cache.get(key, pdf_utils.get_target_path(task.user)) if key else None
+
+    if cached:
+        logger.info('job %s served from the result cache %s', job.pk, result_cache.stats())
+        path, filename, content_type = cached
+        return await pdf_utils.save_result(session, StoredFile(path), filename, content_type)
+
+    result = await __handlers[job.process_id](session, task, job.params)
+
+    if key and result.is_uploaded:
+        result_cache.put(key, result.absolute_path, result.full_name)
+    return result
+
+
+async def __save_profile(session: AsyncSession, task: Task, profile: JobProfile | None) -> None:
+    '''Writes the profile of the job and adds its row, as the profile of the task, to the session.'''
+    if not profile or not profile.calls:
+        return
+
+    stored = await run_in_threadpool(profile.write, pdf_utils.get_target_path(task.user))
+    task.profile = await pdf_utils.save_result(session, stored, 'profile.prof', 'application/octet-stream')
+
+
+async def __run(job_id: int, slots: asyncio.Semaphore) -> None:
+    try:
+        async with db.AsyncSessionLocal() as session:
+            job = await js.get_job(session, job_id=job_id)
+
+            if job:
+                await run_job(session, job)
+    except Exception:
+        logger.exception('unexpected error while running job %s', job_id)
+    finally:
+        slots.release()
+
+
+async def serve(stop: asyncio.Event) -> None:
+    '''
+    Claims and runs jobs until `stop` is set, running up to `config.JOB_CONCURRENCY` of them at once.
+    '''
+    slots = asyncio.Semaphore(config.JOB_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+
+    while not stop.is_set():
+        async with db.AsyncSessionLocal() as session:
+            await js.heartbeat(session, worker=WORKER_ID)
+            await js.requeue_stale(
+                session,
+                older_than=timedelta(seconds=config.JOB_STALE_AFTER),
+                max_attempts=config.JOB_MAX_ATTEMPTS
+            )
+
+        # a job claimed while the engine is full would only be requeued
+        while not stop.is_set() and not slots.locked() and not pdf_engine.full:
+            async with db.AsyncSessionLocal() as session:
+                job = await js.claim(session, worker=WORKER_ID)
+
+            if not job:
+                break
+            await slots.acquire()
+            logger.info('claimed job %s', job.pk)
+            runner = asyncio.create_task(__run(job.pk, slots))
+            runner.add_done_callback(running.discard)
+            running.add(runner)
+
+        try:
+            await asyncio.wait_for(stop.wait(), config.JOB_POLL_INTERVAL)
+        except TimeoutError:
+            pass
+
+    if running:
+        logger.info('waiting for %s running jobs', len(running))
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def sweep(stop: asyncio.Event) -> None:
+    '''Runs the sweeper every `config.SWEEP_INTERVAL` seconds until `stop` is set.'''
+    sweeper = Sweeper(
+        db.AsyncSessionLocal,
+        root=config.UPLOAD_DIR,
+        skip=(result_cache.directory,),
+        retention=timedelta(seconds=config.TASK_RETENTION),
+        grace=timedelta(seconds=config.SWEEP_GRACE),
+        batch_size=config.SWEEP_BATCH_SIZE,
+        batch_delay=config.SWEEP_BATCH_DELAY
+    )
+
+    while not stop.is_set():
+        try:
+            logger.info('sweep removed %s', await sweeper.sweep())
+        except Exception:
+            logger.exception('unexpected error while sweeping')
+
+        try:
+            await asyncio.wait_for(stop.wait(), config.SWEEP_INTERVAL)
+        except TimeoutError:
+            pass
+
+
+def __describe(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        return (error.headers or {}).get('X-Error', str(error.detail))
+    return repr(error)
+
+
+async def main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            pass
+
+    logger.info('worker %s started', WORKER_ID)
+    # the time of the PDF operations is only recorded here, publishing it lets /metrics report it
+    publisher = Publisher(registry, config.METRICS_DIR, config.METRICS_PUBLISH_INTERVAL)
+    publisher.start()
+    # a stop cancels the sweep in progress, the batches it already removed are committed
+    sweeper = asyncio.create_task(sweep(stop)) if config.SWEEP_INTERVAL > 0 else None
+
+    try:
+        await serve(stop)
+    finally:
+        await publisher.stop()
+
+        if sweeper:
+            sweeper.cancel()
+            await asyncio.gather(sweeper, return_exceptions=True)
+        pdf_engine.shutdown()
+        await db.async_engine.dispose()
+        logger.info('worker %s stopped', WORKER_ID)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,147 @@
+'''
+Synthetic PDF documents for the benchmarks, generated offline and deterministically.
+
+A document is described by its number of pages, how many images each page shows and how
+large they are, how many extra small objects (link annotations) each page carries and how
+its page tree is shaped, so scanned documents, text-like documents and documents with very
+large object counts can all be produced from the same generator.
+'''
+import os
+import random
+from typing import Any, Self
+
+import pypdf
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+
+
+class CorpusSpec:
+    def __init__(
+            self: Self,
+            pages: int = 50,
+            images_per_page: int = 1,
+            image_kb: int = 100,
+            objects_per_page: int = 10,
+            seed: int = 0,
+            fanout: int = 0
+    ) -> None:
+        self.pages = pages
+        self.images_per_page = images_per_page
+        self.image_kb = image_kb
+        self.objects_per_page = objects_per_page
+        self.seed = seed
+        # kids of each /Pages node, the pages all sit under the root as pypdf writes them when 0
+        self.fanout = fanout
+
+    def as_dict(self: Self) -> dict[str, Any]:
+        return dict(vars(self))
+
+
+def make_pdf(path: str, spec: CorpusSpec, seed: int = 0) -> str:
+    '''
+    Writes a document following `spec` to `path`.
+
+    Image data is random, so it does not compress, like the images of a scan. `seed` is
+    combined with the seed of the spec, documents of the same corpus differ by it.
+    '''
+    rnd = random.Random(f'{spec.seed}-{seed}')
+    writer = pypdf.PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    side = int((spec.image_kb * 1000 / 3) ** 0.5)
+
+    for number in range(spec.pages):
+        page = writer.add_blank_page(612, 792)
+        images = DictionaryObject()
+        content = []
+
+        for index in range(spec.images_per_page):
+            name = f'/Im{index}'
+            images[NameObject(name)] = writer._add_object(_make_image(rnd, side))
+            content.append(f'q 200 0 0 200 {50 + index * 10} {50 + index * 10} cm {name} Do Q')
+        content.append(f'BT /F1 12 Tf 72 720 Td (page {number + 1}) Tj ET')
+
+        contents = DecodedStreamObject()
+        contents.set_data('\n'.join(content).encode())
+        page[NameObject('/Contents')] = writer._add_object(contents)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+            NameObject('/XObject'): images,
+        })
+
+        if spec.objects_per_page:
+            page[NameObject('/Annots')] = ArrayObject(
+                writer._add_object(_make_link(rnd)) for _ in range(spec.objects_per_page)
+            )
+
+    if spec.fanout:
+        _balance(writer, spec.fanout)
+    with open(path, 'wb') as file:
+        writer.write(file)
+    return path
+
+
+def make_corpus(directory: str, spec: CorpusSpec, count: int) -> list[str]:
+    '''Writes `count` different documents following `spec` into `directory`.'''
+    os.makedirs(directory, exist_ok=True)
+    return [make_pdf(os.path.join(directory, f'input-{index}.pdf'), spec, index) for index in range(count)]
+
+
+def _balance(writer: pypdf.PdfWriter, fanout: int) -> None:
+    '''Groups the pages under intermediate /Pages nodes of `fanout` kids, level by level.'''
+    root = writer.root_object['/Pages'].get_object()
+    level = [(kid, 1) for kid in root['/Kids']]
+
+    while len(level) > fanout:
+        groups = [level[start:start + fanout] for start in range(0, len(level), fanout)]
+        level = []
+
+        for group in groups:
+            count = sum(count for _, count in group)
+            node = writer._add_object(DictionaryObject({
+                NameObject('/Type'): NameObject('/Pages'),
+                NameObject('/Kids'): ArrayObject(kid for kid, _ in group),
+                NameObject('/Count'): NumberObject(count),
+            }))
+
+            for kid, _ in group:
+                kid.get_object()[NameObject('/Parent')] = node
+            level.append((node, count))
+
+    for kid, _ in level:
+        kid.get_object()[NameObject('/Parent')] = writer.root_object.raw_get('/Pages')
+    root[NameObject('/Kids')] = ArrayObject(kid for kid, _ in level)
+
+
+def _make_image(rnd: random.Random, side: int) -> StreamObject:
+    image = StreamObject()
+    image._data = rnd.randbytes(side * side * 3)
+    image.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Image'),
+        NameObject('/Width'): NumberObject(side),
+        NameObject('/Height'): NumberObject(side),
+        NameObject('/ColorSpace'): NameObject('/DeviceRGB'),
+        NameObject('/BitsPerComponent'): NumberObject(8),
+    })
+    return image
+
+
+def _make_link(rnd: random.Random) -> DictionaryObject:
+    x, y = rnd.uniform(0, 560), rnd.uniform(0, 740)
+    return DictionaryObject({
+        NameObject('/Type'): NameObject('/Annot'),
+        NameObject('/Subtype'): NameObject('/Link'),
+        NameObject('/Rect'): ArrayObject(FloatObject(value) for value in (x, y, x + 50, y + 50)),
+        NameObject('/Border'): ArrayObject([NumberObject(0), NumberObject(0), NumberObject(0)]),
+    })
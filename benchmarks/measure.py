@@ -0,0 +1,12 @@
+import resource
+import sys
+
+
+def peak_rss(children: bool = False) -> int:
+    '''
+    Peak resident set size in bytes of this process, or of the largest of its terminated
+    child processes when `children` is set.
+    '''
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
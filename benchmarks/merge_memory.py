@@ -0,0 +1,72 @@
+'''
+Peak memory of merging a growing number of PDF files, with and without streaming.
+
+Every merge runs in a fresh process and reports its peak RSS, so the numbers of one run do
+not leak into the next. With streaming the peak should stay flat as inputs are added, while
+`pypdf.PdfWriter.append` grows with the size of the merged document.
+
+Run from the repository root:
+
+    python -m benchmarks.merge_memory --inputs 5 10 20 40 --pages 20 --image-kb 200
+'''
+import argparse
+import io
+import multiprocessing
+import os
+import tempfile
+
+import pypdf
+
+from backend.core.utils.merge_utils import StreamingPdfMerger
+from .corpus import CorpusSpec, make_corpus
+from .measure import peak_rss
+
+
+def merge(engine: str, paths: list[str], output: str) -> int:
+    '''Merges `paths` into `output` with the given engine and returns the peak RSS in bytes.'''
+    with open(output, 'wb') as file:
+        if engine == 'streaming':
+            StreamingPdfMerger(paths).write(file)
+        else:
+            writer = pypdf.PdfWriter()
+
+            for path in paths:
+                writer.append(pypdf.PdfReader(path))
+            writer.write(file)
+    return peak_rss()
+
+
+def _baseline_rss() -> int:
+    buffer = io.BytesIO()
+    pypdf.PdfWriter().write(buffer)
+    return peak_rss()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inputs', type=int, nargs='+', default=[5, 10, 20, 40])
+    parser.add_argument('--pages', type=int, default=20, help='pages per input')
+    parser.add_argument('--image-kb', type=int, default=200, help='size of the image of each page in kb')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as directory, context.Pool(1, maxtasksperchild=1) as pool:
+        spec = CorpusSpec(pages=args.pages, images_per_page=1, image_kb=args.image_kb, objects_per_page=0)
+        paths = make_corpus(directory, spec, max(args.inputs))
+
+        baseline = pool.apply(_baseline_rss)
+        print(f'interpreter and imports: {baseline / 1e6:.1f} MB peak RSS')
+        print(f'{"inputs":>6} {"input MB":>9} {"append MB":>10} {"streaming MB":>13}')
+
+        for count in args.inputs:
+            inputs = paths[:count]
+            size = sum(os.path.getsize(path) for path in inputs)
+            output = os.path.join(directory, 'merged.pdf')
+            append = pool.apply(merge, ('append', inputs, output))
+            streaming = pool.apply(merge, ('streaming', inputs, output))
+            print(f'{count:>6} {size / 1e6:>9.1f} {append / 1e6:>10.1f} {streaming / 1e6:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Time to look up a few pages of a document through `LazyPages`, against `reader.pages`.
+
+The splits and extractions read their pages from `reader.pages` before `LazyPages`, which
+flattens the whole page tree on first use. Both are timed here on a reader that has not
+read any page yet, for a flat page tree as pypdf writes it and for a balanced one, along
+with `LazyPages` over an `IndexedPdfReader` given the index of an earlier reader of the same
+document, as the PDF workers get it from their index cache. Opening the reader is timed on
+its own and left out of the lookups. Run from the repository root:
+
+    python -m benchmarks.page_lookup --pages 2000 --fanouts 0 10
+'''
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+import pypdf
+
+from backend.core.utils.page_utils import LazyPages
+from backend.core.utils.reader_utils import DocumentIndex, IndexedPdfReader
+from .corpus import CorpusSpec, make_pdf
+
+
+def _median(repeats: int, open_reader: Callable[[], pypdf.PdfReader], lookup: Callable[[pypdf.PdfReader], None]) -> float:
+    seconds = []
+
+    for _ in range(repeats):
+        reader = open_reader()
+        start = time.perf_counter()
+        lookup(reader)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def measure(data: bytes, lookups: list[int], repeats: int) -> dict[str, float]:
+    '''Median seconds of each way of getting the `lookups` pages, numbered from 1, of `data`.'''
+    def reader_pages(reader: pypdf.PdfReader) -> None:
+        for number in lookups:
+            reader.pages[number - 1]
+
+    def lazy_pages(reader: pypdf.PdfReader) -> None:
+        pages = LazyPages(reader)
+
+        for number in lookups:
+            pages[number - 1]
+
+    index: DocumentIndex = IndexedPdfReader(io.BytesIO(data)).index
+    lazy_pages(IndexedPdfReader(io.BytesIO(data), index))
+    start = time.perf_counter()
+
+    for _ in range(repeats):
+        pypdf.PdfReader(io.BytesIO(data))
+    opening = (time.perf_counter() - start) / repeats
+
+    return {
+        'open': opening,
+        'reader.pages': _median(repeats, lambda: pypdf.PdfReader(io.BytesIO(data)), reader_pages),
+        'LazyPages': _median(repeats, lambda: pypdf.PdfReader(io.BytesIO(data)), lazy_pages),
+        'LazyPages indexed': _median(repeats, lambda: IndexedPdfReader(io.BytesIO(data), index), lazy_pages),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=2000, help='pages of the document')
+    parser.add_argument('--fanouts', type=int, nargs='+', default=[0, 10], help='kids of each /Pages node, 0 for a flat tree')
+    parser.add_argument('--lookups', type=int, nargs='+', help='pages looked up, the second, middle and last by default')
+    parser.add_argument('--objects-per-page', type=int, default=10, help='extra small objects per page')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    lookups = args.lookups or [2, args.pages // 2, args.pages]
+    print(f'{"fanout":>6} {"open s":>8} {"reader.pages s":>15} {"LazyPages s":>12} {"indexed s":>10} {"speedup":>8}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for fanout in args.fanouts:
+            spec = CorpusSpec(args.pages, images_per_page=0, objects_per_page=args.objects_per_page, fanout=fanout)
+
+            with open(make_pdf(os.path.join(directory, f'fanout-{fanout}.pdf'), spec), 'rb') as file:
+                result = measure(file.read(), lookups, args.repeats)
+            print(
+                f'{fanout:>6} {result["open"]:>8.3f} {result["reader.pages"]:>15.4f} {result["LazyPages"]:>12.4f}'
+                f' {result["LazyPages indexed"]:>10.4f} {result["reader.pages"] / result["LazyPages"]:>7.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
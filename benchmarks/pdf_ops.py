@@ -0,0 +1,307 @@
+'''
+Times and memory-profiles the PDF operations of `pdf_utils` over a synthetic corpus.
+
+Every case runs in a fresh process against a throwaway SQLite database and goes through
+the same `pdf_engine` worker processes the job workers use, which are started before the
+clock does. A case reports the wall time of its repeats, the peak RSS of the process
+driving the operation and of the PDF worker processes, and the peak of the Python
+allocations traced in the driving process during one extra run. The ZIP storage cases
+run in the driving process, so their traced peak covers the whole work.
+
+Results are written as JSON. Given the results of an earlier run as baseline, every case
+is compared against it and the run fails when some case got slower or bigger than the
+tolerance allows. Run from the repository root:
+
+    python -m benchmarks.pdf_ops --output before.json
+    python -m benchmarks.pdf_ops --baseline before.json --output after.json
+'''
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+import pypdf
+
+from .corpus import CorpusSpec, make_corpus
+from .measure import peak_rss
+
+PASSWORD = 'benchmark'
+# metrics compared against the baseline, a case regresses when any of them grows too much
+COMPARED = ('seconds.median', 'peak_rss', 'workers_peak_rss', 'traced_peak')
+
+Case = Callable[[Any, dict[str, Any]], Awaitable[str]]
+
+
+async def _task(session: Any, paths: list[str]) -> Any:
+    from backend.core.models import FileModel
+    from backend.core.services import tasks_service as ts
+
+    task = await ts.create_task(session, user=None)
+
+    for path in paths:
+        name, extension = os.path.splitext(os.path.basename(path))
+        session.add(FileModel(name=name, extension=extension, path=path, content_type='application/pdf', task_id=task.pk))
+    await session.commit()
+    return await ts.get_task(session, task_id=task.pk, options=ts.JOB_LOAD)
+
+
+async def _merge(session: Any, corpus: dict[str, Any]) -> str:
+    from backend.core.utils import pdf_utils
+    return (await pdf_utils.merge_pdf(session, await _task(session, corpus['paths']), False)).absolute_path
+
+
+async def _lock(session: Any, corpus: dict[str, Any]) -> str:
+    from backend.core.utils import pdf_utils
+    return (await pdf_utils.lock_pdf(session, await _task(session, corpus['paths'][:1]), PASSWORD)).absolute_path
+
+
+async def _unlock(session: Any, corpus: dict[str, Any]) -> str:
+    from backend.core.utils import pdf_utils
+    return (await pdf_utils.unlock_pdf(session, await _task(session, [corpus['locked']]), PASSWORD)).absolute_path
+
+
+async def _rangesplit_zip(session: Any, corpus: dict[str, Any]) -> str:
+    from backend.core.utils import pdf_utils
+    task = await _task(session, corpus['paths'][:1])
+    return (await pdf_utils.rangesplit_pdf(session, task, _ranges(corpus['pages']), False)).absolute_path
+
+
+async def _rangesplit_merged(session: Any, corpus: dict[str, Any]) -> str:
+    from backend.core.utils import pdf_utils
+    task = await _task(session, corpus['paths'][:1])
+    return (await pdf_utils.rangesplit_pdf(session, task, _ranges(corpus['pages']), True)).absolute_path
+
+
+async def _pagesplit_zip(session: Any, corpus: dict[str, Any]) -> str:
+    from backend.core.utils import pdf_utils
+    task = await _task(session, corpus['paths'][:1])
+    pages = list(range(1, corpus['pages'] + 1))
+    return (await pdf_utils.pagesplit_pdf(session, task, pages, False)).absolute_path
+
+
+async def _pagesplit_few(session: Any, corpus: dict[str, Any]) -> str:
+    # a handful of pages out of the whole document, its time should not follow the page count
+    from backend.core.utils import pdf_utils
+    task = await _task(session, corpus['paths'][:1])
+    pages = [2, corpus['pages'] // 2, corpus['pages']]
+    return (await pdf_utils.pagesplit_pdf(session, task, pages, True)).absolute_path
+
+
+def _zip_storage(compression: str) -> Case:
+    async def case(session: Any, corpus: dict[str, Any]) -> str:
+        from backend.core.services.storage_service import LocalPDFZipFile, ZipCompression
+
+        def writers():
+            reader = pypdf.PdfReader(corpus['paths'][0])
+
+            for index, page in enumerate(reader.pages):
+                writer = pypdf.PdfWriter()
+                writer.add_page(page)
+                yield (f'page-[{index+1}].pdf', writer)
+
+        storage = LocalPDFZipFile(writers(), 'benchmark.zip', ZipCompression(compression))
+        return storage.write('benchmarks')
+    return case
+
+
+def _ranges(pages: int) -> list[int]:
+    # consecutive ranges of ten pages
+    return [bound for start in range(1, pages + 1, 10) for bound in (start, min(start + 9, pages))]
+
+
+CASES: dict[str, Case] = {
+    'merge_pdf': _merge,
+    'lock_pdf': _lock,
+    'unlock_pdf': _unlock,
+    'rangesplit_pdf_zip': _rangesplit_zip,
+    'rangesplit_pdf_merged': _rangesplit_merged,
+    'pagesplit_pdf_zip': _pagesplit_zip,
+    'pagesplit_pdf_few': _pagesplit_few,
+    'zip_storage_deflated': _zip_storage('deflated'),
+    'zip_storage_stored': _zip_storage('stored'),
+}
+
+
+def run_case(name: str, corpus: dict[str, Any], repeats: int) -> dict[str, Any]:
+    '''Runs a case in the current process, which should not have run anything else.'''
+    from backend.core import db
+    from backend.core.services import tasks_service as ts
+
+    db.Base.metadata.create_all(bind=db.engine)
+    with db.SessionLocal() as session:
+        ts.init_service(session)
+    return asyncio.run(_measure(CASES[name], corpus, repeats))
+
+
+async def _measure(case: Case, corpus: dict[str, Any], repeats: int) -> dict[str, Any]:
+    from backend.core import db
+    from backend.core.services.execution_service import pdf_engine
+
+    # start every worker process up front, spawning them is not part of the operation
+    await asyncio.gather(*(pdf_engine.submit(time.sleep, 0.2) for _ in range(pdf_engine.max_workers)))
+    seconds = []
+
+    for _ in range(repeats):
+        async with db.AsyncSessionLocal() as session:
+            start = time.perf_counter()
+            result = await case(session, corpus)
+            seconds.append(time.perf_counter() - start)
+        os.remove(result)
+
+    # tracing slows allocations down, so it gets a run of its own
+    tracemalloc.start()
+    async with db.AsyncSessionLocal() as session:
+        os.remove(await case(session, corpus))
+    _, traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pdf_engine.shutdown(wait=True)
+    await db.async_engine.dispose()
+    return {
+        'seconds': {
+            'min': min(seconds),
+            'median': statistics.median(seconds),
+            'max': max(seconds),
+        },
+        'peak_rss': peak_rss(),
+        'workers_peak_rss': peak_rss(children=True),
+        'traced_peak': traced,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> dict[str, Any]:
+    '''
+    Compares every case with the same case of the baseline.
+
+    Returns:
+        dict[str, Any]: For every case, the ratio of each compared metric to its baseline value
+            and whether any ratio is above `1 + tolerance`.
+    '''
+    comparison = {}
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratios = {}
+
+        for metric in COMPARED:
+            current, previous = _metric(result, metric), _metric(baseline[name], metric)
+
+            if previous:
+                ratios[metric] = current / previous
+
+        comparison[name] = {
+            'ratios': ratios,
+            'regression': any(ratio > 1 + tolerance for ratio in ratios.values()),
+        }
+    return comparison
+
+
+def _metric(result: dict[str, Any], metric: str) -> float:
+    value: Any = result
+
+    for key in metric.split('.'):
+        value = value[key]
+    return value
+
+
+def _environment() -> dict[str, Any]:
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pypdf': pypdf.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _report(results: dict[str, Any], comparison: dict[str, Any]) -> None:
+    print(f'{"case":<24} {"median s":>9} {"driver MB":>10} {"workers MB":>11} {"traced MB":>10}', file=sys.stderr)
+
+    for name, result in results.items():
+        line = (
+            f'{name:<24} {result["seconds"]["median"]:>9.3f} {result["peak_rss"] / 1e6:>10.1f}'
+            f' {result["workers_peak_rss"] / 1e6:>11.1f} {result["traced_peak"] / 1e6:>10.1f}'
+        )
+        if name in comparison:
+            ratios = ', '.join(f'{metric} x{ratio:.2f}' for metric, ratio in comparison[name]['ratios'].items())
+            line += f'  [{ratios}]' + ('  REGRESSION' if comparison[name]['regression'] else '')
+        print(line, file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--pages', type=int, default=50, help='pages per document')
+    parser.add_argument('--images-per-page', type=int, default=1)
+    parser.add_argument('--image-kb', type=int, default=100, help='size of each image in kb')
+    parser.add_argument('--objects-per-page', type=int, default=10, help='extra small objects per page')
+    parser.add_argument('--fanout', type=int, default=0, help='kids of each /Pages node, 0 for a flat page tree')
+    parser.add_argument('--inputs', type=int, default=4, help='documents merged by merge_pdf')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='PDF worker processes')
+    parser.add_argument('--output', help='file for the JSON results, printed when missing')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed growth before a regression')
+    args = parser.parse_args()
+
+    spec = CorpusSpec(args.pages, args.images_per_page, args.image_kb, args.objects_per_page, args.seed, args.fanout)
+    results: dict[str, Any] = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        # the case processes inherit these, they must be set before backend is imported
+        os.environ['C_STR'] = f'sqlite:///{os.path.join(directory, "benchmark.db")}'
+        os.environ['PDF_WORKERS'] = str(args.workers)
+
+        paths = make_corpus(os.path.join(directory, 'corpus'), spec, max(2, args.inputs))
+        locked = os.path.join(directory, 'locked.pdf')
+        writer = pypdf.PdfWriter(clone_from=paths[0])
+        writer.encrypt(PASSWORD, None, True)
+        writer.write(locked)
+        corpus = {'paths': paths[:max(2, args.inputs)], 'locked': locked, 'pages': args.pages}
+
+        # a fresh process per case, that can start the PDF worker processes of its own
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(1, mp_context=context, max_tasks_per_child=1) as executor:
+            for name in args.cases:
+                print(f'running {name}', file=sys.stderr)
+                results[name] = executor.submit(run_case, name, corpus, args.repeats).result()
+
+    comparison = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            comparison = compare(results, json.load(file)['results'], args.tolerance)
+
+    output = {
+        'environment': _environment(),
+        'corpus': spec.as_dict() | {'inputs': args.inputs},
+        'workers': args.workers,
+        'repeats': args.repeats,
+        'results': results,
+        'comparison': comparison,
+    }
+    _report(results, comparison)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if any(case['regression'] for case in comparison.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
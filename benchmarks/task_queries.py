@@ -0,0 +1,44 @@
+'''
+Number of SQL statements each task endpoint runs, against the budgets of
+`tests/test_task_queries.py` which enforces them. This runs the same requests against a
+throwaway SQLite database and prints the count of each endpoint, with its statements when it
+goes over its budget or with `--verbose`. Run from the repository root:
+
+    python -m benchmarks.task_queries
+'''
+import argparse
+import os
+import sys
+import tempfile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--verbose', action='store_true', help='print the statements of every endpoint')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # must be set before backend is imported
+        os.environ['C_STR'] = f'sqlite:///{os.path.join(directory, "queries.db")}'
+        from tests.test_task_queries import BUDGETS, run
+
+        results = run(directory)
+
+    exceeded = False
+    print(f'{"endpoint":<32} {"queries":>7} {"budget":>6}')
+
+    for endpoint, statements in results.items():
+        over = len(statements) > BUDGETS[endpoint]
+        exceeded = exceeded or over
+        print(f'{endpoint:<32} {len(statements):>7} {BUDGETS[endpoint]:>6}' + ('  OVER BUDGET' if over else ''))
+
+        if args.verbose or over:
+            for statement in statements:
+                print('    ' + ' '.join(statement.split())[:150])
+
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# the backend reads its settings when it is first imported, the tests always run against a
+# throwaway database whatever the environment or the .env file point to
+_directory = tempfile.mkdtemp(prefix='pypdf-api-tests-')
+os.environ['C_STR'] = f'sqlite:///{os.path.join(_directory, "tests.db")}'
+os.environ.setdefault('T_KEY', 'tests')
+os.environ.setdefault('E_ALGORITHM', 'HS256')
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus: int) -> None:
+    shutil.rmtree(_directory, ignore_errors=True)
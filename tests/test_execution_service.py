@@ -0,0 +1,56 @@
+import asyncio
+import time
+from typing import Iterator
+
+import pytest
+from fastapi import HTTPException
+
+from backend.core import errors
+from backend.core.services.execution_service import PdfExecutionEngine
+
+WORKERS = 4
+PARTS = 3 * WORKERS
+
+
+def _square(value: int) -> int:
+    time.sleep(0.02)
+    return value * value
+
+
+@pytest.fixture
+def engine() -> Iterator[PdfExecutionEngine]:
+    # as many jobs at once as `backend.worker` runs by default, JOB_CONCURRENCY = PDF_WORKERS,
+    # with no room left in the queue
+    engine = PdfExecutionEngine(WORKERS, 0, 30)
+    yield engine
+    engine.shutdown(wait=True)
+
+
+async def _collect(engine: PdfExecutionEngine, job: int) -> list[int]:
+    return [result async for result in engine.map(_square, [(job * PARTS + part,) for part in range(PARTS)])]
+
+
+def test_parallel_maps_are_admitted_once_each(engine: PdfExecutionEngine) -> None:
+    async def run() -> list[list[int]]:
+        return await asyncio.gather(*(_collect(engine, job) for job in range(WORKERS)))
+
+    results = asyncio.run(run())
+
+    assert results == [[value * value for value in range(job * PARTS, (job + 1) * PARTS)] for job in range(WORKERS)]
+    assert engine.pending == 0
+
+
+def test_a_job_beyond_the_queue_is_rejected(engine: PdfExecutionEngine) -> None:
+    async def run() -> None:
+        maps = [asyncio.create_task(_collect(engine, job)) for job in range(WORKERS)]
+        # let every map start and take its place
+        while engine.pending < WORKERS:
+            await asyncio.sleep(0.01)
+
+        with pytest.raises(HTTPException) as rejected:
+            await engine.submit(_square, 2)
+        assert rejected.value is errors.PDF_ENGINE_BUSY
+        await asyncio.gather(*maps)
+
+    asyncio.run(run())
+    assert engine.pending == 0
@@ -0,0 +1,82 @@
+import io
+from typing import Optional
+
+import pypdf
+import pytest
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+
+from backend.core.utils.page_utils import LazyPages
+from backend.core.utils.reader_utils import IndexedPdfReader
+
+WIDTHS = [100, 101, 102]
+
+
+@pytest.fixture(scope='module')
+def shifted_tree() -> bytes:
+    return _shifted_tree()
+
+
+def _shifted_tree(inner_count: Optional[int] = None) -> bytes:
+    '''
+    Three pages under a root whose kids are an empty /Pages node, a page and a /Pages node
+    with the two others: the /Count of the root is the number of its kids, yet its second
+    kid is the first page. `inner_count` replaces the /Count of the inner node.
+    '''
+    writer = pypdf.PdfWriter()
+
+    for width in WIDTHS:
+        writer.add_blank_page(width, 200)
+
+    root = writer.root_object['/Pages'].get_object()
+    root_reference = writer.root_object.raw_get('/Pages')
+    pages = list(root['/Kids'])
+    empty = writer._add_object(_pages_node([], root_reference))
+    inner = writer._add_object(_pages_node(pages[1:], root_reference))
+
+    if inner_count is not None:
+        inner.get_object()[NameObject('/Count')] = NumberObject(inner_count)
+
+    for page in pages[1:]:
+        page.get_object()[NameObject('/Parent')] = inner
+    root[NameObject('/Kids')] = ArrayObject([empty, pages[0], inner])
+
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _pages_node(kids: list, parent) -> DictionaryObject:
+    return DictionaryObject({
+        NameObject('/Type'): NameObject('/Pages'),
+        NameObject('/Kids'): ArrayObject(kids),
+        NameObject('/Count'): NumberObject(len(kids)),
+        NameObject('/Parent'): parent,
+    })
+
+
+def _widths(pages) -> list[float]:
+    return [float(page.mediabox.width) for page in pages]
+
+
+def test_pages_follow_the_counts_of_the_kids(shifted_tree: bytes) -> None:
+    pages = LazyPages(pypdf.PdfReader(io.BytesIO(shifted_tree)))
+
+    assert len(pages) == len(WIDTHS)
+    assert _widths(pages[index] for index in (1, 2, 0)) == [101, 102, 100]
+    assert _widths(pages) == WIDTHS
+
+
+def test_pages_from_the_index_of_an_earlier_reader(shifted_tree: bytes) -> None:
+    first = IndexedPdfReader(io.BytesIO(shifted_tree))
+    assert float(LazyPages(first)[2].mediabox.width) == 102
+
+    # the counts of the root are known from the first reader, the page under it is not
+    second = IndexedPdfReader(io.BytesIO(shifted_tree), first.index)
+    assert _widths(LazyPages(second)[index] for index in (1, 2, 0)) == [101, 102, 100]
+
+
+def test_pages_of_a_node_with_a_wrong_count() -> None:
+    # the inner node claims one page where it holds two, the root no longer adds up
+    pages = LazyPages(pypdf.PdfReader(io.BytesIO(_shifted_tree(inner_count=1))))
+
+    assert _widths(pages[index] for index in (2, 0, 1)) == [102, 100, 101]
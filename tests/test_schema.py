@@ -0,0 +1,85 @@
+'''
+Upgrade of a database created before the columns, indexes and tables added to the models.
+'''
+import os
+
+import pytest
+from sqlalchemy import create_engine, exc, inspect, text
+
+# the tables as the first version created them, the ones that did not change are left to
+# `create_all`
+EARLIER_SCHEMA = (
+    '''
+    CREATE TABLE files (
+        file_id INTEGER NOT NULL PRIMARY KEY,
+        name VARCHAR(250) NOT NULL,
+        extension VARCHAR(100) NOT NULL,
+        path VARCHAR(500) NOT NULL,
+        content_type VARCHAR(100) NOT NULL,
+        created DATETIME NOT NULL,
+        updated DATETIME NOT NULL,
+        task_id INTEGER REFERENCES tasks (task_id) ON DELETE RESTRICT
+    )
+    ''',
+    'CREATE INDEX idx_files_name ON files (name, extension)',
+    'CREATE UNIQUE INDEX idx_files_path ON files (path)',
+    '''
+    CREATE TABLE tasks (
+        task_id INTEGER NOT NULL PRIMARY KEY,
+        created DATETIME NOT NULL,
+        updated DATETIME NOT NULL,
+        process_id INTEGER NOT NULL REFERENCES task_process_type (process_id) ON DELETE RESTRICT,
+        status_id INTEGER NOT NULL REFERENCES task_status (status_id) ON DELETE RESTRICT,
+        user_id INTEGER REFERENCES users (user_id) ON DELETE CASCADE,
+        result_id INTEGER UNIQUE REFERENCES files (file_id) ON DELETE SET NULL
+    )
+    ''',
+    "INSERT INTO tasks VALUES (1, '2024-1-1', '2024-1-1', 1, 1, NULL, NULL)",
+)
+
+
+def _file(path: str) -> str:
+    return (
+        'INSERT INTO files (name, extension, path, content_type, created, updated) '
+        f"VALUES ('a', '.pdf', '{path}', 'application/pdf', '2024-1-1', '2024-1-1')"
+    )
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{os.path.join(tmp_path, "earlier.db")}')
+
+    with engine.begin() as conn:
+        for statement in EARLIER_SCHEMA:
+            conn.exec_driver_sql(statement)
+    yield engine
+    engine.dispose()
+
+
+def test_upgrade_adds_what_the_models_added(engine) -> None:
+    from backend.core import db, models  # noqa: F401, the models register their tables
+
+    db.upgrade_schema(engine)
+    inspector = inspect(engine)
+
+    assert {'size', 'sha256'} <= {column['name'] for column in inspector.get_columns('files')}
+    assert {'result_expires', 'profile_id'} <= {column['name'] for column in inspector.get_columns('tasks')}
+    assert 'jobs' in inspector.get_table_names()
+    indexes = {index['name']: bool(index['unique']) for index in inspector.get_indexes('files')}
+    assert indexes['idx_files_path'] is False
+    assert 'idx_files_sha256' in indexes
+
+    with engine.begin() as conn:
+        # content-addressed storage points several rows to the same blob
+        conn.exec_driver_sql(_file('blobs/ab/abcd'))
+        conn.exec_driver_sql(_file('blobs/ab/abcd'))
+        conn.execute(text('UPDATE tasks SET profile_id = 1, result_expires = CURRENT_TIMESTAMP'))
+    with pytest.raises(exc.IntegrityError), engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO tasks (task_id, created, updated, process_id, status_id, profile_id) "
+            "VALUES (2, '2024-1-1', '2024-1-1', 1, 1, 1)"
+        ))
+
+    # nothing is left to do on the next start
+    db.upgrade_schema(engine)
+    assert inspect(engine).get_indexes('files') == inspector.get_indexes('files')
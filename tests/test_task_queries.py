@@ -0,0 +1,126 @@
+'''
+Number of SQL statements each task endpoint runs, checked against a budget per endpoint.
+
+The task relationships are never loaded implicitly, every route asks for the ones it uses
+with the loader profiles of `tasks_service`. This goes through the endpoints against the
+throwaway database of the tests, counts the statements of each request and fails when some
+endpoint runs more of them than its budget, which is how an extra lazy load or a profile
+that stopped covering a route shows up. `python -m benchmarks.task_queries` prints the same
+counts with the statements themselves.
+'''
+import io
+import os
+from contextlib import contextmanager
+from typing import Any, Iterator, Self
+
+import pypdf
+import pytest
+
+# statements each request may run, the current user comes from the user cache after the
+# first authenticated request
+BUDGETS = {
+    'POST /tasks/start': 2,
+    'POST /files/': 3,
+    'GET /files/': 1,
+    'GET /tasks/{task_id}': 1,
+    'POST /pdf-utilities/merge': 4,
+    # the task and a job still queued for it are cancelled together
+    'PUT /tasks/cancel/{task_id}': 3,
+    'GET /tasks/download/{task_id}': 2,
+    'GET /accounts/users/current': 2,
+}
+
+
+class StatementCounter:
+    def __init__(self: Self) -> None:
+        self.statements: list[str] = []
+
+    def __call__(self: Self, conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        self.statements.append(statement)
+
+    @contextmanager
+    def count(self: Self, results: dict[str, list[str]], endpoint: str) -> Iterator[None]:
+        self.statements = []
+        yield
+        results[endpoint] = list(self.statements)
+
+
+def _pdf() -> bytes:
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(200, 200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def run(directory: str) -> dict[str, list[str]]:
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    from backend.core import db
+    from backend.core.models import FileModel, Task
+    from backend.core.services import tasks_service as ts
+    from backend.main import app
+
+    counter = StatementCounter()
+    event.listen(db.async_engine.sync_engine, 'before_cursor_execute', counter)
+    results: dict[str, list[str]] = {}
+    created: list[str] = []
+
+    with TestClient(app) as client:
+        client.post('/accounts/authenticate/sign-up', json={
+            'first_name': 'Query', 'last_name': 'Count', 'email': 'queries@example.com', 'password': 'benchmark'
+        })
+        token = client.post(
+            '/accounts/authenticate/sign-in', data={'username': 'queries@example.com', 'password': 'benchmark'}
+        ).json()['access_token']
+        client.headers['Authorization'] = f'Bearer {token}'
+
+        with counter.count(results, 'POST /tasks/start'):
+            task_id = client.post('/tasks/start').json()['pk']
+        for index in range(2):
+            with counter.count(results, 'POST /files/'):
+                upload = client.post(
+                    '/files/', params={'task_id': task_id}, files={'file': (f'{index}.pdf', _pdf(), 'application/pdf')}
+                ).json()
+            created.append(upload['path'])
+        with counter.count(results, 'GET /files/'):
+            client.get('/files/', params={'path': created[0]})
+        with counter.count(results, 'GET /tasks/{task_id}'):
+            client.get(f'/tasks/{task_id}')
+        with counter.count(results, 'POST /pdf-utilities/merge'):
+            client.post('/pdf-utilities/merge', params={'task_id': task_id})
+        with counter.count(results, 'PUT /tasks/cancel/{task_id}'):
+            client.put(f'/tasks/cancel/{task_id}')
+
+        # a completed task, as a job worker would leave it
+        path = os.path.join(directory, 'result.pdf')
+        with open(path, 'wb') as file:
+            file.write(_pdf())
+        with db.SessionLocal() as session:
+            result = FileModel(name='result', extension='.pdf', path=path, content_type='application/pdf')
+            task = session.get(Task, client.post('/tasks/start').json()['pk'])
+            task.result = result  # type: ignore
+            ts.set_task_completed(task)  # type: ignore
+            session.commit()
+            done_id = task.pk  # type: ignore
+        with counter.count(results, 'GET /tasks/download/{task_id}'):
+            client.get(f'/tasks/download/{done_id}')
+        with counter.count(results, 'GET /accounts/users/current'):
+            client.get('/accounts/users/current')
+
+    for path in created:
+        if os.path.exists(path):
+            os.remove(path)
+    return results
+
+
+@pytest.fixture(scope='module')
+def statements(tmp_path_factory: pytest.TempPathFactory) -> dict[str, list[str]]:
+    return run(str(tmp_path_factory.mktemp('queries')))
+
+
+@pytest.mark.parametrize('endpoint', BUDGETS)
+def test_query_budget(statements: dict[str, list[str]], endpoint: str) -> None:
+    executed = statements[endpoint]
+    assert len(executed) <= BUDGETS[endpoint], '\n'.join(' '.join(statement.split()) for statement in executed)